@@ -1,9 +1,24 @@
-import logging
+import array
+import contextlib
+import itertools
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
 import numpy as np
-from numpy.core._multiarray_umath import bitwise_or
 from _socket import close
 
-def MAFIA_on_encoded_collection(encoded_transactions, transaction_encoder, min_support_ratio):
+from MaxMiner.bitsetUtils import (WORD_BITS, DepthBuffers, ProjectedBitmaps, bitmap_to_tids, full_bitmap, gather_bitmaps, 
+    number_of_words, pack_coordinates, pack_encoded_columns, pack_weight_planes, popcount, project_bitmaps, project_support_counter, support_counter)
+from MaxMiner.fpTree import FPTree
+from MaxMiner.itemsetIndex import MaximalItemsetIndex
+from MaxMiner.rules import ClosureIndex
+from MaxMiner.searchStatistics import SearchStatistics
+from MaxMiner.parallelUtils import SharedArray, attach_shared_array, resolve_n_jobs
+from MaxMiner.transactionalUtils import PackedEncodedTransactions, SparseEncodedTransactions, minimum_support_count, unpack_encoded_transactions
+
+def MAFIA_on_encoded_collection(encoded_transactions, transaction_encoder, min_support_ratio,
+    parent_equivalence_pruning: bool=True, dynamic_reordering: bool=True, search_statistics: SearchStatistics=None,
+    n_jobs: int=1, transaction_weights=None, return_statistics: bool=False, required_items=(), excluded_items=(), 
+    min_length: int=1, max_length: int=None):
     '''
         Returns the Maximal Frequent Itemsets in a vertically encoded transaction database
         based on a provided minimum support ratio and the MAFIA algorithm.
@@ -14,330 +29,1410 @@ def MAFIA_on_encoded_collection(encoded_transactions, transaction_encoder, min_s
         Accepts a Transaction Encoded ("vertical binary representation" according to the MAFIA
         paper) dataset, the encoder used to create it (which provides the original values for
         de-encoding) and the minimum support ratio
+        
+        Internally every column is packed into a bitmap of 64 bit words, so the support of a
+        node is popcount(AND(head_bitmap, item_bitmap)) and each child bitmap is a single AND
+        
+        The dataset may also be a SparseEncodedTransactions (see the encoders' sparse option). Its frequent items are
+        packed from their tid-lists when full length bitmaps take no more memory than the tid-lists themselves, 
+        otherwise each root is mined as a projected subproblem whose bitmaps only cover the transactions containing 
+        the root (see _MAFIA_sparse_subproblem), so memory follows the number of item occurrences
+        
+        parent_equivalence_pruning moves tail items with the same support as the head into the head
+        instead of branching on them, dynamic_reordering sorts the roots and every tail by increasing 
+        support. An optional SearchStatistics object receives the per-run counts of both, along with the nodes visited,
+        supports counted, subset checks, the deepest head and the time spent preparing and searching. return_statistics 
+        returns (maximal itemsets, SearchStatistics) rather than the itemsets alone.
+        
+        n_jobs > 1 (or -1 for every core) mines the first-level subtrees (or the projected roots) in a process 
+        pool, see _MAFIA_parallel_search
+        
+        transaction_weights accepts the duplicate counts of a collapsed dataset (see collapse_duplicate_transactions),
+        each row then counts its weight towards support and the ratio is taken over the sum of the weights
+        
+        The search can be limited to the itemsets containing every one of required_items, none of excluded_items 
+        (both given as values) and between min_length and max_length items, the result is then the maximal itemsets of
+        that constrained space. Excluded items never enter a tail, the required items form the head of a single root 
+        whose tail is every other frequent item, subtrees which cannot reach min_length are dropped and heads of 
+        max_length items are not extended. Within max_length a frequent itemset of exactly max_length items is maximal,
+        and Parent Equivalence Pruning is only applied where the head and tail fit in max_length.
     '''
-    #Generate intitial list of candidates from encoder keys
-    #Note that these will already be filtered by min support during encoding phase
-    root_candidates = transaction_encoder.value_encoder_mapping.values()
-
-    total_transaction_count = encoded_transactions.shape[0]
+    _check_length_bounds(min_length, max_length)
+    if search_statistics is None:
+        search_statistics = SearchStatistics()
+    n_jobs = resolve_n_jobs(n_jobs)
+    with search_statistics.timed_phase('preparation'):
+        number_of_transactions, number_of_items = encoded_transactions.shape
+        sparse_input = isinstance(encoded_transactions, SparseEncodedTransactions)
     
-    #Frequent itemsets that do not have any frequent supersets
-    maximal_frequent_itemsets = set()
+        if transaction_weights is None:
+            total_transaction_count = number_of_transactions
+        else:
+            total_transaction_count = int(np.sum(transaction_weights))
+        min_support_count = minimum_support_count(min_support_ratio, total_transaction_count)
     
-    #Evaluated itemsets which are found to be frequent or infrequent but not maximal
-    frequent_item_sets = set()
-    infrequent_item_sets = set()
+        if sparse_input:
+            item_supports = encoded_transactions.item_supports(transaction_weights)
+        else:
+            #Convert the transaction encoded columns into packed vertical bitmaps (items x words)
+            item_bitmaps = _packed_item_bitmaps(encoded_transactions)
+            item_supports = support_counter(None if transaction_weights is None else pack_weight_planes(transaction_weights))(item_bitmaps)
 
-    print(encoded_transactions)
+        #Generate intitial list of candidates from encoder keys
+        #Note that these will already be filtered by min support during encoding phase
+        root_candidates = np.array(sorted(transaction_encoder.value_encoder_mapping.values()), dtype=np.intp)
+        root_candidates = root_candidates[item_supports[root_candidates] >= min_support_count]
+        
+        #Constrained searches leave the excluded items out of every tail, the required ones seed the head instead
+        required_columns = _constraint_columns(transaction_encoder, required_items)
+        if required_columns is None:
+            root_candidates = root_candidates[:0]
+        else:
+            root_candidates = root_candidates[~np.isin(root_candidates, required_columns + _constraint_columns(transaction_encoder, 
+                excluded_items, missing_ok=True))]
+    
+        #Order the roots by increasing support, so the least frequent items head the leftmost (and largest) subtrees
+        if dynamic_reordering:
+            root_candidates = root_candidates[np.argsort(item_supports[root_candidates], kind='stable')]
+    
+        #Sparse input switches to full length bitmaps of the frequent items only when they pay for themselves
+        project_roots = sparse_input and not _MAFIA_full_bitmaps_fit(encoded_transactions, root_candidates)
+        if sparse_input and not project_roots:
+            item_bitmaps = _pack_sparse_item_bitmaps(encoded_transactions, np.union1d(root_candidates, required_columns or []).astype(np.intp))
+    
+        #Weighted rows are counted through bit planes of their weights, keeping support an AND + popcount
+        weight_planes = None
+        if transaction_weights is not None and not project_roots:
+            weight_planes = pack_weight_planes(transaction_weights)
+        count_support = support_counter(weight_planes)
+    
+    with search_statistics.timed_phase('search'):
+        #Frequent itemsets that do not have any frequent supersets, indexed for superset checks
+        maximal_itemset_index = MaximalItemsetIndex(number_of_items)
+    
+        #Each root is (head items, head support, tail items), the tail of a root being every root after it so each itemset 
+        #is enumerated exactly once. Required items make up the head of the only root, whose tail is every candidate.
+        if required_columns:
+            if sparse_input:
+                required_support = int(encoded_transactions.itemset_supports([tuple(required_columns)], transaction_weights)[0])
+            else:
+                required_support = int(count_support(np.bitwise_and.reduce(item_bitmaps[required_columns], axis=0)))
+            search_roots = [(required_columns, required_support, root_candidates)] if required_support >= min_support_count and \
+                (max_length is None or len(required_columns) <= max_length) else []
+        else:
+            search_roots = [([root_item], int(item_supports[root_item]), root_candidates[root_index + 1:]) 
+                for root_index, root_item in enumerate(root_candidates.tolist())]
+        
+        #With a pool the roots are only expanded one level here and their children collected as tasks,
+        #projected roots are handed over whole since the worker builds the projection
+        subtree_tasks = [] if n_jobs > 1 else None
+        if project_roots and subtree_tasks is not None:
+            subtree_tasks.extend(search_roots)
+        else:
+            root_subproblem = None
+            if subtree_tasks is None:
+                root_subproblem = _MAFIARootProjector(encoded_transactions, transaction_weights, min_support_count, project_roots,
+                    np.sum(item_supports[root_candidates]) / max(total_transaction_count, 1), search_statistics)
+            maximal_itemsets = MAFIA_on_bitmaps(None if project_roots else item_bitmaps, item_supports, min_support_count,
+                parent_equivalence_pruning=parent_equivalence_pruning, dynamic_reordering=dynamic_reordering,
+                search_statistics=search_statistics, count_support=count_support, min_length=min_length, max_length=max_length,
+                search_roots=search_roots, root_subproblem=root_subproblem, maximal_itemset_index=maximal_itemset_index,
+                subtree_tasks=subtree_tasks)
+    
+        if subtree_tasks is not None:
+            if project_roots:
+                shared_arrays = dict(zip(('indptr', 'indices', 'item_indptr', 'item_tids'), 
+                    (encoded_transactions.indptr, encoded_transactions.indices) + encoded_transactions.item_tidlists()))
+                if transaction_weights is not None:
+                    shared_arrays['transaction_weights'] = np.asarray(transaction_weights, dtype=np.int64)
+            elif sparse_input:
+                shared_arrays = {'item_bitmaps': item_bitmaps.bitmaps, 'bitmap_items': item_bitmaps.items}
+            else:
+                shared_arrays = {'item_bitmaps': item_bitmaps}
+            worker_settings = dict(number_of_items=number_of_items, min_support_count=min_support_count, weight_planes=weight_planes,
+                parent_equivalence_pruning=parent_equivalence_pruning, dynamic_reordering=dynamic_reordering, min_length=min_length,
+                max_length=max_length)
+            
+            maximal_itemsets = _MAFIA_parallel_search(subtree_tasks, shared_arrays, worker_settings, maximal_itemset_index, 
+                search_statistics, n_jobs)
+    
+    if return_statistics:
+        return (maximal_itemsets, search_statistics)
+    return maximal_itemsets
 
-    #Iterate through the first level candidates represented as column numbers
-    for root_item in root_candidates:
+def MAFIA_on_bitmaps(item_bitmaps, item_supports, min_support_count: int, root_candidates=None,
+    parent_equivalence_pruning: bool=True, dynamic_reordering: bool=True, search_statistics: SearchStatistics=None,
+    count_support=popcount, min_length: int=1, max_length: int=None, search_roots: list=None, root_subproblem=None,
+    maximal_itemset_index: MaximalItemsetIndex=None, subtree_tasks: list=None) -> set:
+    '''
+        Returns the Maximal Frequent Itemsets of prepared packed item bitmaps, as the set of sorted column number
+        tuples of MAFIA_on_encoded_collection, whose MAFIA search this is without the encoding and packing
         
-        frequent_item_sets.add(root_item)
+        item_bitmaps holds one packed bitmap per column (items x words, or a ProjectedBitmaps) and item_supports the
+        support of every column, count_support is the popcount of the bitmaps (see support_counter for weighted rows).
+        Callers which maintain their own bitmaps (ex. SlidingWindowMiner) search them as they are.
+        
+        root_candidates are the columns an itemset may hold, by default every column of at least min_support_count,
+        ordered by increasing support when dynamic_reordering. Each one is a root whose tail is every candidate after
+        it, unless search_roots gives the (head items, head support, tail items) of the roots instead.
+        
+        root_subproblem is called with the (head items, head support, tail items) of every root and may return the
+        (tail items, head bitmap, item bitmaps, count_support) of a subproblem to search that root in (ex. bitmaps 
+        projected onto the root's transactions), or None to search the full bitmaps. maximal_itemset_index and 
+        subtree_tasks (see _MAFIA_candidate_assessor) let MAFIA_on_encoded_collection keep the index and hand the
+        first level subtrees to a pool, the other arguments are those of MAFIA_on_encoded_collection.
+    '''
+    _check_length_bounds(min_length, max_length)
+    if search_statistics is None:
+        search_statistics = SearchStatistics()
+    item_supports = np.asarray(item_supports)
+    if maximal_itemset_index is None:
+        maximal_itemset_index = MaximalItemsetIndex(len(item_supports))
+    
+    if search_roots is None:
+        if root_candidates is None:
+            root_candidates = np.flatnonzero(item_supports >= max(min_support_count, 1))
+        root_candidates = np.asarray(root_candidates, dtype=np.intp)
+        if dynamic_reordering:
+            root_candidates = root_candidates[np.argsort(item_supports[root_candidates], kind='stable')]
+        search_roots = [([root_item], int(item_supports[root_item]), root_candidates[root_index + 1:]) 
+            for root_index, root_item in enumerate(root_candidates.tolist())]
     
-        #Filter transactions down to the rows pertinent to this root
-        root_transactions = encoded_transactions[ encoded_transactions[:,root_item] == True]
-        logging.info(root_transactions)
+    depth_buffers = DepthBuffers()
+    for root_items, root_support, root_tail_items in search_roots:
         
-        #Identify tail items by bitwise_or columns and extracting those with positive values
-        occupied_columns = np.bitwise_or.reduce(root_transactions, axis=0) 
-        occupied_column_indices = []
-        for index, column_digest_value in enumerate(occupied_columns):
-            if column_digest_value == 1:
-                occupied_column_indices.append(index)
+        #Progressive focusing, the root only needs to compare against the MFIs which contain it
+        root_mfi_rows = maximal_itemset_index.all_rows()
+        for root_item in root_items:
+            root_mfi_rows = maximal_itemset_index.rows_containing_item(root_mfi_rows, root_item)
+        
+        root_search = None if root_subproblem is None else root_subproblem(root_items, root_support, root_tail_items)
+        if root_search is None:
+            root_search = (root_tail_items, np.bitwise_and.reduce(item_bitmaps[root_items], axis=0), item_bitmaps, count_support)
+        root_tail_items, root_bitmap, root_item_bitmaps, root_count_support = root_search
+        
+        _MAFIA_candidate_assessor(root_items, root_bitmap, root_support, root_tail_items, root_item_bitmaps, 
+            maximal_itemset_index, root_mfi_rows, min_support_count, parent_equivalence_pruning, dynamic_reordering, 
+            search_statistics, root_count_support, subtree_tasks, depth_buffers, min_length, max_length)
+    return maximal_itemset_index.maximal_itemsets()
 
-        #Assess the "tail" (potential supersets) by sequentially choosing additional columns to evluate
-        #and recursively following them
-        for tail_item in occupied_column_indices:
-            
-            #Ensure that we do not assess the original candidate column
-            if (tail_item != root_item):
-                candidate_set = {root_item, tail_item}
-                candidate_list = list(candidate_set)
-                
-                head_transactions = root_transactions[np.sum(root_transactions[:,candidate_list], axis=1) == len(candidate_set)]
-                
-                
-                _MAFIA_recursive_candidate_assessor(candidate_set,
-                    head_transactions, maximal_frequent_itemsets, frequent_item_sets, infrequent_item_sets, 
-                    min_support_ratio, total_transaction_count)
+class _MAFIARootProjector:
+    '''
+        root_subproblem of MAFIA_on_encoded_collection, a root is searched in bitmaps projected onto its transactions
+        (see _MAFIA_sparse_subproblem) when project_all is set or _MAFIA_prefers_projected_root picks it, a dense 
+        dataset gets its CSR copy on first need
+    '''
+    
+    def __init__(self, encoded_transactions, transaction_weights, min_support_count: int, project_all: bool, 
+        mean_transaction_length: float, search_statistics: SearchStatistics):
+        self.encoded_transactions = encoded_transactions
+        self.transaction_weights = transaction_weights
+        self.min_support_count = min_support_count
+        self.project_all = project_all
+        self.mean_transaction_length = mean_transaction_length
+        self.search_statistics = search_statistics
     
-    return maximal_frequent_itemsets
+    def __call__(self, root_items: list, root_support: int, root_tail_items):
+        if not self.project_all and not _MAFIA_prefers_projected_root(root_support, self.mean_transaction_length, 
+            len(root_tail_items), number_of_words(self.encoded_transactions.shape[0])):
+            return None
+        if not isinstance(self.encoded_transactions, SparseEncodedTransactions):
+            self.encoded_transactions = SparseEncodedTransactions.from_dense(unpack_encoded_transactions(self.encoded_transactions))
+        if not self.project_all:
+            self.search_statistics.bitmap_projections += 1
+        return _MAFIA_sparse_subproblem(self.encoded_transactions, root_items, root_tail_items, self.transaction_weights, 
+            self.min_support_count)
+
+def _packed_item_bitmaps(encoded_transactions) -> np.ndarray:
+    '''
+        Packed item bitmaps (items x words) of a dense dataset, PackedEncodedTransactions already hold them and are
+        read in place
+    '''
+    if isinstance(encoded_transactions, PackedEncodedTransactions):
+        return np.asarray(encoded_transactions.item_bitmaps)
+    return pack_encoded_columns(encoded_transactions)
+
+def _constraint_columns(transaction_encoder, values, missing_ok: bool=False) -> list:
+    '''
+        Column numbers of the constrained values, a value without a column (unknown or infrequent) is skipped
+        when missing_ok, otherwise no itemset can contain it and None is returned
+    '''
+    columns = []
+    for value in values:
+        if value in transaction_encoder.value_encoder_mapping:
+            columns.append(transaction_encoder.value_encoder_mapping[value])
+        elif not missing_ok:
+            return None
+    return sorted(set(columns))
+
+def _check_length_bounds(min_length: int, max_length: int):
+    '''
+        Rejects a max_length under one item or under min_length
+    '''
+    if max_length is not None and max_length < max(min_length, 1):
+        raise ValueError("max_length {} is below min_length {} or 1".format(max_length, min_length))
 
-def _MAFIA_recursive_candidate_assessor(head_item_set: set, head_transactions, maximal_frequent_itemsets,
-    frequent_item_sets, infrequent_item_sets, min_support_ratio: float, total_transaction_count: int):
+def _MAFIA_full_bitmaps_fit(sparse_transactions: SparseEncodedTransactions, frequent_items) -> bool:
+    '''
+        Full length bitmaps cost one bit per transaction for every frequent item while the tid-lists cost one index
+        per occurrence, packing is only worthwhile when the bitmaps are no larger than the tid-lists they replace
+    '''
+    item_indptr, item_tids = sparse_transactions.item_tidlists()
+    frequent_occurrences = int(np.sum(item_indptr[frequent_items + 1] - item_indptr[frequent_items]))
+    bitmap_bits = len(frequent_items) * number_of_words(sparse_transactions.number_of_transactions) * WORD_BITS
+    return bitmap_bits <= frequent_occurrences * item_tids.itemsize * 8
+
+def _pack_sparse_item_bitmaps(sparse_transactions: SparseEncodedTransactions, items) -> ProjectedBitmaps:
+    '''
+        Full length packed bitmaps of the given columns of a sparse dataset, built straight from their tid-lists
     '''
-        Recursive, depth-first search function that progressively assesses the tail of a root item through increasingly large supersets
+    sorted_items = np.sort(items)
+    item_positions, item_tids = sparse_transactions.transpose().transactions_items(sorted_items)
+    return ProjectedBitmaps(sorted_items, 
+        pack_coordinates(item_positions, item_tids, len(sorted_items), sparse_transactions.number_of_transactions))
+
+def _MAFIA_sparse_subproblem(sparse_transactions: SparseEncodedTransactions, head_items: list, tail_items, 
+    transaction_weights, min_support_count: int):
+    '''
+        Builds the dense subproblem of a head from a sparse dataset, only the transactions containing the head 
+        are kept (numbered 0..m) and only the tail items frequent within them are packed
+        
+        The transactions are found by intersecting the head's tid-lists, and one gather of their items with a
+        bincount gives the support of every head + tail item pair before anything is packed
         
-        This assessor is designed to act on a base parent set (ex. {a, b}) and a a
+        Returns the frequent tail items (in their original order), the head bitmap (every projected transaction), 
+        the projected item bitmaps and the support counter of the projected transactions
     '''
+    head_tids = sparse_transactions.item_tidlist(head_items[0])
+    for head_item in head_items[1:]:
+        head_tids = np.intersect1d(head_tids, sparse_transactions.item_tidlist(head_item), assume_unique=True)
+    head_weights = None if transaction_weights is None else np.asarray(transaction_weights)[head_tids]
+    positions, items = sparse_transactions.transactions_items(head_tids)
     
-    #Measure the support of the new head by measuring the support of the tail element within the transactions of the previous head
+    #Keep the occurrences of tail items, ranked by column number
+    sorted_tail_items = np.sort(tail_items)
+    tail_ranks = np.searchsorted(sorted_tail_items, items)
+    tail_occurrences = tail_ranks < len(sorted_tail_items)
+    tail_occurrences[tail_occurrences] = sorted_tail_items[tail_ranks[tail_occurrences]] == items[tail_occurrences]
+    positions, tail_ranks = positions[tail_occurrences], tail_ranks[tail_occurrences]
     
+    pair_supports = np.bincount(tail_ranks, weights=None if head_weights is None else head_weights[positions], 
+        minlength=len(sorted_tail_items))
+    frequent_ranks = pair_supports >= min_support_count
     
-    head_support = head_transactions.shape[0]
-    logging.info("Head Item Set {} Support {}".format(head_item_set, head_support/total_transaction_count))
+    #Pack the occurrences of the frequent tail items, one bitmap row per item over the projected transactions
+    projected_rows = np.cumsum(frequent_ranks) - 1
+    frequent_occurrences = frequent_ranks[tail_ranks]
+    projected_bitmaps = ProjectedBitmaps(sorted_tail_items[frequent_ranks], pack_coordinates(projected_rows[tail_ranks[frequent_occurrences]], 
+        positions[frequent_occurrences], int(np.count_nonzero(frequent_ranks)), len(head_tids)))
     
-    #If Head Support is above the MinSupp ratio, continue to evaluate the node
-    if head_support/total_transaction_count > min_support_ratio:
+    weight_planes = None if head_weights is None else pack_weight_planes(head_weights)
+    return (tail_items[np.isin(tail_items, projected_bitmaps.items)], full_bitmap(len(head_tids)), projected_bitmaps, 
+        support_counter(weight_planes))
+
+def _MAFIA_candidate_assessor(head_items: list, head_bitmap, head_support: int, tail_items, item_bitmaps,
+    maximal_itemset_index: MaximalItemsetIndex, local_mfi_rows, min_support_count: int,
+    parent_equivalence_pruning: bool, dynamic_reordering: bool, search_statistics: SearchStatistics, count_support,
+    subtree_tasks: list=None, depth_buffers: DepthBuffers=None, min_length: int=1, max_length: int=None):
+    '''
+        Depth-first search that progressively assesses the tail of a root item through increasingly large supersets
         
+        The head is known to be frequent, head_bitmap holds the transactions which contain it and
+        tail_items holds the column numbers which may still extend it, item_bitmaps is indexed by column number 
+        (a full bitmap array or the ProjectedBitmaps of a sparse subproblem)
         
-        #Generate tail items from all occupied columns in the head's transactions
-        occupied_columns = np.bitwise_or.reduce(head_transactions, axis=0) 
-        tail_item_set = set()
-        for index, column_digest in enumerate(occupied_columns):
-            if column_digest == 1:
-                tail_item_set.add(index)
+        local_mfi_rows lists the rows of the MFI index that contain the head (the LMFI of the MAFIA paper),
+        any known MFI that could be a superset of this node or its descendants is among them, count_support 
+        is the (possibly weighted) popcount of the run
+        
+        The search keeps an explicit stack of the expanded nodes (see _MAFIA_expand_node) rather than recursing, so
+        the length of a pattern is not bound by the interpreter's recursion limit. The head is a single list of items
+        cut back to each node's length before its next child, and the tail bitmaps of the node at depth d live in
+        block d of depth_buffers (shared across calls when given), where its children read their head bitmaps.
+        
+        When subtree_tasks is provided the children are not evaluated, their (head_items, head_support, tail_items)
+        arguments are appended to it instead so they can be handed to pool workers
+        
+        min_length and max_length bound the length of the reported MFIs, see MAFIA_on_encoded_collection
+    '''
+    if depth_buffers is None:
+        depth_buffers = DepthBuffers()
+    head_items = list(head_items)
+    root_frame = _MAFIA_expand_node(head_items, head_bitmap, head_support, tail_items, item_bitmaps, maximal_itemset_index,
+        local_mfi_rows, min_support_count, parent_equivalence_pruning, dynamic_reordering, search_statistics, count_support,
+        depth_buffers.block(0, len(tail_items), len(head_bitmap)), subtree_tasks is None, None, min_length, max_length)
+    if root_frame is None:
+        return
+    
+    #Hand the children over to the caller rather than evaluating them here
+    if subtree_tasks is not None:
+        for tail_index, tail_item in enumerate(root_frame.tail_items.tolist()):
+            subtree_tasks.append((head_items + [tail_item], int(root_frame.tail_supports[tail_index]), root_frame.tail_items[tail_index + 1:]))
+        return
+    
+    search_frames = [root_frame]
+    while search_frames:
+        frame = search_frames[-1]
+        tail_index = frame.next_child
+        if tail_index == len(frame.tail_items):
+            search_frames.pop()
+            continue
+        frame.next_child += 1
+        tail_item = int(frame.tail_items[tail_index])
+        
+        #MFIs discovered under earlier children contain the head, so they join the local list before it is
+        #narrowed to those which also contain the child's new item
+        candidate_mfi_rows = np.concatenate((frame.local_mfi_rows, np.arange(frame.first_new_mfi_row, len(maximal_itemset_index), dtype=np.intp)))
+        child_mfi_rows = maximal_itemset_index.rows_containing_item(candidate_mfi_rows, tail_item)
+        
+        del head_items[frame.head_length:]
+        head_items.append(tail_item)
+        child_bitmap = frame.tail_bitmaps[frame.tail_rows[tail_index]]
+        child_tail_items = frame.tail_items[tail_index + 1:]
+        child_frame = _MAFIA_expand_node(head_items, child_bitmap, int(frame.tail_supports[tail_index]), child_tail_items, 
+            frame.item_bitmaps, maximal_itemset_index, child_mfi_rows, min_support_count, parent_equivalence_pruning, 
+            dynamic_reordering, search_statistics, frame.count_support, 
+            depth_buffers.block(len(search_frames), len(child_tail_items), len(child_bitmap)), True, frame.hut_mask, 
+            min_length, max_length)
+        
+        #The later children no longer have this item in their head union tail
+        frame.hut_mask[tail_item // WORD_BITS] &= ~np.uint64(1 << (tail_item % WORD_BITS))
+        if child_frame is not None:
+            search_frames.append(child_frame)
 
-        #Check to see if the head union tail is already present in the maximal frequent item list
-        head_union_tail = tail_item_set.union(tail_item_set)
-        if tuple(head_union_tail) in maximal_frequent_itemsets:
-            logging.debug("HUTMFI Optimization Engaged")
-            frequent_item_sets.add(tuple(head_item_set))
-            return
+class _MAFIAFrame:
+    '''
+        Expanded node on the MAFIA search stack, the length of its head, its frequent tail (column numbers, their
+        supports and their rows in tail_bitmaps), the bitmaps and support counter its subtree uses, its local MFI 
+        rows and the position of its next child
+        
+        hut_mask is the item mask of the head and the tail from the next child on, which is also that child's head 
+        union tail, so the HUT check of each child costs one bit cleared rather than a mask built
+    '''
+    __slots__ = ('head_length', 'tail_items', 'tail_supports', 'tail_rows', 'tail_bitmaps', 'item_bitmaps', 'count_support', 
+        'local_mfi_rows', 'first_new_mfi_row', 'hut_mask', 'next_child')
+    
+    def __init__(self, head_length: int, tail_items, tail_supports, tail_rows, tail_bitmaps, item_bitmaps, count_support, 
+        local_mfi_rows, first_new_mfi_row: int, hut_mask):
+        self.head_length = head_length
+        self.tail_items = tail_items
+        self.tail_supports = tail_supports
+        self.tail_rows = tail_rows
+        self.tail_bitmaps = tail_bitmaps
+        self.item_bitmaps = item_bitmaps
+        self.count_support = count_support
+        self.local_mfi_rows = local_mfi_rows
+        self.first_new_mfi_row = first_new_mfi_row
+        self.hut_mask = hut_mask
+        self.next_child = 0
 
-        #If the head item set already contains its potential tail, it has no tail, and should be returned as a maximal set
-        if len(head_item_set) == len(tail_item_set):
-            logging.debug("No superset items found, {} is maximal".format(head_item_set))
-            maximal_frequent_itemsets.add(tuple(head_item_set))
-            return
+def _MAFIA_expand_node(head_items: list, head_bitmap, head_support: int, tail_items, item_bitmaps,
+    maximal_itemset_index: MaximalItemsetIndex, local_mfi_rows, min_support_count: int,
+    parent_equivalence_pruning: bool, dynamic_reordering: bool, search_statistics: SearchStatistics, count_support,
+    tail_block, allow_projection: bool, hut_mask=None, min_length: int=1, max_length: int=None) -> _MAFIAFrame:
+    '''
+        Visits one node of the search, counting its tail into tail_block and applying HUT pruning, Parent Equivalence
+        Pruning (which extends head_items in place) and dynamic reordering, hut_mask is the node's head union tail
+        when the parent already holds it
         
-        #Otherwise recursively evaluate the tail elements
-        else:
-            
-            original_maximal_item_set_size = len(maximal_frequent_itemsets)
+        A head of max_length items is not extended (it is maximal unless a known MFI contains it) and a node whose 
+        head and frequent tail together fall short of min_length is pruned
+        
+        Returns the node's frame, or None when the node is pruned or has no frequent tail (a maximal head is added to
+        the MFI index)
+    '''
+    search_statistics.nodes_visited += 1
+    search_statistics.record_depth(len(head_items))
+    
+    #Check to see if the head union tail is a subset of a known MFI before counting any support
+    #If so, every itemset in this subtree is a subset of it as well and the whole subtree is pruned
+    search_statistics.subsumption_tests += 1
+    if hut_mask is None:
+        hut_mask = maximal_itemset_index.itemset_mask(head_items + tail_items.tolist())
+    if maximal_itemset_index.has_superset(hut_mask, local_mfi_rows):
+        search_statistics.hut_prunes += 1
+        return None
+    
+    #The length constraint cuts the search at max_length, every frequent head there is as long as an MFI may be
+    if max_length is not None and len(head_items) >= max_length:
+        if len(local_mfi_rows) == 0 and len(head_items) >= min_length:
+            maximal_itemset_index.add(head_items)
+        return None
+    
+    #Measure the support of every head + tail item combination at once, by ANDing the head bitmap
+    #into the bitmap of each tail item and counting the surviving bits
+    gather_bitmaps(item_bitmaps, tail_items, tail_block)
+    np.bitwise_and(tail_block, head_bitmap, out=tail_block)
+    tail_supports = count_support(tail_block)
+    search_statistics.support_computations += len(tail_items)
+    
+    #Only the frequent extensions remain in the tail, their bitmaps stay in place and become the child head bitmaps
+    tail_rows = np.flatnonzero(tail_supports >= min_support_count)
+    original_tail_length = len(tail_items)
+    tail_items = tail_items[tail_rows]
+    tail_supports = tail_supports[tail_rows]
+    
+    #No itemset of this subtree can reach min_length
+    if len(head_items) + len(tail_items) < min_length:
+        return None
+    
+    #Parent Equivalence Pruning, a tail item present in every transaction of the head belongs to every 
+    #MFI containing the head, so it is moved into the head (whose bitmap is unchanged) rather than branched on,
+    #under max_length only while they cannot outgrow it (an MFI then holds just some of the equivalent items)
+    if parent_equivalence_pruning and (max_length is None or len(head_items) + len(tail_items) <= max_length):
+        equivalent_tail_mask = tail_supports == head_support
+        if np.any(equivalent_tail_mask):
+            equivalent_items = tail_items[equivalent_tail_mask].tolist()
+            search_statistics.pep_merges += len(equivalent_items)
             
-            for tail_item in tail_item_set:
-                
-                #Skip over items in the head item set
-                maximal_itemsets = []
-                if tail_item not in head_item_set:
-                    
-                    head_tail_items = head_item_set.copy()
-                    head_tail_items.add(tail_item)
-                    head_tail_items_list = list(head_tail_items)
-                    
-                    head_tail_transactions = head_transactions[np.sum(head_transactions[:,head_tail_items_list], axis=1) == len(head_tail_items_list)]
-                    
-                    _MAFIA_recursive_candidate_assessor(head_tail_items, head_tail_transactions, 
-                        maximal_frequent_itemsets, frequent_item_sets, infrequent_item_sets, 
-                        min_support_ratio, total_transaction_count)
-                    
-                    
-            #After following all tail items, if we've found at least one maximal_itemset mark the current combination as depleted and return
-            if len(maximal_frequent_itemsets) > original_maximal_item_set_size:
-                logging.debug("Frequent/maximal tail items found")
-                frequent_item_sets.add(tuple(head_item_set))
-                return
+            head_items.extend(equivalent_items)
+            search_statistics.record_depth(len(head_items))
+            for equivalent_item in equivalent_items:
+                local_mfi_rows = maximal_itemset_index.rows_containing_item(local_mfi_rows, equivalent_item)
             
-            #Otherwise we assume that the tail elements were not frequent, and return the current head as a maximal itemset
-            else:
-                logging.debug("No frequent tail items found, {} is maximal".format(head_item_set))
-                maximal_frequent_itemsets.add(tuple(head_item_set))
-                return
+            tail_items = tail_items[~equivalent_tail_mask]
+            tail_rows = tail_rows[~equivalent_tail_mask]
+            tail_supports = tail_supports[~equivalent_tail_mask]
 
-    #If the Head is not above the MinSupp ratio the node should return itself as infrequent with no Maximal Itemsets
-    else:
-        logging.debug("Head items infrequent")
-        infrequent_item_sets.add(tuple(head_item_set))
-        return
+    #If the head has no frequent tail, it has no frequent superset in this subtree
+    #Supersets from earlier subtrees have already been discovered and would be in the local list, 
+    #so an empty list means the head is maximal
+    if len(tail_items) == 0:
+        if len(local_mfi_rows) == 0:
+            maximal_itemset_index.add(head_items)
+        return None
 
-def CHARM_on_encoded_collection(encoded_transactions, transaction_encoder, min_support_ratio):
+    #Repeat the HUT check now that the infrequent tail items are gone (or moved into the head)
+    hut_mask = maximal_itemset_index.itemset_mask(head_items + tail_items.tolist())
+    if len(tail_items) < original_tail_length:
+        search_statistics.subsumption_tests += 1
+        if maximal_itemset_index.has_superset(hut_mask, local_mfi_rows):
+            search_statistics.hut_prunes += 1
+            return None
+    
+    #Dynamic reordering, evaluate the least frequent tail items first, they have the smallest subtrees and their 
+    #MFIs are the most likely to make the HUT of the later (larger) siblings redundant
+    if dynamic_reordering:
+        tail_order = np.argsort(tail_supports, kind='stable')
+        if np.any(tail_order != np.arange(len(tail_order))):
+            search_statistics.tail_reorders += 1
+            tail_items = tail_items[tail_order]
+            tail_rows = tail_rows[tail_order]
+            tail_supports = tail_supports[tail_order]
+    
+    #Once the head covers a small share of the bitmap width, the subtree switches to bitmaps projected onto the
+    #head's transactions, every AND below this node then only spans those transactions
+    tail_bitmaps = tail_block
+    if allow_projection and len(tail_items) > 1 and _MAFIA_prefers_projection(head_bitmap):
+        head_tids = bitmap_to_tids(head_bitmap, len(head_bitmap) * WORD_BITS)
+        tail_bitmaps = project_bitmaps(tail_block[tail_rows], head_tids)
+        tail_rows = np.arange(len(tail_items))
+        item_order = np.argsort(tail_items)
+        item_bitmaps = ProjectedBitmaps(tail_items[item_order], tail_bitmaps[item_order])
+        count_support = project_support_counter(count_support, head_tids)
+        search_statistics.bitmap_projections += 1
+    
+    return _MAFIAFrame(len(head_items), tail_items, tail_supports, tail_rows, tail_bitmaps, item_bitmaps, count_support,
+        local_mfi_rows, len(maximal_itemset_index), hut_mask)
+
+def _MAFIA_prefers_projected_root(root_support: int, mean_transaction_length: float, tail_length: int, words: int) -> bool:
     '''
-        CHARM performs two essential tasks finding frequent itemsets, and determining when an
-        itemset is superceded by another itemset.
-        
-        The finished product when all frequent itemsets are generated and superceded is a list
-        of closed itemsets.
+        A projected root gathers the items of its transactions (about root_support * mean_transaction_length of 
+        them) where a full bitmap root ANDs every tail bitmap across all words, the projection is chosen when it 
+        is the cheaper of the two by the _MAFIA_ROOT_PROJECTION_COST a gathered item costs over an ANDed word
     '''
-    total_transaction_count = encoded_transactions.shape[0]
+    return root_support * mean_transaction_length * _MAFIA_ROOT_PROJECTION_COST < tail_length * words
 
-    decoder_map = transaction_encoder.value_decoder_mapping
-    logging.debug(transaction_encoder.value_encoder_mapping)
-    logging.debug(transaction_encoder.value_supports)
-    
-    closed_itemsets = {}
+_MAFIA_ROOT_PROJECTION_COST = 8
+
+def _MAFIA_prefers_projection(head_bitmap) -> bool:
+    '''
+        Projection pays off once the bitmaps are wide enough to matter and the head sets at most one bit in
+        _MAFIA_PROJECTION_DENSITY of them
+    '''
+    return len(head_bitmap) >= _MAFIA_PROJECTION_MIN_WORDS and \
+        int(popcount(head_bitmap)) * _MAFIA_PROJECTION_DENSITY <= len(head_bitmap) * WORD_BITS
+
+#Narrowest bitmaps (in words) worth projecting and the density below which they are projected (1 in 16 bits set)
+_MAFIA_PROJECTION_MIN_WORDS = 16
+_MAFIA_PROJECTION_DENSITY = 16
 
+def _MAFIA_parallel_search(subtree_tasks: list, shared_arrays: dict, worker_settings: dict, 
+    maximal_itemset_index: MaximalItemsetIndex, search_statistics: SearchStatistics, n_jobs: int):
+    '''
+        Process pool version of the MAFIA root loop
+        
+        Each task is the (head_items, head_support, tail_items) of a subtree, the first-level subtrees of a dense run
+        or the roots of a projected sparse run. The arrays of the run (item bitmaps or sparse indices) are placed in 
+        shared memory once, and every task is submitted with a snapshot of the MFIs merged so far, so HUT pruning in a 
+        worker benefits from what the other workers have already found. 
         
-    #Sorting the root items to be considered an order of ascending support as described in the paper
-    sorted_root_candidates = sorted(transaction_encoder.value_supports.items(), key = 
-                 lambda kv:(kv[1], kv[0]))
-    sorted_root_candidate_items = list(map(lambda tuple: transaction_encoder.value_encoder_mapping[tuple[0]], sorted_root_candidates))
+        Tasks are only submitted as workers free up (a couple per worker in flight) to keep those snapshots recent.
+        Because subtrees finish out of order, the merged MFIs go through a final maximality check.
+    '''
+    remaining_tasks = iter(subtree_tasks)
+    pending_tasks = set()
+    merged_itemsets = maximal_itemset_index.maximal_itemsets()
     
-    logging.debug("Pre Encode {}, post encode {}".format(list(map(lambda item: item[0], sorted_root_candidates)), sorted_root_candidate_items))
+    with contextlib.ExitStack() as pool_resources:
+        shared_array_descriptors = {name: pool_resources.enter_context(SharedArray(array)).descriptor() 
+            for name, array in shared_arrays.items()}
+        executor = pool_resources.enter_context(ProcessPoolExecutor(max_workers=n_jobs, 
+            initializer=_MAFIA_worker_initializer, initargs=(shared_array_descriptors, worker_settings)))
+        
+        while True:
+            #Top up the pool, each new task carries the MFIs merged so far
+            known_masks = maximal_itemset_index.snapshot_masks()
+            for head_items, head_support, tail_items in itertools.islice(remaining_tasks, 2 * n_jobs - len(pending_tasks)):
+                pending_tasks.add(executor.submit(_MAFIA_subtree_worker, head_items, head_support, tail_items, known_masks))
+            if not pending_tasks:
+                break
+            
+            completed_tasks, pending_tasks = wait(pending_tasks, return_when=FIRST_COMPLETED)
+            for completed_task in completed_tasks:
+                discovered_itemsets, worker_statistics = completed_task.result()
+                search_statistics.merge(worker_statistics)
+                
+                #Merge the worker's MFIs, subsets of MFIs from other workers are removed by the final check
+                for itemset in discovered_itemsets:
+                    if itemset not in merged_itemsets:
+                        merged_itemsets.add(itemset)
+                        maximal_itemset_index.add(list(itemset))
+    
+    return maximal_itemset_index.filtered_maximal_itemsets()
 
+_MAFIA_worker_state = {}
+
+def _MAFIA_worker_initializer(shared_array_descriptors: dict, worker_settings: dict):
+    '''
+        Runs once in each pool worker, maps the shared arrays, rebuilds the run's representation around them 
+        and stores the run settings
+    '''
+    shared_arrays = {}
+    shared_blocks = []
+    for name, descriptor in shared_array_descriptors.items():
+        shared_block, shared_arrays[name] = attach_shared_array(descriptor)
+        shared_blocks.append(shared_block)
+    _MAFIA_worker_state.update(worker_settings, shared_blocks=shared_blocks, 
+        count_support=support_counter(worker_settings['weight_planes']))
+    
+    if 'item_tids' in shared_arrays:
+        _MAFIA_worker_state['sparse_transactions'] = SparseEncodedTransactions(shared_arrays['indptr'], shared_arrays['indices'],
+            worker_settings['number_of_items'], shared_arrays['item_indptr'], shared_arrays['item_tids'])
+        _MAFIA_worker_state['transaction_weights'] = shared_arrays.get('transaction_weights')
+    elif 'bitmap_items' in shared_arrays:
+        _MAFIA_worker_state['item_bitmaps'] = ProjectedBitmaps(shared_arrays['bitmap_items'], shared_arrays['item_bitmaps'])
+    else:
+        _MAFIA_worker_state['item_bitmaps'] = shared_arrays['item_bitmaps']
+
+def _MAFIA_subtree_worker(head_items: list, head_support: int, tail_items, known_masks):
+    '''
+        Evaluates one subtree in a pool worker, returning the MFIs it discovered and its search counters
+    '''
+    maximal_itemset_index = MaximalItemsetIndex(_MAFIA_worker_state['number_of_items'])
+    maximal_itemset_index.extend(known_masks)
+    local_mfi_rows = maximal_itemset_index.all_rows()
+    for head_item in head_items:
+        local_mfi_rows = maximal_itemset_index.rows_containing_item(local_mfi_rows, head_item)
+    
+    if 'sparse_transactions' in _MAFIA_worker_state:
+        tail_items, head_bitmap, item_bitmaps, count_support = _MAFIA_sparse_subproblem(_MAFIA_worker_state['sparse_transactions'],
+            head_items, tail_items, _MAFIA_worker_state['transaction_weights'], _MAFIA_worker_state['min_support_count'])
+    else:
+        item_bitmaps = _MAFIA_worker_state['item_bitmaps']
+        head_bitmap = np.bitwise_and.reduce(item_bitmaps[head_items], axis=0)
+        count_support = _MAFIA_worker_state['count_support']
+    
+    search_statistics = SearchStatistics()
+    _MAFIA_candidate_assessor(head_items, head_bitmap, head_support, tail_items, item_bitmaps, 
+        maximal_itemset_index, local_mfi_rows, _MAFIA_worker_state['min_support_count'], 
+        _MAFIA_worker_state['parent_equivalence_pruning'], _MAFIA_worker_state['dynamic_reordering'], search_statistics,
+        count_support, min_length=_MAFIA_worker_state['min_length'], max_length=_MAFIA_worker_state['max_length'])
+    
+    return (maximal_itemset_index.itemsets[len(known_masks):], search_statistics.as_dict())
 
-    #Iterate through the root elements and compare them to all other root elements
-    for root_index, root_item in enumerate(sorted_root_candidate_items):
+def MaxMiner_on_encoded_collection(encoded_transactions, transaction_encoder, min_support_ratio,
+    support_lower_bounding: bool=True, search_statistics: SearchStatistics=None, transaction_weights=None,
+    return_statistics: bool=False):
+    '''
+        Returns the Maximal Frequent Itemsets in a transaction encoded dataset based on a provided minimum
+        support ratio and Bayardo's Max-Miner algorithm
         
-        #Create a holding variable to hold the superceded version of the root
-        build_up_itemset = {root_item}
+        Max-Miner walks the same set-enumeration tree as MAFIA, but breadth first. Every candidate group is a head 
+        h(g) and the tail t(g) of items which may still extend it, and each level of groups is counted in one batched 
+        pass which measures sup(h(g) u {i}) for every tail item along with sup(h(g) u t(g)). When h(g) u t(g) is 
+        frequent (the superset-frequency lookahead) it is maximal within the group and none of its subsets are 
+        expanded, which pays off on datasets with long patterns.
         
-        for secondary_item in sorted_root_candidate_items[root_index:]:
-            if secondary_item != root_item:
+        support_lower_bounding skips counting groups whose h(g) u t(g) is already known to be frequent from the 
+        supports of the parent level, see _MaxMiner_generate_sub_nodes
+        
+        Accepts the same inputs as MAFIA_on_encoded_collection (dense or SparseEncodedTransactions, transaction_weights)
+        and returns the same set of sorted tuples of column numbers. An optional SearchStatistics object receives the
+        counts of groups evaluated, supports counted, lookahead hits and lower bound hits, along with the time spent 
+        counting groups and merging each level into F. return_statistics returns (maximal itemsets, SearchStatistics).
+    '''
+    if search_statistics is None:
+        search_statistics = SearchStatistics()
+    with search_statistics.timed_phase('preparation'):
+        number_of_transactions, number_of_items = encoded_transactions.shape
+    
+        if transaction_weights is None:
+            total_transaction_count = number_of_transactions
+            count_support = support_counter()
+        else:
+            total_transaction_count = int(np.sum(transaction_weights))
+            count_support = support_counter(pack_weight_planes(transaction_weights))
+        min_support_count = minimum_support_count(min_support_ratio, total_transaction_count)
+    
+        if isinstance(encoded_transactions, SparseEncodedTransactions):
+            item_supports = encoded_transactions.item_supports(transaction_weights)
+        else:
+            item_bitmaps = _packed_item_bitmaps(encoded_transactions)
+            item_supports = count_support(item_bitmaps)
+    
+        #Roots are the frequent items ordered by increasing support, as in MAFIA
+        root_candidates = np.array(sorted(transaction_encoder.value_encoder_mapping.values()), dtype=np.intp)
+        root_candidates = root_candidates[item_supports[root_candidates] >= min_support_count]
+        root_candidates = root_candidates[np.argsort(item_supports[root_candidates], kind='stable')]
+        if isinstance(encoded_transactions, SparseEncodedTransactions):
+            item_bitmaps = _pack_sparse_item_bitmaps(encoded_transactions, root_candidates)
+    
+        maximal_itemset_index = MaximalItemsetIndex(number_of_items)
+    
+        #Gen-Initial-Groups, every root but the last heads a group whose tail is the roots after it
+        #The last root has an empty tail and is a frequent itemset on its own
+        candidate_groups = [([root_item], item_bitmaps[root_item], int(item_supports[root_item]), root_candidates[root_index + 1:])
+            for root_index, root_item in enumerate(root_candidates[:-1].tolist())]
+        level_itemsets = [[int(root_item)] for root_item in root_candidates[-1:]]
+    
+    while candidate_groups:
+        search_statistics.nodes_visited += len(candidate_groups)
+        next_candidate_groups = []
+        
+        with search_statistics.timed_phase('search'):
+            for candidate_group, (tail_bitmaps, tail_supports, head_union_tail_support) in zip(candidate_groups, 
+                _MaxMiner_count_groups(candidate_groups, item_bitmaps, count_support)):
+                head_items, head_bitmap, head_support, tail_items = candidate_group
+                search_statistics.support_computations += len(tail_items) + 1
+                search_statistics.record_depth(len(head_items))
                 
-                #Isolate root and secondary item transactions 
-                root_transactions = encoded_transactions[:,root_item]
-                secondary_transactions = encoded_transactions[:,secondary_item]
-
+                #Lookahead, a frequent head union tail covers every itemset of the group's subtree
+                if head_union_tail_support >= min_support_count:
+                    search_statistics.lookahead_hits += 1
+                    level_itemsets.append(head_items + tail_items.tolist())
+                    continue
                 
-                logging.debug("Checking subsumption for {} and {} (translated)".format(list(map(lambda x: decoder_map[x], build_up_itemset)), 
-                    decoder_map[secondary_item]))
-
-                #If the root item is subsumed by the secondary item, compound with root
-                if _CHARM_subsumption_test(root_transactions, secondary_transactions):
-                    previous_build_up_itemset = build_up_itemset.copy()
-                    build_up_itemset.add(secondary_item)
-                    logging.debug("{} is subsumed by {} making {} (translated)".format(list(map(lambda x: decoder_map[x], previous_build_up_itemset)), 
-                                                                          decoder_map[secondary_item], 
-                                                                          list(map(lambda x: decoder_map[x], build_up_itemset))))
-                #Otherwise, treat the root and secondary as a potential new frequent itemset 
-                else:
-                    head_item_set = {root_item}
-                    head_item_set.add(secondary_item)
-                    
-                    _CHARM_recursive_candidate_assessor(head_item_set, encoded_transactions, sorted_root_candidate_items, 
-                        closed_itemsets, min_support_ratio, total_transaction_count)
-        
-        #Once we have iterated through all potentially superceding variables, add the compilation to closed itemsets
-        build_up_itemset = frozenset(build_up_itemset)
-        logging.info("Inserting closed itemset {}".format(build_up_itemset))
-        if len(build_up_itemset) not in closed_itemsets:
-            closed_itemsets[len(build_up_itemset)] = {}
-        closed_itemset_support = transaction_encoder.value_supports[transaction_encoder.value_decoder_mapping[root_item]]
+                _MaxMiner_generate_sub_nodes(head_items, head_support, tail_items, tail_bitmaps, tail_supports, 
+                    level_itemsets, next_candidate_groups, min_support_count, support_lower_bounding, search_statistics)
+        
+        with search_statistics.timed_phase('merge'):
+            search_statistics.subsumption_tests += len(level_itemsets) + len(next_candidate_groups)
+            maximal_itemset_index = _MaxMiner_merge_level(maximal_itemset_index, level_itemsets)
+            level_itemsets = []
             
-        closed_itemsets[len(build_up_itemset)][build_up_itemset] = closed_itemset_support
+            #Groups whose head union tail is a subset of a known frequent itemset can not contain a new maximal itemset
+            if next_candidate_groups:
+                covered_groups = maximal_itemset_index.has_superset_each(
+                    [head_items + tail_items.tolist() for head_items, head_bitmap, head_support, tail_items in next_candidate_groups])
+                search_statistics.hut_prunes += int(np.count_nonzero(covered_groups))
+                next_candidate_groups = list(itertools.compress(next_candidate_groups, ~covered_groups))
+        candidate_groups = next_candidate_groups
+    
+    with search_statistics.timed_phase('merge'):
+        search_statistics.subsumption_tests += len(level_itemsets)
+        maximal_itemsets = _MaxMiner_merge_level(maximal_itemset_index, level_itemsets).maximal_itemsets()
+    
+    if return_statistics:
+        return (maximal_itemsets, search_statistics)
+    return maximal_itemsets
 
-    #Decode the discovered itemsets back to the original values
-    translated_closed_itemsets = {}
-    for itemset_size in closed_itemsets:
+def _MaxMiner_count_groups(candidate_groups: list, item_bitmaps, count_support):
+    '''
+        Counting pass over one level of candidate groups, yields the tail bitmaps, the support of the head with each 
+        tail item and the support of the head union the entire tail of every group
         
-        if itemset_size not in translated_closed_itemsets:
-            translated_closed_itemsets[itemset_size] = {}
+        The tails of many groups are ANDed with their heads in one batch (bounded by _MAX_MINER_BATCH_WORDS) and the
+        head union tail bitmaps are reduced from those same rows with np.bitwise_and.reduceat
+    '''
+    batch_start = 0
+    while batch_start < len(candidate_groups):
+        words_per_row = max(len(candidate_groups[batch_start][1]), 1)
+        batch_end, batch_rows = batch_start, 0
+        while batch_end < len(candidate_groups) and (batch_end == batch_start or 
+            (batch_rows + len(candidate_groups[batch_end][3])) * words_per_row <= _MAX_MINER_BATCH_WORDS):
+            batch_rows += len(candidate_groups[batch_end][3])
+            batch_end += 1
+        batch_groups = candidate_groups[batch_start:batch_end]
         
-        for closed_itemset in closed_itemsets[itemset_size]:
-            support = closed_itemsets[itemset_size][closed_itemset]
-            decoded_itemset = list(map(lambda item: decoder_map[item], closed_itemset))
-            decoded_itemset = frozenset(decoded_itemset)
-            translated_closed_itemsets[itemset_size][decoded_itemset] = support
-    logging.info("Discovered closed itemsets {}".format(translated_closed_itemsets))
-    
-    return translated_closed_itemsets
+        tail_lengths = np.array([len(tail_items) for head_items, head_bitmap, head_support, tail_items in batch_groups])
+        tail_offsets = np.concatenate(([0], np.cumsum(tail_lengths)[:-1]))
+        head_bitmaps = np.stack([head_bitmap for head_items, head_bitmap, head_support, tail_items in batch_groups])
+        batch_tail_items = np.concatenate([tail_items for head_items, head_bitmap, head_support, tail_items in batch_groups])
+        
+        batch_tail_bitmaps = item_bitmaps[batch_tail_items] & np.repeat(head_bitmaps, tail_lengths, axis=0)
+        batch_tail_supports = count_support(batch_tail_bitmaps)
+        head_union_tail_supports = count_support(np.bitwise_and.reduceat(batch_tail_bitmaps, tail_offsets, axis=0))
+        
+        for group_index, (tail_offset, tail_length) in enumerate(zip(tail_offsets.tolist(), tail_lengths.tolist())):
+            yield (batch_tail_bitmaps[tail_offset:tail_offset + tail_length], batch_tail_supports[tail_offset:tail_offset + tail_length],
+                int(head_union_tail_supports[group_index]))
+        batch_start = batch_end
 
-def _CHARM_subsumption_test(root_transactions, secondary_transactions):
+def _MaxMiner_generate_sub_nodes(head_items: list, head_support: int, tail_items, tail_bitmaps, tail_supports,
+    level_itemsets: list, next_candidate_groups: list, min_support_count: int, support_lower_bounding: bool, 
+    search_statistics: SearchStatistics):
     '''
-        Function that returns whether the transactiosn representing the root items
-        are subsumed by the transactions representing the secondary items
-        
-        Tidsets are a list of transaction ids where a specified itemset appeared,
+        Gen-Sub-Nodes, expands a group whose head union tail is infrequent into the groups of the next level
         
-        Subsumption is called for when the tidset of the root items is a subset of the
-        secondary items tidset.
+        Infrequent tail items are dropped and the rest reordered by increasing support with the head. Every tail item 
+        but the last heads a child group whose tail is the items after it, and the head plus the last item is frequent.
+        Frequent itemsets are appended to level_itemsets and child groups to next_candidate_groups.
         
-        a = {1,2,3}, b = {1,2,3,4} -> True
+        Support lower bounding: removing item j from the transactions of h(g) drops drop(j) = sup(h(g)) - sup(h(g) u {j})
+        of them, so sup(h(g) u {i} u T) >= sup(h(g) u {i}) - sum(drop(j) for j in T). When that bound reaches the minimum 
+        support the child's head union tail is frequent without being counted.
     '''
-    #Test for subsumption by determining that the transactions in which the root item are present
-    #are a subset of the items  
+    frequent_tail_mask = tail_supports >= min_support_count
+    tail_order = np.argsort(tail_supports[frequent_tail_mask], kind='stable')
+    tail_items = tail_items[frequent_tail_mask][tail_order]
+    tail_bitmaps = tail_bitmaps[frequent_tail_mask][tail_order]
+    tail_supports = tail_supports[frequent_tail_mask][tail_order]
     
+    if len(tail_items) == 0:
+        level_itemsets.append(head_items)
+        return
     
-    combined_transaction_shape = root_transactions.shape
+    #Suffix sums of the drops, the total drop of the tail following each item
+    following_drops = np.concatenate((np.cumsum((head_support - tail_supports)[::-1])[::-1][1:], [0]))
     
-    new_shape = list(secondary_transactions.shape)
-    new_shape.append(1)
+    for tail_index, tail_item in enumerate(tail_items[:-1].tolist()):
+        child_head_items = head_items + [tail_item]
+        child_tail_items = tail_items[tail_index + 1:]
+        
+        #The tail is ordered by increasing support, so the bound only grows along it and the first child to reach the 
+        #minimum support covers every later child (their head union tail is a subset of its own) and h(g) u {last}
+        if support_lower_bounding and tail_supports[tail_index] - following_drops[tail_index] >= min_support_count:
+            search_statistics.lower_bound_hits += 1
+            level_itemsets.append(child_head_items + child_tail_items.tolist())
+            return
+        
+        next_candidate_groups.append((child_head_items, tail_bitmaps[tail_index], int(tail_supports[tail_index]), child_tail_items))
     
-    #For original round with two individual items
-    if len(combined_transaction_shape) == 1:
+    level_itemsets.append(head_items + [int(tail_items[-1])])
 
-        '''
-        root_transactions = root_transactions.reshape(new_shape)
-        secondary_transactions = secondary_transactions.reshape(new_shape)
-        combined_transaction_shape = (combined_transaction_shape[0], 2)
-        '''
-    #For successive founds as root itemset grows
-    else:
-        #This turns it into a two stage process, turning the multiple columns into 1D
-        root_transactions = np.bitwise_and.reduce(root_transactions, axis=1)
-        combined_transaction_shape = (combined_transaction_shape[0], 2)
+def _MaxMiner_merge_level(maximal_itemset_index: MaximalItemsetIndex, level_itemsets: list) -> MaximalItemsetIndex:
+    '''
+        Adds the frequent itemsets found by a level to F and removes any itemset of F with a proper superset in F,
+        returning the rebuilt index
         
-    transaction_or = bitwise_or(root_transactions, secondary_transactions)
+        New itemsets already covered by F are dropped with one batched superset check. The survivors are filtered
+        among themselves and may still cover older itemsets, which are dropped with a second batched check.
+    '''
+    new_itemsets = list({tuple(sorted(itemset)) for itemset in level_itemsets})
+    if not new_itemsets:
+        return maximal_itemset_index
     
-    return np.array_equal(transaction_or, secondary_transactions)
+    new_itemsets = list(itertools.compress(new_itemsets, ~maximal_itemset_index.has_superset_each(new_itemsets)))
+    new_itemset_index = MaximalItemsetIndex(maximal_itemset_index.number_of_items)
+    new_itemset_index.extend(new_itemset_index.itemset_masks_of(new_itemsets), new_itemsets)
+    new_itemsets = list(new_itemset_index.filtered_maximal_itemsets())
+    new_itemset_index = MaximalItemsetIndex(maximal_itemset_index.number_of_items)
+    new_itemset_index.extend(new_itemset_index.itemset_masks_of(new_itemsets), new_itemsets)
+    
+    #New itemsets are never equal to old ones, so any old itemset they contain is a proper subset
+    old_itemset_masks = maximal_itemset_index.snapshot_masks()
+    uncovered_old_itemsets = ~new_itemset_index.has_superset_each(maximal_itemset_index.itemsets)
+    new_itemset_index.extend(old_itemset_masks[uncovered_old_itemsets], 
+        list(itertools.compress(maximal_itemset_index.itemsets, uncovered_old_itemsets)))
+    return new_itemset_index
+
+#Largest number of bitmap words ANDed at once by a Max-Miner counting pass (128MB)
+_MAX_MINER_BATCH_WORDS = 1 << 24
 
+def FPMAX_on_collection(iterable_object, transaction_encoder, min_support_ratio, search_statistics: SearchStatistics=None,
+    return_statistics: bool=False):
+    '''
+        Returns the Maximal Frequent Itemsets of a Python collection of transactions (a List-of-Lists, as accepted by
+        generate_transactional_encoder_from_collection) based on a provided minimum support ratio and Grahne and 
+        Zhu's FP-MAX algorithm
+        
+        The items kept by the encoder are ranked by their value_supports and every transaction is inserted into an 
+        FPTree as its frequent ranks, so the transactions x items matrix is never built and identical transaction 
+        prefixes are stored once. Each item's conditional pattern base is mined recursively, least frequent item first,
+        see _FPMAX_recursive_search.
+        
+        Returns the same set of sorted tuples of column numbers (value_encoder_mapping) as MAFIA_on_encoded_collection.
+        An optional SearchStatistics object receives the counts of conditional trees visited, items counted, HUT prunes
+        and subset checks, along with the time spent building the FP-tree and mining it. return_statistics returns 
+        (maximal itemsets, SearchStatistics).
+    '''
+    if search_statistics is None:
+        search_statistics = SearchStatistics()
+    with search_statistics.timed_phase('tree_construction'):
+        min_support_count = minimum_support_count(min_support_ratio, transaction_encoder.number_of_transactions)
+        
+        #Rank the frequent values by decreasing support, ties keep their column order
+        frequent_values = [value for value in transaction_encoder.value_encoder_mapping 
+            if transaction_encoder.value_supports[value] >= min_support_count]
+        frequent_values.sort(key=lambda value: -transaction_encoder.value_supports[value])
+        value_ranks = {value: rank for rank, value in enumerate(frequent_values)}
+        rank_columns = np.array([transaction_encoder.value_encoder_mapping[value] for value in frequent_values], dtype=np.intp)
+        
+        indptr, items = array.array('q', [0]), array.array('q')
+        for row in iterable_object:
+            items.extend(sorted({value_ranks[value] for value in row if value in value_ranks}))
+            indptr.append(len(items))
+        indptr, items = np.frombuffer(indptr, dtype=np.int64), np.frombuffer(items, dtype=np.int64)
+        
+        fp_tree = FPTree.from_transactions(indptr, items, np.ones(len(indptr) - 1, dtype=np.int64), len(frequent_values))
     
-def _CHARM_recursive_candidate_assessor(head_item_set: set, encoded_transactions, 
-    sorted_root_candidate_items, closed_itemsets, min_support_ratio: float, total_transaction_count: int):
+    with search_statistics.timed_phase('search'):
+        maximal_itemset_index = MaximalItemsetIndex(len(frequent_values))
+        if len(fp_tree):
+            _FPMAX_recursive_search(fp_tree, [], maximal_itemset_index, maximal_itemset_index.all_rows(), min_support_count, 
+                search_statistics)
+    
+    maximal_itemsets = {tuple(sorted(rank_columns[list(itemset)].tolist())) for itemset in maximal_itemset_index.itemsets}
+    if return_statistics:
+        return (maximal_itemsets, search_statistics)
+    return maximal_itemsets
+
+def _FPMAX_recursive_search(fp_tree: FPTree, head_items: list, maximal_itemset_index: MaximalItemsetIndex, local_mfi_rows,
+    min_support_count: int, search_statistics: SearchStatistics):
     '''
-        This function is run recursively each time we assess a prospective frequent itemset and
-        has the potential 
+        Mines the (conditional) FP-tree of a frequent head, whose items are all frequent together with the head
         
+        The items of the tree are processed in decreasing rank (increasing support) order, the conditional pattern
+        base of an item only holds the items ranked before it, so an itemset found later can never be a superset of 
+        one found earlier and every itemset which passes the subset check is maximal.
         
+        The subset checks run against the MFI index restricted to local_mfi_rows, the itemsets containing the head.
+        This is the conditional MFI-tree of FP-MAX, narrowed by progressive focusing as in MAFIA.
+    '''
+    search_statistics.nodes_visited += 1
+    search_statistics.record_depth(len(head_items))
+    
+    #Every subset of a single path is frequent, so the head and the whole path form the only candidate
+    if fp_tree.is_single_path():
+        itemset = head_items + fp_tree.single_path_items()
+        search_statistics.record_depth(len(itemset))
+        search_statistics.subsumption_tests += 1
+        if not maximal_itemset_index.has_superset(maximal_itemset_index.itemset_mask(itemset), local_mfi_rows):
+            maximal_itemset_index.add(itemset)
+        return
     
+    first_new_mfi_row = len(maximal_itemset_index)
+    for item in fp_tree.items()[::-1].tolist():
+        base_indptr, base_items, base_counts = fp_tree.conditional_pattern_base(item)
+        base_supports = np.bincount(base_items, weights=np.repeat(base_counts, np.diff(base_indptr)), 
+            minlength=fp_tree.number_of_items)
+        frequent_base_items = np.flatnonzero(base_supports >= min_support_count)
+        search_statistics.support_computations += int(np.count_nonzero(base_supports))
+        
+        candidate_mfi_rows = np.concatenate((local_mfi_rows, np.arange(first_new_mfi_row, len(maximal_itemset_index), dtype=np.intp)))
+        child_mfi_rows = maximal_itemset_index.rows_containing_item(candidate_mfi_rows, item)
+        
+        #The head, the item and its frequent conditional items bound every itemset of the subtree
+        search_statistics.subsumption_tests += 1
+        if maximal_itemset_index.has_superset(maximal_itemset_index.itemset_mask(head_items + [item] + frequent_base_items.tolist()), 
+            child_mfi_rows):
+            search_statistics.hut_prunes += 1
+            continue
+        
+        #Build the conditional tree from the base paths restricted to their frequent items
+        kept_items = base_supports[base_items] >= min_support_count
+        base_rows = np.repeat(np.arange(len(base_counts)), np.diff(base_indptr))
+        kept_indptr = np.concatenate(([0], np.cumsum(np.bincount(base_rows[kept_items], minlength=len(base_counts)))))
+        conditional_tree = FPTree.from_transactions(kept_indptr, base_items[kept_items], base_counts, fp_tree.number_of_items)
+        
+        _FPMAX_recursive_search(conditional_tree, head_items + [item], maximal_itemset_index, child_mfi_rows, 
+            min_support_count, search_statistics)
+
+def CHARM_on_encoded_collection(encoded_transactions, transaction_encoder, min_support_ratio, transaction_weights=None,
+    diffsets: bool=None, search_statistics: SearchStatistics=None, return_statistics: bool=False, required_items=(), 
+    excluded_items=(), min_length: int=1, max_length: int=None):
+    '''
+        CHARM performs two essential tasks finding frequent itemsets, and determining when an
+        itemset is superceded by another itemset.
+        
+        The finished product when all frequent itemsets are generated and superceded is a list
+        of closed itemsets.
+        
+        The search runs over an itemset-tidset tree (IT-tree), every node pairs an itemset with the sorted ids of the
+        transactions containing it, and siblings are combined using the four tidset properties of the paper
+        (see _CHARM_extend). A SparseEncodedTransactions is consumed through its tid-lists without expansion.
+        
+        diffsets stores each node as the transactions it loses relative to its parent (dCHARM) instead of its tidset,
+        which is far smaller on dense data. None switches a subtree over once its diffsets are the smaller of the two,
+        True starts the search on diffsets and False keeps tidsets throughout.
+        
+        transaction_weights accepts the duplicate counts of a collapsed dataset (see collapse_duplicate_transactions),
+        supports are then the summed weights of the matching rows
+        
+        An optional SearchStatistics object receives the counts of IT-tree nodes, tidset intersections (or pairs read from
+        the co-occurrence matrix), closed hash subsumption tests and the deepest itemset, along with the time spent in 
+        each phase. return_statistics returns (closed itemsets, SearchStatistics).
+        
+        The result can be limited to the closed itemsets containing every one of required_items and none of 
+        excluded_items (both given as values), closure then only ranges over the items which are not excluded. The
+        search runs over the transactions containing the required items with those items as the prefix of every class.
+        min_length and max_length bound the length of the reported itemsets, classes which cannot reach min_length 
+        are dropped and nodes longer than max_length are not extended. Cutting those nodes can leave the closed 
+        supersets of a shorter itemset unfound, so the itemsets of a run that cut any are checked against their tidsets.
+        
+        Returns {itemset size: {frozenset of values: support}}
     '''
+    _check_length_bounds(min_length, max_length)
+    if search_statistics is None:
+        search_statistics = SearchStatistics()
+    with search_statistics.timed_phase('preparation'):
+        if not isinstance(encoded_transactions, SparseEncodedTransactions):
+            encoded_transactions = SparseEncodedTransactions.from_dense(unpack_encoded_transactions(encoded_transactions))
+        number_of_transactions = encoded_transactions.number_of_transactions
     
-    logging.debug("Assessing potential frequent item set {}".format(head_item_set))
-    head_item_list = list(head_item_set)
+        if transaction_weights is None:
+            total_transaction_count = number_of_transactions
+        else:
+            transaction_weights = np.asarray(transaction_weights, dtype=np.int64)
+            total_transaction_count = int(np.sum(transaction_weights))
+        min_support_count = minimum_support_count(min_support_ratio, total_transaction_count)
+        
+        #Required items are conditioned on, only the transactions containing all of them are searched
+        required_columns = _constraint_columns(transaction_encoder, required_items)
+        excluded_columns = _constraint_columns(transaction_encoder, excluded_items, missing_ok=True)
+        if required_columns is None or (max_length is not None and len(required_columns) > max_length):
+            required_columns, required_tids = [], np.empty(0, dtype=np.int64)
+        elif required_columns:
+            required_tids = encoded_transactions.item_tidlist(required_columns[0])
+            for required_column in required_columns[1:]:
+                required_tids = np.intersect1d(required_tids, encoded_transactions.item_tidlist(required_column), assume_unique=True)
+        else:
+            required_tids = None
+        if required_tids is not None:
+            encoded_transactions = encoded_transactions.take_transactions(required_tids)
+            number_of_transactions = len(required_tids)
+            if transaction_weights is not None:
+                transaction_weights = transaction_weights[required_tids]
+        
+        if transaction_weights is None:
+            count_support = len
+        else:
+            count_support = lambda transaction_ids: int(np.sum(transaction_weights[transaction_ids]))
     
-    head_transactions = encoded_transactions[np.sum(encoded_transactions[:,head_item_list], axis=1) == len(head_item_list)]
-    head_column_transactions = encoded_transactions[:,head_item_list]
+        #The root class pairs each frequent item with its tidset, ordered by ascending support as described in the paper
+        root_nodes = []
+        constrained_columns = set(required_columns).union(excluded_columns)
+        search_columns = [item for item in sorted(transaction_encoder.value_encoder_mapping.values()) if item not in constrained_columns]
+        for root_item in search_columns if number_of_transactions else []:
+            root_tids = encoded_transactions.item_tidlist(root_item)
+            root_support = count_support(root_tids)
+            if root_support >= min_support_count:
+                root_nodes.append(_CHARMNode([root_item], root_tids, root_support, int(np.sum(root_tids, dtype=np.int64)), len(root_tids)))
+        root_nodes.sort(key=lambda node: node.support)
     
+        #The empty itemset is the parent of the roots, it covers every transaction
+        all_tids = np.arange(number_of_transactions, dtype=np.int64)
+        root_parent = _CHARMNode([], all_tids, count_support(all_tids), int(np.sum(all_tids)), number_of_transactions)
+        if diffsets or (diffsets is None and _CHARM_prefers_diffsets(root_parent, root_nodes)):
+            root_nodes = _CHARM_to_diffsets(root_parent, root_nodes)
+            root_diffset_mode = True
+            if diffsets is None:
+                search_statistics.diffset_switches += 1
+        else:
+            root_diffset_mode = False
     
-    head_support = head_transactions.shape[0]
-    logging.info("Head Item Set {} Support {}".format(head_item_set, head_support/total_transaction_count))
+    #Every root pair is counted at once with a co-occurrence matrix (X.T @ X over the frequent columns), the 
+    #containment and frequency of all 2-itemsets are read from it rather than intersected one pair at a time
+    with search_statistics.timed_phase('pair_counting'):
+        root_pair_tid_counts = root_pair_supports = None
+        root_items = [root_node.items[0] for root_node in root_nodes]
+        pair_matrix_count = 1 if transaction_weights is None else 2
+        if 1 < len(root_items) and pair_matrix_count * len(root_items) ** 2 * 8 <= _CHARM_PAIR_MATRIX_MAX_BYTES:
+            root_pair_tid_counts = root_pair_supports = encoded_transactions.item_cooccurrence(root_items)
+            if transaction_weights is not None:
+                root_pair_supports = encoded_transactions.item_cooccurrence(root_items, transaction_weights)
+            search_statistics.support_computations += len(root_items) * (len(root_items) - 1) // 2
     
-    #If Head Support is above the MinSupp ratio, continue to evaluate the head
-    if head_support/total_transaction_count >= min_support_ratio:
-        logging.debug("{} is frequent".format(head_item_set))
+    #Closed itemsets found so far, hashed on the sum of their tids and their support
+    with search_statistics.timed_phase('search'):
+        closed_itemset_hash = {}
+        length_cut = _CHARM_extend(required_columns, root_nodes, root_diffset_mode, closed_itemset_hash, min_support_count, 
+            count_support, diffsets, search_statistics, root_pair_tid_counts, root_pair_supports, min_length, max_length)
         
-        #Narrow down the tail items to assess for subsumption or frequent itemset candidates
-        potential_tails = np.bitwise_or.reduce(head_transactions, axis=0) 
-        potential_tail_indices = []
-        for index, column_digest_value in enumerate(potential_tails):
-            if column_digest_value == 1:
-                potential_tail_indices.append(index)
-                
-                
-        #Figure out how far down the sorted roots we've traveled based on the last item in the head set
-        last_index = 0
-        for head_item in head_item_set:
-            head_item_index = sorted_root_candidate_items.index(head_item)
-            if  head_item_index > last_index:
-                last_index = head_item_index
-                
-        #Retrieves an optimized list of candidate tail items for assessment
-        #The two optimizations are sorting by ascending support, and removing items before the highest support item in the head set
-        reduced_root_items = sorted_root_candidate_items[last_index + 1:]
-        reduced_sorted_root_candidate_items = list(filter(lambda index: index in potential_tail_indices, reduced_root_items))
-        
-        #Iterate through the tail candidates, test for subsumption (if yes
-        build_up_itemset = head_item_set.copy()
-        for tail_item in reduced_sorted_root_candidate_items:
-            if tail_item not in head_item_set:
-                tail_column_transactions = encoded_transactions[:,tail_item]
-                if _CHARM_subsumption_test(head_column_transactions, tail_column_transactions):
-                    previous_build_up_itemset = build_up_itemset.copy()
-                    build_up_itemset.add(tail_item)
-                    
-                    logging.debug("{} is subsumed by {} making {}".format(previous_build_up_itemset, 
-                                                                          tail_item, 
-                                                                          build_up_itemset))
-                #Otherwise test as another potential frequnet itemset
-                else:
-                    logging.debug("{} is not subsumed by {}".format(build_up_itemset, tail_item))
-                    
-                
-                
+        #The required items are closed themselves unless an itemset found above has their tidset
+        if required_columns and root_parent.support >= min_support_count and len(required_columns) >= min_length:
+            _CHARM_insert_closed(closed_itemset_hash, required_columns, root_parent.support, root_parent.tid_sum, search_statistics)
         
-        build_up_itemset = frozenset(build_up_itemset)
-        logging.info("Inserting closed itemset {}".format(build_up_itemset))
-        if len(build_up_itemset) not in closed_itemsets:
-            closed_itemsets[len(build_up_itemset)] = {}
-        closed_itemsets[len(build_up_itemset)][build_up_itemset] = head_support
+        if length_cut:
+            search_columns = np.array(required_columns + search_columns, dtype=np.int64)
+            for closed_itemset_bucket in closed_itemset_hash.values():
+                closed_itemset_bucket[:] = [(closed_itemset, support) for closed_itemset, support in closed_itemset_bucket
+                    if _CHARM_is_closed(encoded_transactions, closed_itemset, search_columns)]
+
+    #Decode the discovered itemsets back to the original values
+    decoder_map = transaction_encoder.value_decoder_mapping
+    translated_closed_itemsets = {}
+    for closed_itemset_bucket in closed_itemset_hash.values():
+        for closed_itemset, support in closed_itemset_bucket:
+            decoded_itemset = frozenset(map(lambda item: decoder_map[item], closed_itemset))
+            translated_closed_itemsets.setdefault(len(decoded_itemset), {})[decoded_itemset] = support
+    
+    if return_statistics:
+        return (translated_closed_itemsets, search_statistics)
+    return translated_closed_itemsets
+
+#Largest memory for the root co-occurrence matrices, above it (ex. tens of thousands of frequent items) the roots are
+#intersected pair by pair like every other class
+_CHARM_PAIR_MATRIX_MAX_BYTES = 1 << 28
+
+class _CHARMNode:
+    '''
+        IT-tree node, the items it adds to its class prefix and either its tidset or its diffset (the tids of the prefix
+        it does not occur in), along with its (weighted) support, the sum of its tids and the number of its tids
+    '''
+    __slots__ = ('items', 'tids', 'support', 'tid_sum', 'tid_count')
+    
+    def __init__(self, items: list, tids, support: int, tid_sum: int, tid_count: int):
+        self.items = items
+        self.tids = tids
+        self.support = support
+        self.tid_sum = tid_sum
+        self.tid_count = tid_count
+
+def _CHARM_extend(prefix_items: list, class_nodes: list, diffset_mode: bool, closed_itemset_hash: dict, 
+    min_support_count: int, count_support, diffsets: bool, search_statistics: SearchStatistics, pair_tid_counts=None, 
+    pair_supports=None, min_length: int=1, max_length: int=None) -> bool:
+    '''
+        CHARM-EXTEND, processes the equivalence classes of the IT-tree (the nodes sharing a prefix) depth first
         
-    else:
-        logging.debug("{} is infrequent".format(head_item_set))
+        Each node X is combined with every later sibling Y, and the tidset of X u Y decides how (t() is the tidset)
+        
+        1. t(X) == t(Y) - Y is removed from the class and its items join X
+        2. t(X) <  t(Y) - Y's items join X, Y stays in the class for the nodes after X
+        3. t(X) >  t(Y) - Y is removed from the class and X u Y becomes a child of X
+        4. otherwise    - X u Y becomes a child of X
+        
+        Items joined to X in properties 1 and 2 occur in every transaction of X, so they also belong to every child of X.
+        Children therefore only store their own items and get X's final itemset as their prefix.
+        
+        The classes being extended are kept on an explicit stack (see _CHARMClass) rather than recursed into, X is
+        only inserted into the closed itemsets once the class of its children has been popped, as in the recursive
+        formulation of the paper.
+        
+        When the pairwise tid counts and supports of the class are known (the root co-occurrence matrix) only the frequent
+        pairs are visited, the properties are decided from the counts and a tidset is only built for the new children
+        
+        Only itemsets of min_length to max_length items are inserted. A class stops once its prefix and remaining 
+        nodes hold fewer than min_length items, and a node longer than max_length is neither inserted nor extended,
+        in which case True is returned since the closed supersets in its subtree are never found
+    '''
+    length_cut = False
+    class_stack = [_CHARMClass(prefix_items, class_nodes, diffset_mode, pair_tid_counts, pair_supports)]
+    while class_stack:
+        charm_class = class_stack[-1]
+        if charm_class.pending_closed is not None:
+            if len(charm_class.pending_closed[0]) >= min_length:
+                _CHARM_insert_closed(closed_itemset_hash, *charm_class.pending_closed, search_statistics)
+            charm_class.pending_closed = None
+        
+        class_nodes, removed_nodes = charm_class.nodes, charm_class.removed_nodes
+        node_index = charm_class.next_node
+        while node_index < len(class_nodes) and removed_nodes[node_index]:
+            node_index += 1
+        if node_index == len(class_nodes) or len(charm_class.prefix_items) + charm_class.suffix_lengths[node_index] < min_length:
+            class_stack.pop()
+            continue
+        charm_class.next_node = node_index + 1
+        node = class_nodes[node_index]
+        
+        node_itemset = charm_class.prefix_items + node.items
+        search_statistics.nodes_visited += 1
+        search_statistics.record_depth(len(node_itemset))
+        child_nodes = []
+        pair_tid_counts, pair_supports = charm_class.pair_tid_counts, charm_class.pair_supports
+        if pair_supports is None:
+            sibling_indices = range(node_index + 1, len(class_nodes))
+        else:
+            sibling_indices = (np.flatnonzero(pair_supports[node_index, node_index + 1:] >= min_support_count) + node_index + 1).tolist()
+        
+        for sibling_index in sibling_indices:
+            if removed_nodes[sibling_index]:
+                continue
+            sibling = class_nodes[sibling_index]
+            
+            if pair_tid_counts is None:
+                search_statistics.support_computations += 1
+                child_node = _CHARM_combine(node, sibling, charm_class.diffset_mode, count_support)
+                if child_node.support < min_support_count:
+                    continue
+                child_tid_count = child_node.tid_count
+            else:
+                child_node = None
+                child_tid_count = pair_tid_counts[node_index, sibling_index]
+            
+            node_subsumed = child_tid_count == node.tid_count
+            sibling_subsumed = child_tid_count == sibling.tid_count
+            removed_nodes[sibling_index] = sibling_subsumed
+            if node_subsumed:
+                #Properties 1 and 2
+                node_itemset = node_itemset + sibling.items
+            else:
+                #Properties 3 and 4
+                if child_node is None:
+                    search_statistics.support_computations += 1
+                    child_node = _CHARM_combine(node, sibling, charm_class.diffset_mode, count_support)
+                child_nodes.append(child_node)
+        
+        if max_length is not None and len(node_itemset) > max_length:
+            length_cut = True
+        elif child_nodes:
+            child_nodes.sort(key=lambda child_node: child_node.support)
+            child_diffset_mode = charm_class.diffset_mode
+            if not child_diffset_mode and diffsets is None and _CHARM_prefers_diffsets(node, child_nodes):
+                child_nodes = _CHARM_to_diffsets(node, child_nodes)
+                child_diffset_mode = True
+                search_statistics.diffset_switches += 1
+            charm_class.pending_closed = (node_itemset, node.support, node.tid_sum)
+            class_stack.append(_CHARMClass(node_itemset, child_nodes, child_diffset_mode))
+        elif len(node_itemset) >= min_length:
+            _CHARM_insert_closed(closed_itemset_hash, node_itemset, node.support, node.tid_sum, search_statistics)
+    return length_cut
+
+class _CHARMClass:
+    '''
+        Equivalence class on the CHARM search stack, its prefix, its nodes (with those removed by properties 1 and 3
+        flagged), their tid representation, the root pair counts when known, the position of the next node to extend
+        and the closed itemset left to insert once the class of that node's children is done
+        
+        suffix_lengths[i] counts the items of nodes i onwards, the most any itemset from node i can add to the prefix
+    '''
+    __slots__ = ('prefix_items', 'nodes', 'removed_nodes', 'diffset_mode', 'pair_tid_counts', 'pair_supports', 'next_node', 
+        'pending_closed', 'suffix_lengths')
+    
+    def __init__(self, prefix_items: list, nodes: list, diffset_mode: bool, pair_tid_counts=None, pair_supports=None):
+        self.prefix_items = prefix_items
+        self.nodes = nodes
+        self.removed_nodes = [False] * len(nodes)
+        self.diffset_mode = diffset_mode
+        self.pair_tid_counts = pair_tid_counts
+        self.pair_supports = pair_supports
+        self.next_node = 0
+        self.pending_closed = None
+        self.suffix_lengths = list(itertools.accumulate(reversed([len(node.items) for node in nodes])))[::-1]
+
+def _CHARM_combine(node: _CHARMNode, sibling: _CHARMNode, diffset_mode: bool, count_support) -> _CHARMNode:
+    '''
+        Child node of X u Y from the tidsets (or diffsets) of siblings X and Y
+    '''
+    if diffset_mode:
+        #d(XY) = d(Y) - d(X), the tids of X missing from XY
+        child_tids = np.setdiff1d(sibling.tids, node.tids, assume_unique=True)
+        return _CHARMNode(sibling.items, child_tids, node.support - count_support(child_tids), 
+            node.tid_sum - int(np.sum(child_tids, dtype=np.int64)), node.tid_count - len(child_tids))
+    
+    child_tids = np.intersect1d(node.tids, sibling.tids, assume_unique=True)
+    return _CHARMNode(sibling.items, child_tids, count_support(child_tids), int(np.sum(child_tids, dtype=np.int64)), len(child_tids))
+
+def _CHARM_prefers_diffsets(parent_node: _CHARMNode, child_nodes: list) -> bool:
+    '''
+        Diffsets pay off once the children lose fewer of their parent's transactions than they keep
+    '''
+    kept_tids = sum(child_node.tid_count for child_node in child_nodes)
+    return len(child_nodes) * parent_node.tid_count - kept_tids < kept_tids
+
+def _CHARM_to_diffsets(parent_node: _CHARMNode, child_nodes: list) -> list:
+    '''
+        Converts the tidset children of a node into diffsets relative to it
+    '''
+    for child_node in child_nodes:
+        child_node.tids = np.setdiff1d(parent_node.tids, child_node.tids, assume_unique=True)
+    return child_nodes
+
+def _CHARM_is_closed(encoded_transactions: SparseEncodedTransactions, itemset, search_columns) -> bool:
+    '''
+        Whether no column of search_columns outside the itemset occurs in every transaction containing the itemset
+    '''
+    itemset = list(itemset)
+    itemset_tids = encoded_transactions.item_tidlist(itemset[0])
+    for item in itemset[1:]:
+        itemset_tids = np.intersect1d(itemset_tids, encoded_transactions.item_tidlist(item), assume_unique=True)
+    item_counts = np.bincount(encoded_transactions.transactions_items(itemset_tids)[1], minlength=encoded_transactions.number_of_items)
+    item_counts[itemset] = 0
+    return not np.any(item_counts[search_columns] == len(itemset_tids))
+
+def _CHARM_insert_closed(closed_itemset_hash: dict, itemset: list, support: int, tid_sum: int, search_statistics: SearchStatistics):
+    '''
+        Adds an itemset to the closed itemsets unless a known closed itemset subsumes it
+        
+        A subsuming itemset is a superset with the same tidset, so it shares the same tid sum and support and only
+        the itemsets in that hash bucket need to be compared
+    '''
+    itemset = frozenset(itemset)
+    closed_itemset_bucket = closed_itemset_hash.setdefault((tid_sum, support), [])
+    search_statistics.subsumption_tests += len(closed_itemset_bucket)
+    if any(itemset <= closed_itemset for closed_itemset, closed_support in closed_itemset_bucket):
         return
+    closed_itemset_bucket.append((itemset, support))
+
+def support_envelope_on_encoded_collection(encoded_transactions, transaction_encoder, min_support_ratios, transaction_weights=None,
+    diffsets: bool=None, search_statistics: SearchStatistics=None, return_statistics: bool=False):
+    '''
+        Closed and maximal itemsets at several minimum support ratios from a single CHARM run at the lowest of them
         
+        Closedness does not depend on the threshold, so the closed itemsets at a higher ratio are those of the lowest 
+        one which still reach its minimum support count. Every maximal itemset is closed, and a closed itemset is 
+        maximal exactly while the threshold stays above the support of its most frequent closed superset (see
+        ClosureIndex.closed_superset_supports), so each closed itemset is maximal over one band of thresholds, its
+        support envelope. Sweeping the thresholds is then a comparison of two support arrays per threshold.
+        
+        transaction_weights, diffsets and search_statistics are handed to CHARM_on_encoded_collection, the time 
+        spent deriving the thresholds is recorded as the 'envelope' phase
+        
+        Returns {min support ratio: {'closed': closed itemsets, 'maximal': maximal itemsets}}, both in the 
+        {itemset size: {frozenset of values: support}} format of CHARM_on_encoded_collection
+    '''
+    if search_statistics is None:
+        search_statistics = SearchStatistics()
+    min_support_ratios = sorted(set(min_support_ratios))
+    closed_itemsets = CHARM_on_encoded_collection(encoded_transactions, transaction_encoder, min_support_ratios[0], transaction_weights, 
+        diffsets, search_statistics)
+    
+    with search_statistics.timed_phase('envelope'):
+        if transaction_weights is None:
+            total_transaction_count = encoded_transactions.shape[0]
+        else:
+            total_transaction_count = int(np.sum(transaction_weights))
+        closure_index = ClosureIndex(closed_itemsets)
+        superset_supports = closure_index.closed_superset_supports()
+        
+        envelope_itemsets = {}
+        for min_support_ratio in min_support_ratios:
+            min_support_count = minimum_support_count(min_support_ratio, total_transaction_count)
+            threshold_itemsets = envelope_itemsets[min_support_ratio] = {'closed': {}, 'maximal': {}}
+            for closed_number in np.flatnonzero(closure_index.supports >= min_support_count).tolist():
+                itemset, support = closure_index.closed_itemsets[closed_number], int(closure_index.supports[closed_number])
+                threshold_itemsets['closed'].setdefault(len(itemset), {})[itemset] = support
+                if superset_supports[closed_number] < min_support_count:
+                    threshold_itemsets['maximal'].setdefault(len(itemset), {})[itemset] = support
     
+    if return_statistics:
+        return (envelope_itemsets, search_statistics)
+    return envelope_itemsets
 
+def rare_itemsets_on_encoded_collection(encoded_transactions, transaction_encoder, max_support_ratio, min_support_ratio=0,
+    sporadic: bool=False, transaction_weights=None, search_statistics: SearchStatistics=None, return_statistics: bool=False):
+    '''
+        Returns the Minimal Rare Itemsets of a transaction database, or with sporadic its sporadic itemsets
+        
+        An itemset is rare when its support ratio is below max_support_ratio. A minimal rare itemset is rare while every 
+        one of its proper subsets is frequent, the border just above the frequent itemsets (Apriori-Rare, Szathmary et
+        al.). The search is depth-first over the frequent itemsets alone, counting every extension of a node with one
+        AND + popcount of the bitmaps as MAFIA does. An extension that is still frequent becomes a child, a rare one 
+        ends its branch and is kept when its other immediate subsets are also frequent. Children are visited in 
+        decreasing rank, which ensures every subset of an extension has been reached before the extension is counted,
+        so that test is a lookup in the frequent itemsets found so far. encode_horizontally_from_collection_rare keeps
+        exactly the frequent items in its encoding.
+        
+        Sporadic itemsets (Apriori-Inverse, Koh and Rountree) are made up of rare items only, the search then runs over
+        the rare items (the encoding of encode_horizontally_from_collection_inverse) and every itemset reaching 
+        min_support_ratio is returned.
+        
+        min_support_ratio is a noise floor in both modes, itemsets below it (and itemsets that never occur) are not 
+        reported. Items missing from the encoding, ex. those removed by the rare encoder, can only be rare on their 
+        own and are reported from the encoder's value_supports.
+        
+        The data may be a dense array or a SparseEncodedTransactions, transaction_weights accepts the duplicate counts 
+        of a collapsed dataset
+        
+        Returns {itemset size: {frozenset of values: support}}, the format of CHARM_on_encoded_collection
+    '''
+    if search_statistics is None:
+        search_statistics = SearchStatistics()
+    with search_statistics.timed_phase('preparation'):
+        number_of_transactions = encoded_transactions.shape[0]
+        if transaction_weights is None:
+            total_transaction_count = number_of_transactions
+        else:
+            total_transaction_count = int(np.sum(transaction_weights))
+        max_support_count = minimum_support_count(max_support_ratio, total_transaction_count)
+        min_support_count = minimum_support_count(min_support_ratio, total_transaction_count)
+        if min_support_count > max_support_count:
+            raise ValueError("min_support_ratio {} is above max_support_ratio {}".format(min_support_ratio, max_support_ratio))
+        
+        #Only items above the noise floor are searched, sporadic itemsets are further limited to the rare items
+        encoded_items = np.array(sorted(transaction_encoder.value_encoder_mapping.values()), dtype=np.intp)
+        if isinstance(encoded_transactions, SparseEncodedTransactions):
+            item_supports = encoded_transactions.item_supports(transaction_weights)
+        else:
+            item_bitmaps = _packed_item_bitmaps(encoded_transactions)
+            item_supports = support_counter(None if transaction_weights is None else pack_weight_planes(transaction_weights))(item_bitmaps)
+        root_items = encoded_items[item_supports[encoded_items] >= min_support_count]
+        if sporadic:
+            root_items = root_items[item_supports[root_items] < max_support_count]
+        root_items = root_items[np.argsort(item_supports[root_items], kind='stable')]
+        if isinstance(encoded_transactions, SparseEncodedTransactions):
+            item_bitmaps = _pack_sparse_item_bitmaps(encoded_transactions, root_items)
+        
+        count_support = support_counter(None if transaction_weights is None else pack_weight_planes(transaction_weights))
+    
+    with search_statistics.timed_phase('search'):
+        #Minimal rare itemsets end the branches above the border, sporadic itemsets are branched on like frequent ones
+        extension_support_count = min_support_count if sporadic else max_support_count
+        frequent_itemsets = set()
+        reported_itemsets = {}
+        
+        #Nodes are (depth, head items in rank order, head bitmap, tail items), the root is the empty itemset covering every
+        #transaction. A node's bitmap is a row of its parent's depth block, which holds until the parent's siblings run.
+        depth_buffers = DepthBuffers()
+        search_nodes = [(0, (), full_bitmap(number_of_transactions), root_items)]
+        while search_nodes:
+            depth, head_items, head_bitmap, tail_items = search_nodes.pop()
+            search_statistics.nodes_visited += 1
+            search_statistics.record_depth(len(head_items))
+            if len(tail_items) == 0:
+                continue
+            
+            tail_bitmaps = depth_buffers.block(depth, len(tail_items), len(head_bitmap))
+            gather_bitmaps(item_bitmaps, tail_items, tail_bitmaps)
+            np.bitwise_and(tail_bitmaps, head_bitmap, out=tail_bitmaps)
+            tail_supports = count_support(tail_bitmaps)
+            search_statistics.support_computations += len(tail_items)
+            
+            #A rare extension is minimal when dropping any head item leaves a frequent itemset (dropping its own item leaves the head),
+            #below a single item head the tail items are frequent extensions already so every rare extension is minimal
+            if not sporadic:
+                rare_rows = np.flatnonzero((tail_supports < max_support_count) & (tail_supports >= min_support_count))
+                for tail_item, support in zip(tail_items[rare_rows].tolist(), tail_supports[rare_rows].tolist()):
+                    candidate_itemset = head_items + (tail_item,)
+                    if len(head_items) > 1:
+                        search_statistics.subsumption_tests += len(head_items)
+                        if not all(candidate_itemset[:position] + candidate_itemset[position + 1:] in frequent_itemsets 
+                            for position in range(len(head_items))):
+                            continue
+                    reported_itemsets[candidate_itemset] = support
+            
+            #Children are pushed in increasing rank so they run in decreasing rank, each taking the extensions after it
+            extension_rows = np.flatnonzero(tail_supports >= extension_support_count)
+            extension_items = tail_items[extension_rows]
+            for extension_index, tail_item in enumerate(extension_items.tolist()):
+                child_items = head_items + (tail_item,)
+                if sporadic:
+                    reported_itemsets[child_items] = int(tail_supports[extension_rows[extension_index]])
+                else:
+                    frequent_itemsets.add(child_items)
+                search_nodes.append((depth + 1, child_items, tail_bitmaps[extension_rows[extension_index]], 
+                    extension_items[extension_index + 1:]))
+    
+    #Decode the discovered itemsets back to the original values, adding the rare items the encoding left out
+    decoder_map = transaction_encoder.value_decoder_mapping
+    translated_itemsets = {}
+    for itemset, support in reported_itemsets.items():
+        translated_itemsets.setdefault(len(itemset), {})[frozenset(decoder_map[item] for item in itemset)] = support
+    for value, support in transaction_encoder.value_supports.items():
+        if value not in transaction_encoder.value_encoder_mapping and min_support_count <= support < max_support_count:
+            translated_itemsets.setdefault(1, {})[frozenset([value])] = support
     
-    
\ No newline at end of file
+    if return_statistics:
+        return (translated_itemsets, search_statistics)
+    return translated_itemsets
@@ -0,0 +1,258 @@
+'''
+    Reproducible workloads and a timing harness for comparing the mining engines
+
+    Two sources of transactions are provided, both returned as a Python List-of-Lists like the collections the
+    encoders accept:
+
+    - generate_quest_transactions, a synthetic basket generator following the IBM Quest procedure of Agrawal and
+      Srikant (the generator behind the T10I4D100K family of datasets)
+    - load_fimi_transactions, a reader for the FIMI repository .dat layout (chess, mushroom, retail, T10I4D100K...)
+      with one transaction per line as whitespace separated integer items
+
+    benchmark_engines times encoding and mining for each engine across a sweep of minimum supports and records the
+    peak memory and the number of itemsets found, write_benchmark_report stores the records as JSON.
+
+    The module can also be run directly, ex.
+
+    ##
+    python -m MaxMiner.benchmarkUtils --quest 10 4 100000 1000 --supports 0.01 0.005 --output quest.json
+    python -m MaxMiner.benchmarkUtils --fimi chess.dat --supports 0.9 0.8 --engines MAFIA CHARM
+    ##
+'''
+import argparse
+import json
+import os
+import platform
+import time
+import tracemalloc
+from typing import Iterable, List
+
+import numpy as np
+
+import MaxMiner
+from MaxMiner.searchStatistics import SearchStatistics
+from MaxMiner.transactionalUtils import generate_transactional_encoder_from_collection
+
+#Mean and standard deviation of the per pattern corruption level, as in the Quest generator
+_QUEST_CORRUPTION_MEAN = 0.5
+_QUEST_CORRUPTION_DEVIATION = 0.1
+
+
+def generate_quest_transactions(number_of_transactions: int, average_transaction_length: float, average_pattern_length: float,
+    number_of_items: int, number_of_patterns: int=2000, correlation: float=0.5, seed: int=0) -> List[List[int]]:
+    '''
+        Generates market basket transactions with the IBM Quest procedure, T10I4D100K with 1000 items is
+        generate_quest_transactions(100000, 10, 4, 1000)
+
+        A pool of number_of_patterns potentially frequent itemsets is drawn first. Pattern sizes are Poisson around
+        average_pattern_length, each pattern takes an exponentially distributed fraction (mean correlation) of its
+        items from the previous pattern and the rest at random, and patterns receive exponentially distributed weights
+        and a normally distributed corruption level.
+
+        Each transaction has a Poisson size around average_transaction_length and is filled with patterns picked by
+        weight. Items of a picked pattern are dropped while a uniform draw stays below its corruption level, and a
+        pattern which does not fit is added anyway half of the time, otherwise it starts the next transaction.
+
+        The same arguments and seed always produce the same transactions
+    '''
+    random_generator = np.random.default_rng(seed)
+
+    patterns = []
+    previous_pattern = np.empty(0, dtype=np.int64)
+    for pattern_size in np.maximum(random_generator.poisson(average_pattern_length, number_of_patterns), 1).tolist():
+        pattern_size = min(pattern_size, number_of_items)
+        shared_fraction = min(random_generator.exponential(correlation), 1.0)
+        shared_size = min(int(round(shared_fraction * pattern_size)), len(previous_pattern))
+        shared_items = random_generator.choice(previous_pattern, shared_size, replace=False) if shared_size else previous_pattern[:0]
+
+        #Draw the remaining items from those not shared, oversampling once keeps this vectorized
+        remaining_items = np.setdiff1d(random_generator.choice(number_of_items, 2 * pattern_size + len(shared_items)), shared_items)
+        if len(remaining_items) < pattern_size - shared_size:
+            remaining_items = np.setdiff1d(np.arange(number_of_items), shared_items)
+        remaining_items = random_generator.permutation(remaining_items)[:pattern_size - shared_size]
+
+        previous_pattern = np.concatenate((shared_items, remaining_items))
+        patterns.append(previous_pattern)
+
+    pattern_weights = random_generator.exponential(1.0, number_of_patterns)
+    pattern_weights /= pattern_weights.sum()
+    corruption_levels = np.clip(random_generator.normal(_QUEST_CORRUPTION_MEAN, _QUEST_CORRUPTION_DEVIATION, number_of_patterns), 0, 1)
+
+    #Patterns are picked in batches, one draw per expected pattern of a transaction is plenty
+    pattern_draws = iter(())
+    carried_pattern = None
+    transactions = []
+    for transaction_length in np.maximum(random_generator.poisson(average_transaction_length, number_of_transactions), 1).tolist():
+        transaction = set()
+        while len(transaction) < transaction_length:
+            if carried_pattern is not None:
+                pattern_index, carried_pattern = carried_pattern, None
+            else:
+                pattern_index = next(pattern_draws, None)
+                if pattern_index is None:
+                    pattern_draws = iter(random_generator.choice(number_of_patterns, 4096, p=pattern_weights).tolist())
+                    pattern_index = next(pattern_draws)
+
+            pattern = patterns[pattern_index]
+            kept_items = len(pattern)
+            while kept_items > 0 and random_generator.random() < corruption_levels[pattern_index]:
+                kept_items -= 1
+            pattern_items = random_generator.permutation(pattern)[:kept_items]
+
+            if transaction and len(transaction) + len(pattern_items) > transaction_length and random_generator.random() < 0.5:
+                carried_pattern = pattern_index
+                break
+            transaction.update(pattern_items.tolist())
+        transactions.append(sorted(transaction))
+    return transactions
+
+
+def load_fimi_transactions(file_path: str) -> List[List[int]]:
+    '''
+        Reads a FIMI repository .dat file, one transaction per line as whitespace separated integer items
+
+        Blank lines are kept as empty transactions so the transaction count matches the file
+    '''
+    with open(file_path, 'r') as input_file:
+        return [[int(item) for item in line.split()] for line in input_file]
+
+
+def _run_MAFIA(transactions, transaction_encoder, min_support_ratio, sparse, search_statistics):
+    encoded_transactions, encoder_key = transaction_encoder.encode_horizontally_from_collection_frequent(transactions, min_support_ratio,
+        sparse=sparse)
+    yield
+    yield len(MaxMiner.MAFIA_on_encoded_collection(encoded_transactions, transaction_encoder, min_support_ratio, 
+        search_statistics=search_statistics))
+
+def _run_MaxMiner(transactions, transaction_encoder, min_support_ratio, sparse, search_statistics):
+    encoded_transactions, encoder_key = transaction_encoder.encode_horizontally_from_collection_frequent(transactions, min_support_ratio,
+        sparse=sparse)
+    yield
+    yield len(MaxMiner.MaxMiner_on_encoded_collection(encoded_transactions, transaction_encoder, min_support_ratio, 
+        search_statistics=search_statistics))
+
+def _run_CHARM(transactions, transaction_encoder, min_support_ratio, sparse, search_statistics):
+    encoded_transactions, encoder_key = transaction_encoder.encode_horizontally_from_collection_frequent(transactions, min_support_ratio,
+        sparse=sparse)
+    yield
+    closed_itemsets = MaxMiner.CHARM_on_encoded_collection(encoded_transactions, transaction_encoder, min_support_ratio,
+        search_statistics=search_statistics)
+    yield sum(len(size_itemsets) for size_itemsets in closed_itemsets.values())
+
+def _run_FPMAX(transactions, transaction_encoder, min_support_ratio, sparse, search_statistics):
+    #FP-MAX reads the collection directly, there is no encoding step beyond the encoder itself
+    yield
+    yield len(MaxMiner.FPMAX_on_collection(transactions, transaction_encoder, min_support_ratio, search_statistics=search_statistics))
+
+#Each runner is a generator which encodes up to its first yield and mines up to its second, yielding the result count
+BENCHMARK_ENGINES = {
+    'MAFIA': _run_MAFIA,
+    'MaxMiner': _run_MaxMiner,
+    'CHARM': _run_CHARM,
+    'FPMAX': _run_FPMAX,
+}
+
+
+def benchmark_engines(transactions: list, min_support_ratios: Iterable[float], engines: Iterable[str]=('MAFIA', 'CHARM'),
+    dataset_name: str='', sparse: bool=False, measure_memory: bool=True) -> List[dict]:
+    '''
+        Times each engine (a key of BENCHMARK_ENGINES) at each minimum support ratio over a collection of transactions
+
+        Every run builds a fresh encoder, so the recorded encoding time covers generating the encoder and encoding
+        the frequent items, and mining time covers the engine alone. With measure_memory each run is repeated under
+        tracemalloc to record its peak traced memory (numpy buffers included), this is kept out of the timed run
+        as tracing slows allocation heavy code down.
+
+        Each record also holds the engine's SearchStatistics of the timed run (as_dict), which includes the time of
+        each of its phases.
+
+        Returns one record per (engine, support) pair
+    '''
+    benchmark_records = []
+    for min_support_ratio in min_support_ratios:
+        for engine in engines:
+            run_engine = BENCHMARK_ENGINES[engine]
+
+            encoding_start = time.perf_counter()
+            transaction_encoder = generate_transactional_encoder_from_collection(transactions)
+            search_statistics = SearchStatistics()
+            engine_run = run_engine(transactions, transaction_encoder, min_support_ratio, sparse, search_statistics)
+            next(engine_run)
+            mining_start = time.perf_counter()
+            result_count = next(engine_run)
+            mining_end = time.perf_counter()
+
+            benchmark_record = {
+                'dataset': dataset_name,
+                'engine': engine,
+                'min_support_ratio': min_support_ratio,
+                'sparse': sparse,
+                'number_of_transactions': len(transactions),
+                'result_count': result_count,
+                'encoding_seconds': mining_start - encoding_start,
+                'mining_seconds': mining_end - mining_start,
+                'peak_memory_bytes': None,
+                'search_statistics': search_statistics.as_dict(),
+            }
+
+            if measure_memory:
+                tracemalloc.start()
+                try:
+                    for step in run_engine(transactions, generate_transactional_encoder_from_collection(transactions), min_support_ratio, sparse,
+                        SearchStatistics()):
+                        pass
+                    benchmark_record['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1]
+                finally:
+                    tracemalloc.stop()
+
+            benchmark_records.append(benchmark_record)
+    return benchmark_records
+
+
+def write_benchmark_report(benchmark_records: List[dict], file_path: str):
+    '''
+        Writes benchmark records to a JSON file along with the versions they were measured on
+    '''
+    benchmark_report = {
+        'python_version': platform.python_version(),
+        'numpy_version': np.__version__,
+        'platform': platform.platform(),
+        'records': benchmark_records,
+    }
+    with open(file_path, 'w') as output_file:
+        json.dump(benchmark_report, output_file, indent=2)
+
+
+def main(arguments=None):
+    argument_parser = argparse.ArgumentParser(description='Time the MaxMiner engines over a sweep of minimum supports')
+    dataset_arguments = argument_parser.add_mutually_exclusive_group(required=True)
+    dataset_arguments.add_argument('--fimi', metavar='PATH', help='FIMI .dat file to mine')
+    dataset_arguments.add_argument('--quest', nargs=4, type=float, metavar=('T', 'I', 'D', 'N'),
+        help='Quest synthetic data, average transaction length, average pattern length, transactions and items')
+    argument_parser.add_argument('--supports', nargs='+', type=float, required=True, help='Minimum support ratios')
+    argument_parser.add_argument('--engines', nargs='+', default=['MAFIA', 'CHARM'], choices=sorted(BENCHMARK_ENGINES))
+    argument_parser.add_argument('--sparse', action='store_true', help='Encode the transactions sparsely')
+    argument_parser.add_argument('--seed', type=int, default=0, help='Seed of the Quest generator')
+    argument_parser.add_argument('--no-memory', action='store_true', help='Skip the peak memory measurement')
+    argument_parser.add_argument('--output', default='benchmark.json', help='JSON file to write the records to')
+    arguments = argument_parser.parse_args(arguments)
+
+    if arguments.fimi:
+        transactions = load_fimi_transactions(arguments.fimi)
+        dataset_name = os.path.basename(arguments.fimi)
+    else:
+        average_transaction_length, average_pattern_length, number_of_transactions, number_of_items = arguments.quest
+        transactions = generate_quest_transactions(int(number_of_transactions), average_transaction_length, average_pattern_length,
+            int(number_of_items), seed=arguments.seed)
+        dataset_name = 'T{:g}I{:g}D{:g}N{:g}'.format(*arguments.quest)
+
+    benchmark_records = benchmark_engines(transactions, arguments.supports, arguments.engines, dataset_name, arguments.sparse,
+        not arguments.no_memory)
+    for benchmark_record in benchmark_records:
+        print('{dataset} {engine} {min_support_ratio}: {result_count} itemsets, encoding {encoding_seconds:.3f}s, '
+            'mining {mining_seconds:.3f}s, peak memory {peak_memory_bytes}'.format(**benchmark_record))
+    write_benchmark_report(benchmark_records, arguments.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+'''
+    Packed vertical bitmap helpers used by the mining engines
+
+    Each item (column) of a Transaction Encoded dataset is stored as a row of unsigned 64 bit
+    words, where bit j of the array represents transaction j. This is the Vertical Bitmap
+    Representation described in the MAFIA paper, packed 64 transactions to a word so that
+    the support of an itemset is the popcount of the AND of its item bitmaps.
+
+    ##
+    encoded_transactions           item_bitmaps (bits shown little-endian, transaction 0 first)
+    [[True, True ],                [[1, 1, 0, ...],
+     [True, False],       ->        [1, 0, 1, ...]]
+     [False, True]]
+    ##
+'''
+import functools
+
+import numpy as np
+
+WORD_BITS = 64
+WORD_DTYPE = np.dtype('<u8')
+
+#numpy >= 2.0 ships a native popcount ufunc, older versions fall back to a byte lookup table
+if hasattr(np, 'bitwise_count'):
+    def _word_popcounts(bitmaps):
+        return np.bitwise_count(bitmaps)
+else:
+    _BYTE_POPCOUNTS = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+    def _word_popcounts(bitmaps):
+        bitmaps = np.ascontiguousarray(bitmaps)
+        byte_view = bitmaps.view(np.uint8).reshape(bitmaps.shape + (8,))
+        return _BYTE_POPCOUNTS[byte_view].sum(axis=-1, dtype=np.uint8)
+
+
+def number_of_words(number_of_transactions: int) -> int:
+    '''
+        Number of 64 bit words required to hold one bit per transaction
+    '''
+    return (number_of_transactions + WORD_BITS - 1) // WORD_BITS
+
+
+def pack_encoded_columns(encoded_transactions) -> np.ndarray:
+    '''
+        Converts a horizontally encoded (transactions x items) boolean array into packed item
+        bitmaps of shape (items, words)
+
+        Padding bits beyond the final transaction are always zero, so they never contribute
+        to a support count.
+    '''
+    number_of_transactions, number_of_items = encoded_transactions.shape
+    words = number_of_words(number_of_transactions)
+
+    #Pack down the transaction axis so we never materialize a transposed copy of the bool matrix
+    packed_bytes = np.packbits(encoded_transactions, axis=0, bitorder='little')
+    item_bytes = np.zeros((number_of_items, words * 8), dtype=np.uint8)
+    item_bytes[:, :packed_bytes.shape[0]] = packed_bytes.T
+
+    return item_bytes.view(WORD_DTYPE)
+
+
+def full_bitmap(number_of_transactions: int) -> np.ndarray:
+    '''
+        Bitmap with a bit set for every transaction, the cover of the empty itemset
+    '''
+    bitmap = np.zeros(number_of_words(number_of_transactions), dtype=WORD_DTYPE)
+    full_words, remaining_bits = divmod(number_of_transactions, WORD_BITS)
+    bitmap[:full_words] = np.iinfo(WORD_DTYPE).max
+    if remaining_bits:
+        bitmap[full_words] = (1 << remaining_bits) - 1
+    return bitmap
+
+
+def popcount(bitmaps) -> np.ndarray:
+    '''
+        Number of set bits in each bitmap (summed over the last axis)
+
+        Accepts a single bitmap (returns a scalar) or a 2D array of bitmaps (returns one count
+        per row)
+    '''
+    return _word_popcounts(bitmaps).sum(axis=-1, dtype=np.int64)
+
+
+def bitmap_to_tids(bitmap, number_of_transactions: int) -> np.ndarray:
+    '''
+        Expands a packed bitmap back into the sorted transaction ids it contains
+    '''
+    bits = np.unpackbits(np.ascontiguousarray(bitmap).view(np.uint8), bitorder='little')
+    return np.flatnonzero(bits[:number_of_transactions])
+
+
+def pack_weight_planes(transaction_weights) -> np.ndarray:
+    '''
+        Splits non-negative integer transaction weights into bit planes, returned as packed bitmaps
+        of shape (planes, words) where plane k holds the transactions whose weight has bit k set
+
+        This lets weighted supports be counted with the same AND + popcount as unweighted ones,
+        see weighted_popcount
+    '''
+    transaction_weights = np.asarray(transaction_weights, dtype=np.uint64)
+    number_of_planes = int(transaction_weights.max()).bit_length() if len(transaction_weights) else 0
+    plane_shifts = np.arange(number_of_planes, dtype=np.uint64)
+    plane_bits = ((transaction_weights[:, np.newaxis] >> plane_shifts) & np.uint64(1)).astype(bool)
+    return pack_encoded_columns(plane_bits)
+
+
+def weighted_popcount(bitmaps, weight_planes) -> np.ndarray:
+    '''
+        Sum of the weights of the transactions set in each bitmap
+
+        sum_k 2^k * popcount(bitmap AND plane_k), which needs one extra AND per bit of the largest weight
+    '''
+    weighted_counts = np.zeros(np.shape(bitmaps)[:-1], dtype=np.int64)
+    for plane_index, weight_plane in enumerate(weight_planes):
+        weighted_counts += popcount(bitmaps & weight_plane) << plane_index
+    return weighted_counts
+
+
+def support_counter(weight_planes=None):
+    '''
+        Returns the support counting function for a run, plain popcount or the weighted popcount
+        when the transactions carry duplicate counts
+    '''
+    if weight_planes is None:
+        return popcount
+    return functools.partial(weighted_popcount, weight_planes=weight_planes)
+
+
+def project_bitmaps(bitmaps, transaction_ids) -> np.ndarray:
+    '''
+        Restricts bitmaps to the given (sorted) transactions, renumbered 0..len(transaction_ids)-1, so the
+        bitmaps of a sparse subtree shrink to the transactions of its head
+
+        Each bitmap's bits at transaction_ids are gathered and packed again, returning (bitmaps, words)
+    '''
+    transaction_ids = np.asarray(transaction_ids, dtype=np.int64)
+    bitmaps = np.asarray(bitmaps).reshape(-1, np.shape(bitmaps)[-1])
+    gathered_bits = (bitmaps[:, transaction_ids // WORD_BITS] >> (transaction_ids % WORD_BITS).astype(np.uint64)) & np.uint64(1)
+    return pack_encoded_columns(gathered_bits.T.astype(bool))
+
+
+def project_support_counter(count_support, transaction_ids):
+    '''
+        Support counter (see support_counter) for bitmaps projected onto transaction_ids, popcount stays as it is
+        and a weighted counter takes its weight planes projected the same way
+    '''
+    weight_planes = getattr(count_support, 'keywords', {}).get('weight_planes')
+    if weight_planes is None:
+        return count_support
+    return support_counter(project_bitmaps(weight_planes, transaction_ids))
+
+
+def pack_coordinates(rows, transaction_ids, number_of_rows: int, number_of_transactions: int) -> np.ndarray:
+    '''
+        Packs (row, transaction) pairs, ex. the occurrences of a sparse encoding, into bitmaps of shape
+        (number_of_rows, words) without going through a dense bool array
+    '''
+    bitmaps = np.zeros((number_of_rows, number_of_words(number_of_transactions)), dtype=WORD_DTYPE)
+    transaction_ids = np.asarray(transaction_ids, dtype=np.int64)
+    np.bitwise_or.at(bitmaps, (rows, transaction_ids // WORD_BITS),
+        np.left_shift(np.uint64(1), (transaction_ids % WORD_BITS).astype(np.uint64)))
+    return bitmaps
+
+
+class ProjectedBitmaps:
+    '''
+        Bitmaps for a subset of the item columns (ex. the frequent tail of a projected subproblem), indexed by
+        the original column numbers like a full (items x words) array
+
+        items must be sorted, bitmaps holds one row per item in the same order
+    '''
+
+    def __init__(self, items, bitmaps):
+        self.items = np.asarray(items)
+        self.bitmaps = bitmaps
+
+    def __getitem__(self, items):
+        return self.bitmaps[np.searchsorted(self.items, items)]
+
+    def __len__(self):
+        return len(self.items)
+
+
+def gather_bitmaps(item_bitmaps, items, out) -> np.ndarray:
+    '''
+        Writes item_bitmaps[items] into out, a C contiguous (len(items), words) array, without allocating
+
+        item_bitmaps is a full (items x words) array or a ProjectedBitmaps
+    '''
+    if isinstance(item_bitmaps, ProjectedBitmaps):
+        item_bitmaps, items = item_bitmaps.bitmaps, np.searchsorted(item_bitmaps.items, items)
+    return np.take(item_bitmaps, items, axis=0, out=out, mode='clip')
+
+
+class DepthBuffers:
+    '''
+        Scratch bitmap blocks of a depth-first search, one per depth and reused by every node at that depth
+
+        A node's block holds the bitmaps of its tail, which stay valid while its descendants write to the deeper
+        blocks, so the whole search needs depth x (tail x words) words however many nodes it visits. Blocks are
+        flat and only ever grow (doubling), a node gets a C contiguous (rows, words) view of its depth's block.
+    '''
+
+    def __init__(self):
+        self.blocks = []
+
+    def block(self, depth: int, rows: int, words: int) -> np.ndarray:
+        while len(self.blocks) <= depth:
+            self.blocks.append(np.empty(0, dtype=WORD_DTYPE))
+        if len(self.blocks[depth]) < rows * words:
+            self.blocks[depth] = np.empty(max(rows * words, 2 * len(self.blocks[depth])), dtype=WORD_DTYPE)
+        return self.blocks[depth][:rows * words].reshape(rows, words)
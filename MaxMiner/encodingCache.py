@@ -0,0 +1,169 @@
+'''
+    On-disk format for encoded datasets, memory mapped on load, and a cache keyed on the source file's content
+
+    An encoded dataset is saved as a directory of .npy arrays next to a JSON sidecar:
+
+    ##
+    encoder.json                    format version, layout, vocabulary (values in column order) with their
+                                    supports, number of transactions and of encoded rows, source content hash and
+                                    support threshold
+    item_bitmaps.npy                dense layout, the packed item bitmaps of PackedEncodedTransactions (items x
+                                    64 bit words, an eighth of the bool array), mined by MAFIA as they are
+    indptr.npy, indices.npy         sparse layout, the CSR arrays of SparseEncodedTransactions
+    item_indptr.npy, item_tids.npy  sparse layout, its per item tid-lists (the CSC view the engines read)
+    transaction_weights.npy         duplicate counts, when the transactions were collapsed
+    ##
+
+    load_encoded_dataset memory maps every array read only, nothing is copied or parsed beyond the sidecar and pages
+    are only read as the engines touch them, so many processes mining the same snapshot share one copy through the
+    page cache.
+
+    encode_csv_cached returns the same result as encode_horizontally_from_csv_streaming (a dense layout as
+    PackedEncodedTransactions), encoding (and saving) only when no saved dataset matches the file's SHA-256, the
+    support threshold and the layout requested.
+'''
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from MaxMiner.transactionalUtils import (PackedEncodedTransactions, SparseEncodedTransactions, TransactionalEncoder, 
+    encode_horizontally_from_csv_streaming)
+
+ENCODED_DATASET_FORMAT_VERSION = 2
+
+_SIDECAR_FILE_NAME = 'encoder.json'
+_HASH_BLOCK_BYTES = 1 << 20
+
+
+def file_content_hash(file_path: str) -> str:
+    '''
+        SHA-256 hex digest of a file's bytes, read in 1MB blocks
+    '''
+    content_hash = hashlib.sha256()
+    with open(file_path, 'rb') as input_file:
+        for block in iter(lambda: input_file.read(_HASH_BLOCK_BYTES), b''):
+            content_hash.update(block)
+    return content_hash.hexdigest()
+
+
+def save_encoded_dataset(directory: str, transaction_encoder: TransactionalEncoder, encoded_transactions, transaction_weights=None,
+    source_hash: str=None, min_support_ratio: float=None):
+    '''
+        Writes an encoded dataset (a dense array, PackedEncodedTransactions or SparseEncodedTransactions) and its 
+        encoder to directory, a dense array is saved packed
+
+        The vocabulary is stored in column order with the supports from the encoder's value_supports, values have to
+        be JSON serializable (CSV and FIMI values always are)
+    '''
+    os.makedirs(directory, exist_ok=True)
+    sparse = isinstance(encoded_transactions, SparseEncodedTransactions)
+    if sparse:
+        item_indptr, item_tids = encoded_transactions.item_tidlists()
+        saved_arrays = {'indptr': encoded_transactions.indptr, 'indices': encoded_transactions.indices, 'item_indptr': item_indptr,
+            'item_tids': item_tids}
+    else:
+        if not isinstance(encoded_transactions, PackedEncodedTransactions):
+            encoded_transactions = PackedEncodedTransactions.from_dense(np.asarray(encoded_transactions, dtype=bool))
+        saved_arrays = {'item_bitmaps': encoded_transactions.item_bitmaps}
+    if transaction_weights is not None:
+        saved_arrays['transaction_weights'] = np.asarray(transaction_weights, dtype=np.int64)
+    for array_name, saved_array in saved_arrays.items():
+        np.save(os.path.join(directory, array_name + '.npy'), saved_array)
+
+    decoder_map = transaction_encoder.value_decoder_mapping
+    values = [decoder_map[column] for column in range(encoded_transactions.shape[1])]
+    sidecar = {
+        'format_version': ENCODED_DATASET_FORMAT_VERSION,
+        'layout': 'sparse' if sparse else 'dense',
+        'number_of_transactions': transaction_encoder.number_of_transactions,
+        'number_of_rows': encoded_transactions.shape[0],
+        'values': values,
+        'value_supports': [transaction_encoder.value_supports[value] for value in values],
+        'source_hash': source_hash,
+        'min_support_ratio': min_support_ratio,
+        'collapsed': transaction_weights is not None,
+    }
+    with open(os.path.join(directory, _SIDECAR_FILE_NAME), 'w') as sidecar_file:
+        json.dump(sidecar, sidecar_file)
+
+
+def read_encoded_dataset_sidecar(directory: str) -> dict:
+    '''
+        The JSON sidecar of a saved dataset, None when the directory holds no dataset of this format version
+    '''
+    try:
+        with open(os.path.join(directory, _SIDECAR_FILE_NAME), 'r') as sidecar_file:
+            sidecar = json.load(sidecar_file)
+    except (OSError, ValueError):
+        return None
+    if sidecar.get('format_version') != ENCODED_DATASET_FORMAT_VERSION:
+        return None
+    return sidecar
+
+
+def load_encoded_dataset(directory: str, mmap_mode: str='r'):
+    '''
+        Reads a dataset written by save_encoded_dataset, its arrays memory mapped with mmap_mode (None reads them
+        into memory)
+
+        Returns (transaction encoder, encoded transactions) like encode_horizontally_from_csv_streaming, with the
+        transaction weights as a third element when they were saved. A dense dataset is returned as
+        PackedEncodedTransactions over the memory mapped bitmaps.
+    '''
+    sidecar = read_encoded_dataset_sidecar(directory)
+    if sidecar is None:
+        raise ValueError("No encoded dataset of format version {} in {}".format(ENCODED_DATASET_FORMAT_VERSION, directory))
+
+    def load_array(array_name):
+        return np.load(os.path.join(directory, array_name + '.npy'), mmap_mode=mmap_mode)
+
+    transaction_encoder = TransactionalEncoder(dict(zip(sidecar['values'], sidecar['value_supports'])), sidecar['number_of_transactions'])
+    if sidecar['layout'] == 'sparse':
+        encoded_transactions = SparseEncodedTransactions(load_array('indptr'), load_array('indices'), len(sidecar['values']),
+            load_array('item_indptr'), load_array('item_tids'))
+    else:
+        encoded_transactions = PackedEncodedTransactions(load_array('item_bitmaps'), sidecar['number_of_rows'])
+
+    if sidecar['collapsed']:
+        return (transaction_encoder, encoded_transactions, load_array('transaction_weights'))
+    return (transaction_encoder, encoded_transactions)
+
+
+def encode_csv_cached(file_path: str, min_support_ratio_threshhold: float=0, cache_directory: str=None, collapse_duplicates: bool=False,
+    sparse: bool=False, mmap_mode: str='r'):
+    '''
+        encode_horizontally_from_csv_streaming backed by saved datasets in cache_directory (by default a
+        .maxminer_cache directory beside the file)
+
+        Each combination of source content, threshold and layout has its own entry, named after them. A matching
+        entry is loaded memory mapped, otherwise the file is encoded and the result saved before it is returned.
+        Entries are written to a temporary directory and renamed into place, so concurrent workers never read a
+        partial entry (the first to finish keeps its copy).
+    '''
+    if cache_directory is None:
+        cache_directory = os.path.join(os.path.dirname(os.path.abspath(file_path)), '.maxminer_cache')
+    source_hash = file_content_hash(file_path)
+    entry_directory = os.path.join(cache_directory, '{}-{}-{!r}-{}{}'.format(os.path.basename(file_path), source_hash[:16],
+        float(min_support_ratio_threshhold), 'sparse' if sparse else 'dense', '-collapsed' if collapse_duplicates else ''))
+
+    sidecar = read_encoded_dataset_sidecar(entry_directory)
+    if sidecar is not None and sidecar['source_hash'] == source_hash and sidecar['min_support_ratio'] == min_support_ratio_threshhold:
+        return load_encoded_dataset(entry_directory, mmap_mode)
+
+    encoding = encode_horizontally_from_csv_streaming(file_path, min_support_ratio_threshhold, collapse_duplicates=collapse_duplicates,
+        sparse=sparse)
+    os.makedirs(cache_directory, exist_ok=True)
+    staging_directory = tempfile.mkdtemp(prefix='.staging-', dir=cache_directory)
+    try:
+        save_encoded_dataset(staging_directory, *encoding, source_hash=source_hash, min_support_ratio=min_support_ratio_threshhold)
+        if os.path.isdir(entry_directory):
+            shutil.rmtree(entry_directory, ignore_errors=True)
+        os.rename(staging_directory, entry_directory)
+    except OSError:
+        #Another worker renamed its entry into place first
+        shutil.rmtree(staging_directory, ignore_errors=True)
+    return load_encoded_dataset(entry_directory, mmap_mode) if read_encoded_dataset_sidecar(entry_directory) else encoding
@@ -0,0 +1,140 @@
+'''
+    Array backed FP-tree used by the FP-MAX engine
+
+    Items are identified by their rank in the support ordering (rank 0 is the most frequent item) and every
+    transaction is inserted as its sorted ranks, so shared prefixes of frequent items collapse into shared
+    paths. Rather than one Python object per node, the tree is held in flat arrays indexed by node number:
+
+    ##
+    node            0     1     2     3
+    parent         -1     0     0    -1      (-1 is the implicit root)
+    item            0     1     2     1
+    count           5     3     1     2
+    node_link       -1    3    -1    -1      (next node holding the same item, -1 ends the chain)
+
+    header_table    item -> first node of its node-link chain
+    ##
+
+    Construction is vectorized one depth at a time: the nodes at a depth are the distinct (parent node, item) pairs
+    of the transactions reaching it, found with one np.unique over the CSR occurrences at that depth.
+'''
+import numpy as np
+
+NO_NODE = -1
+
+
+class FPTree:
+    '''
+        FP-tree over item ranks 0..number_of_items-1, built with from_transactions
+    '''
+
+    def __init__(self, parent, item, count, number_of_items: int):
+        self.parent = parent
+        self.item = item
+        self.count = count
+        self.number_of_items = number_of_items
+
+        #Node-links thread the nodes of every item in node order, the header table holds the head of each chain
+        node_order = np.argsort(item, kind='stable')
+        self.item_node_counts = np.bincount(item, minlength=number_of_items)
+        self.item_node_indptr = np.concatenate(([0], np.cumsum(self.item_node_counts)))
+        self.header_table = np.full(number_of_items, NO_NODE, dtype=np.int64)
+        self.header_table[self.item_node_counts > 0] = node_order[self.item_node_indptr[:-1][self.item_node_counts > 0]]
+        self.node_link = np.full(len(item), NO_NODE, dtype=np.int64)
+        same_item = item[node_order[1:]] == item[node_order[:-1]]
+        self.node_link[node_order[:-1][same_item]] = node_order[1:][same_item]
+        self._linked_nodes = node_order
+
+    def __len__(self):
+        return len(self.item)
+
+    @classmethod
+    def from_transactions(cls, indptr, items, transaction_weights, number_of_items: int):
+        '''
+            Builds the tree from transactions in CSR form (indptr, items), each row holding distinct item ranks
+            in increasing order, and the number of times each transaction occurs
+
+            The tree is built one depth at a time straight from the CSR occurrences, so memory follows the number of
+            occurrences rather than rows x longest row. The rows are ordered by decreasing length, the rows reaching
+            a depth are then a prefix of that order, and the nodes of a depth are the distinct (parent node, item)
+            pairs of the occurrences at that depth.
+        '''
+        indptr = np.asarray(indptr, dtype=np.int64)
+        items = np.asarray(items, dtype=np.int64)
+        transaction_weights = np.asarray(transaction_weights, dtype=np.int64)
+        lengths = np.diff(indptr)
+        row_order = np.argsort(-lengths, kind='stable')
+        row_order = row_order[lengths[row_order] > 0]
+        if len(row_order) == 0:
+            return cls(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), number_of_items)
+        row_starts, lengths, transaction_weights = indptr[row_order], lengths[row_order], transaction_weights[row_order]
+
+        #Rows still holding an item at each depth, the lengths are decreasing
+        depth_rows = np.searchsorted(-lengths, -np.arange(int(lengths[0])), side='left')
+
+        parents, node_items, counts = [], [], []
+        row_nodes = np.full(len(row_order), NO_NODE, dtype=np.int64)
+        number_of_nodes = 0
+        for depth, number_of_rows in enumerate(depth_rows.tolist()):
+            #A row shares the node of every row with the same parent and item, the first occurrence creates it
+            node_keys = (row_nodes[:number_of_rows] + 1) * number_of_items + items[row_starts[:number_of_rows] + depth]
+            level_keys, level_nodes = np.unique(node_keys, return_inverse=True)
+            parents.append(level_keys // number_of_items - 1)
+            node_items.append(level_keys % number_of_items)
+            counts.append(np.bincount(level_nodes, weights=transaction_weights[:number_of_rows], minlength=len(level_keys)).astype(np.int64))
+            row_nodes = number_of_nodes + level_nodes.reshape(-1)
+            number_of_nodes += len(level_keys)
+        return cls(np.concatenate(parents), np.concatenate(node_items), np.concatenate(counts), number_of_items)
+
+    def item_supports(self) -> np.ndarray:
+        '''
+            Support of every item rank within the tree, the sum of the counts along its node-link chain
+        '''
+        return np.bincount(self.item, weights=self.count, minlength=self.number_of_items).astype(np.int64)
+
+    def items(self) -> np.ndarray:
+        '''
+            Item ranks present in the tree (the non empty header table entries), in increasing rank order
+        '''
+        return np.flatnonzero(self.item_node_counts)
+
+    def item_nodes(self, item: int) -> np.ndarray:
+        '''
+            Nodes on the node-link chain of an item, in chain order
+        '''
+        return self._linked_nodes[self.item_node_indptr[item]:self.item_node_indptr[item + 1]]
+
+    def is_single_path(self) -> bool:
+        '''
+            Whether the tree is empty or a single chain, in which case every subset of the chain is frequent
+        '''
+        return bool(np.all(np.bincount(self.parent + 1) <= 1)) if len(self.parent) else True
+
+    def conditional_pattern_base(self, item: int):
+        '''
+            Prefix paths of every node of an item, returned as CSR transactions (indptr, items) in increasing rank
+            order together with the count of the item's node at the end of each path
+
+            All paths are walked one level at a time in lockstep, following the parent array towards the root
+        '''
+        item_nodes = self.item_nodes(item)
+        path_rows, path_items = [], []
+        rows, current_nodes = np.arange(len(item_nodes)), self.parent[item_nodes]
+        while len(current_nodes):
+            below_root = current_nodes != NO_NODE
+            rows, current_nodes = rows[below_root], current_nodes[below_root]
+            path_rows.append(rows)
+            path_items.append(self.item[current_nodes])
+            current_nodes = self.parent[current_nodes]
+
+        path_rows = np.concatenate(path_rows) if path_rows else np.empty(0, dtype=np.int64)
+        path_items = np.concatenate(path_items) if path_items else np.empty(0, dtype=np.int64)
+        path_order = np.lexsort((path_items, path_rows))
+        indptr = np.concatenate(([0], np.cumsum(np.bincount(path_rows, minlength=len(item_nodes)))))
+        return (indptr, path_items[path_order], self.count[item_nodes])
+
+    def single_path_items(self) -> list:
+        '''
+            Item ranks along a single path tree, see is_single_path
+        '''
+        return sorted(self.item.tolist())
@@ -0,0 +1,171 @@
+'''
+    Incremental maintenance of the frequent, maximal and closed itemsets as batches of transactions arrive
+
+    IncrementalMiner keeps the frequent itemsets F of everything appended so far along with their negative border NB
+    (the infrequent itemsets whose every proper subset is frequent), both with their supports, following the negative
+    border algorithm of Thomas, Bodagala, Alsabti and Ranka (and the FUP observation of Cheung et al. that an itemset
+    can only become frequent by being frequent enough in the increment):
+
+    - Every itemset of F and NB is counted in the new batch only, giving its support over the whole history
+    - Itemsets of F which fall below the (growing) minimum support count leave F
+    - When no itemset of NB reaches the minimum support F is complete, nothing else can have become frequent
+    - Otherwise only the candidates made possible by the promoted itemsets (supersets of them whose subsets are all
+      frequent) are counted against the stored history, level by level until no new itemset is frequent
+
+    The maximal and closed itemsets are read from F, so after every append they are current without a re-mine.
+    Storing F and NB is the price, which grows with the number of frequent itemsets (ex. on dense data at low
+    support a single MAFIA or CHARM run is the better fit).
+'''
+import numpy as np
+
+from MaxMiner.transactionalUtils import SparseEncodedTransactions, TransactionalEncoder, minimum_support_count
+
+
+class IncrementalMiner:
+    '''
+        Frequent itemset state of a growing transaction database at a fixed minimum support ratio
+
+        Transactions are Python collections (a List-of-Lists) as accepted by generate_transactional_encoder_from_collection.
+        Every value is kept by the encoder (nothing is filtered) and the history is stored as SparseEncodedTransactions,
+        itemsets are sorted tuples of its column numbers.
+    '''
+
+    def __init__(self, min_support_ratio: float, transactions=()):
+        self.min_support_ratio = min_support_ratio
+        self.transaction_encoder = TransactionalEncoder({}, 0)
+        self.encoded_transactions = SparseEncodedTransactions(np.zeros(1, dtype=np.int64), np.empty(0, dtype=np.int32), 0)
+        self.frequent_itemsets = {}
+        self.negative_border = {}
+        self.append_transactions(transactions)
+
+    @property
+    def min_support_count(self) -> int:
+        return minimum_support_count(self.min_support_ratio, self.transaction_encoder.number_of_transactions)
+
+    def append_transactions(self, transactions):
+        '''
+            Adds a batch of transactions and brings the frequent itemsets and their negative border up to date
+        '''
+        previous_number_of_items = self.encoded_transactions.number_of_items
+        self.encoded_transactions, encoded_batch = self.transaction_encoder.append_from_collection(transactions,
+            self.encoded_transactions)
+        if encoded_batch.number_of_transactions == 0:
+            return
+        min_support_count = self.min_support_count
+
+        #Known itemsets only need counting in the batch, values seen for the first time join as singletons
+        known_supports = dict(self.frequent_itemsets)
+        known_supports.update(self.negative_border)
+        known_itemsets = list(known_supports)
+        for itemset, batch_support in zip(known_itemsets, encoded_batch.itemset_supports(known_itemsets).tolist()):
+            known_supports[itemset] += batch_support
+        batch_item_supports = encoded_batch.item_supports()
+        for new_item in range(previous_number_of_items, encoded_batch.number_of_items):
+            known_supports[(new_item,)] = int(batch_item_supports[new_item])
+
+        self.frequent_itemsets, self.negative_border = _update_negative_border(self.frequent_itemsets, known_supports,
+            min_support_count, self.encoded_transactions.itemset_supports, self.encoded_transactions.number_of_items)
+
+    def maximal_itemsets(self) -> set:
+        '''
+            Frequent itemsets without a frequent superset, as the set of sorted column number tuples returned by
+            MAFIA_on_encoded_collection
+        '''
+        return derive_maximal_itemsets(self.frequent_itemsets)
+
+    def closed_itemsets(self) -> dict:
+        '''
+            Frequent itemsets without a superset of the same support, in the {itemset size: {frozenset of values: support}}
+            format of CHARM_on_encoded_collection
+        '''
+        return derive_closed_itemsets(self.frequent_itemsets, self.transaction_encoder.value_decoder_mapping)
+
+
+def derive_maximal_itemsets(frequent_itemsets: dict) -> set:
+    '''
+        Maximal itemsets of a complete (downward closed) {sorted column number tuple: support} collection of frequent 
+        itemsets, an itemset is maximal unless it is an immediate subset of another frequent itemset
+    '''
+    covered_itemsets = set()
+    for itemset in frequent_itemsets:
+        if len(itemset) > 1:
+            covered_itemsets.update(_immediate_subsets(itemset))
+    return {itemset for itemset in frequent_itemsets if itemset not in covered_itemsets}
+
+def derive_closed_itemsets(frequent_itemsets: dict, value_decoder_mapping: dict) -> dict:
+    '''
+        Closed itemsets of a complete collection of frequent itemsets, decoded into the CHARM_on_encoded_collection format,
+        an itemset is closed unless an immediate superset has its support
+    '''
+    unclosed_itemsets = set()
+    for itemset, support in frequent_itemsets.items():
+        if len(itemset) > 1:
+            unclosed_itemsets.update(subset for subset in _immediate_subsets(itemset) if frequent_itemsets[subset] == support)
+
+    closed_itemsets = {}
+    for itemset, support in frequent_itemsets.items():
+        if itemset not in unclosed_itemsets:
+            closed_itemsets.setdefault(len(itemset), {})[frozenset(value_decoder_mapping[item] for item in itemset)] = support
+    return closed_itemsets
+
+def _immediate_subsets(itemset: tuple):
+    return (itemset[:position] + itemset[position + 1:] for position in range(len(itemset)))
+
+def _update_negative_border(previous_frequent_itemsets: dict, known_supports: dict, min_support_count: int, count_itemsets,
+    number_of_items: int):
+    '''
+        Frequent itemsets and negative border from the current supports of every itemset previously in either (and
+        any new singletons), candidates made possible by the promoted itemsets are counted over the whole database with
+        count_itemsets (a list of sorted column tuples to their supports) and added to known_supports
+    '''
+    frequent_itemsets = {itemset: support for itemset, support in known_supports.items() if support >= min_support_count}
+    promoted_itemsets = [itemset for itemset in frequent_itemsets if itemset not in previous_frequent_itemsets]
+    demoted_itemsets = {itemset for itemset in previous_frequent_itemsets if itemset not in frequent_itemsets}
+
+    #Grow the promoted itemsets one item at a time, any itemset not counted before which could now be frequent has
+    #a promoted (or newly found) subset one item smaller
+    frequent_items = sorted(itemset[0] for itemset in frequent_itemsets if len(itemset) == 1)
+    new_itemsets_by_size = {}
+    for itemset in promoted_itemsets:
+        new_itemsets_by_size.setdefault(len(itemset), []).append(itemset)
+    while new_itemsets_by_size:
+        itemset_size = min(new_itemsets_by_size)
+        candidate_itemsets = _extend_new_itemsets(new_itemsets_by_size.pop(itemset_size), frequent_items, frequent_itemsets,
+            known_supports)
+        for itemset, support in zip(candidate_itemsets, count_itemsets(candidate_itemsets).tolist()):
+            known_supports[itemset] = support
+            if support >= min_support_count:
+                frequent_itemsets[itemset] = support
+                new_itemsets_by_size.setdefault(itemset_size + 1, []).append(itemset)
+
+    #Every known itemset had frequent subsets before this batch and the new candidates were generated with frequent
+    #subsets, so only a demoted subset can push an itemset out of the negative border
+    negative_border = {itemset: support for itemset, support in known_supports.items() if itemset not in frequent_itemsets}
+    if len(demoted_itemsets) * number_of_items < len(negative_border):
+        for itemset in demoted_itemsets:
+            for item in range(number_of_items):
+                if item not in itemset:
+                    negative_border.pop(tuple(sorted(itemset + (item,))), None)
+    elif demoted_itemsets:
+        demoted_sizes = {len(itemset) + 1 for itemset in demoted_itemsets}
+        negative_border = {itemset: support for itemset, support in negative_border.items()
+            if len(itemset) not in demoted_sizes or demoted_itemsets.isdisjoint(_immediate_subsets(itemset))}
+    return (frequent_itemsets, negative_border)
+
+def _extend_new_itemsets(new_itemsets: list, frequent_items: list, frequent_itemsets: dict, known_supports: dict) -> list:
+    '''
+        Candidates one item larger than the newly frequent itemsets which have not been counted yet and whose subsets
+        are all frequent
+    '''
+    candidate_itemsets = set()
+    for itemset in new_itemsets:
+        for item in frequent_items:
+            if item in itemset:
+                continue
+            candidate_itemset = tuple(sorted(itemset + (item,)))
+            if candidate_itemset in known_supports or candidate_itemset in candidate_itemsets:
+                continue
+            #The subsets dropping item (itemset itself) and, for pairs, itemset's item are frequent already
+            if len(itemset) == 1 or all(subset in frequent_itemsets for subset in _immediate_subsets(candidate_itemset)):
+                candidate_itemsets.add(candidate_itemset)
+    return sorted(candidate_itemsets)
@@ -0,0 +1,186 @@
+'''
+    Index of discovered Maximal Frequent Itemsets (MFIs) for superset pruning
+
+    Every MFI is stored as a packed bitmask over the item columns, one row per MFI, so the
+    question "is X a subset of a known MFI" is answered by (mfi_mask & x_mask) == x_mask over
+    the candidate rows.
+
+    To keep those checks small the search uses the progressive focusing technique from the
+    MAFIA paper: each node carries a local list (LMFI) of the row numbers of the MFIs which
+    contain its head. A child narrows its parent's list to the rows that also contain the new
+    head item, so only MFIs that could possibly be supersets are ever compared.
+'''
+import itertools
+
+import numpy as np
+
+from MaxMiner.bitsetUtils import WORD_BITS, WORD_DTYPE, number_of_words
+
+_INITIAL_CAPACITY = 16
+
+#Largest number of mask words compared at once by the batched superset checks
+_BATCH_ELEMENTS = 1 << 22
+
+
+class MaximalItemsetIndex:
+    '''
+        Growable store of MFIs held both as sorted tuples of column numbers and as packed
+        item bitmasks (rows x words)
+    '''
+
+    def __init__(self, number_of_items:int):
+        self.number_of_items = number_of_items
+        self.itemsets = []
+        self.itemset_masks = np.zeros((_INITIAL_CAPACITY, number_of_words(number_of_items)), dtype=WORD_DTYPE)
+
+    def __len__(self):
+        return len(self.itemsets)
+
+    def itemset_mask(self, items) -> np.ndarray:
+        '''
+            Packs a collection of column numbers into a bitmask comparable with the stored rows
+        '''
+        items = np.asarray(items, dtype=np.intp)
+        mask = np.zeros(self.itemset_masks.shape[1], dtype=WORD_DTYPE)
+        np.bitwise_or.at(mask, items // WORD_BITS, np.left_shift(np.uint64(1), (items % WORD_BITS).astype(np.uint64)))
+        return mask
+
+    def itemset_masks_of(self, itemsets:list) -> np.ndarray:
+        '''
+            Packs many itemsets at once, one mask row per itemset
+        '''
+        rows, items = _flatten_itemsets(itemsets)
+        masks = np.zeros((len(itemsets), self.itemset_masks.shape[1]), dtype=WORD_DTYPE)
+        np.bitwise_or.at(masks, (rows, items // WORD_BITS), np.left_shift(np.uint64(1), (items % WORD_BITS).astype(np.uint64)))
+        return masks
+    
+    def add(self, items) -> int:
+        '''
+            Inserts an MFI and returns its row number
+
+            The caller is responsible for establishing that no stored MFI is a superset
+        '''
+        row = len(self.itemsets)
+        if row == self.itemset_masks.shape[0]:
+            self.itemset_masks = np.concatenate((self.itemset_masks, np.zeros_like(self.itemset_masks)))
+        self.itemset_masks[row] = self.itemset_mask(items)
+        self.itemsets.append(tuple(sorted(items)))
+        return row
+
+    def extend(self, itemset_masks:np.ndarray, itemsets:list=None):
+        '''
+            Bulk inserts MFIs which already have packed masks, ex. a snapshot from another index
+
+            When only the masks are provided the rows can be used for superset checks but their
+            tuples are stored as None, this keeps seeding a worker's index cheap
+        '''
+        if itemsets is None:
+            itemsets = [None] * len(itemset_masks)
+        required_capacity = len(self.itemsets) + len(itemsets)
+        if required_capacity > self.itemset_masks.shape[0]:
+            grown_masks = np.zeros((max(required_capacity, 2 * self.itemset_masks.shape[0]), self.itemset_masks.shape[1]), dtype=WORD_DTYPE)
+            grown_masks[:len(self.itemsets)] = self.itemset_masks[:len(self.itemsets)]
+            self.itemset_masks = grown_masks
+        self.itemset_masks[len(self.itemsets):required_capacity] = itemset_masks
+        self.itemsets.extend(itemsets)
+
+    def snapshot_masks(self) -> np.ndarray:
+        '''
+            Copy of the packed masks of the stored MFIs
+        '''
+        return self.itemset_masks[:len(self.itemsets)].copy()
+
+    def all_rows(self) -> np.ndarray:
+        return np.arange(len(self.itemsets), dtype=np.intp)
+
+    def rows_containing_item(self, rows, item:int) -> np.ndarray:
+        '''
+            Narrows a list of row numbers down to the MFIs containing the given column
+        '''
+        word_bits = self.itemset_masks[rows, item // WORD_BITS] >> np.uint64(item % WORD_BITS)
+        return rows[(word_bits & np.uint64(1)) == 1]
+
+    def has_superset(self, query_mask, rows=None) -> bool:
+        '''
+            Returns whether any MFI (or any MFI among the given rows) is a superset of the
+            itemset represented by query_mask
+        '''
+        if rows is None:
+            rows = self.all_rows()
+        if len(rows) == 0:
+            return False
+        candidate_masks = self.itemset_masks[rows]
+        return bool(np.any(np.all((candidate_masks & query_mask) == query_mask, axis=1)))
+
+    def has_superset_each(self, itemsets:list) -> np.ndarray:
+        '''
+            has_superset for many itemsets at once against every stored MFI, returns one flag per itemset
+        '''
+        return self._containing_counts(itemsets, self.itemset_masks_of(itemsets)) > 0
+    
+    def maximal_itemsets(self) -> set:
+        return set(self.itemsets)
+
+    def filtered_maximal_itemsets(self) -> set:
+        '''
+            Final maximality check for an index which was filled out of order (ex. merged from
+            several workers), drops every itemset that is a subset of another stored itemset
+            
+            Stored itemsets must be distinct. Every row contains itself, so a row is only maximal 
+            when it is contained exactly once.
+        '''
+        stored_masks = self.itemset_masks[:len(self.itemsets)]
+        return set(itertools.compress(self.itemsets, self._containing_counts(self.itemsets, stored_masks) == 1))
+    
+    def _containing_counts(self, query_itemsets:list, query_masks:np.ndarray) -> np.ndarray:
+        '''
+            Number of stored itemsets containing each query itemset, the stored rows must hold their itemsets
+            
+            Any superset of an itemset has to contain its least common (stored) item, so each query is only 
+            compared against the rows containing that item. Queries sharing the same least common item are 
+            compared as one batch.
+        '''
+        stored_masks = self.itemset_masks[:len(self.itemsets)]
+        stored_rows, stored_items = _flatten_itemsets(self.itemsets)
+        item_frequencies = np.bincount(stored_items, minlength=self.number_of_items)
+        item_rows = stored_rows[np.argsort(stored_items, kind='stable')]
+        item_indptr = np.concatenate(([0], np.cumsum(item_frequencies)))
+        
+        #The empty itemset is contained in every row
+        query_lengths = np.fromiter(map(len, query_itemsets), dtype=np.intp, count=len(query_itemsets))
+        containing_counts = np.where(query_lengths == 0, len(stored_masks), 0)
+        query_rows = np.flatnonzero(query_lengths)
+        if len(query_rows) == 0 or len(stored_masks) == 0:
+            return containing_counts
+        
+        #Rarest item of every query, the first of its pairs once they are ordered by query then item frequency
+        pair_rows, pair_items = _flatten_itemsets(query_itemsets)
+        pair_order = np.lexsort((item_frequencies[pair_items], pair_rows))
+        rarest_items = pair_items[pair_order[(np.cumsum(query_lengths) - query_lengths)[query_rows]]]
+        
+        query_order = np.argsort(rarest_items, kind='stable')
+        query_rows, rarest_items = query_rows[query_order], rarest_items[query_order]
+        group_starts = np.flatnonzero(np.r_[True, np.diff(rarest_items) != 0])
+        for group_start, group_end in zip(group_starts.tolist(), np.r_[group_starts[1:], len(query_rows)].tolist()):
+            rarest_item = rarest_items[group_start]
+            candidate_masks = stored_masks[item_rows[item_indptr[rarest_item]:item_indptr[rarest_item + 1]]]
+            if len(candidate_masks) == 0:
+                continue
+            
+            #Compare in chunks of queries to bound the (queries x candidates x words) intermediate
+            chunk_size = max(_BATCH_ELEMENTS // candidate_masks.size, 1)
+            for chunk_start in range(group_start, group_end, chunk_size):
+                chunk_rows = query_rows[chunk_start:min(chunk_start + chunk_size, group_end)]
+                chunk_masks = query_masks[chunk_rows, np.newaxis]
+                containing_counts[chunk_rows] = np.count_nonzero(np.all((candidate_masks & chunk_masks) == chunk_masks, axis=2), axis=1)
+        return containing_counts
+
+
+def _flatten_itemsets(itemsets:list):
+    '''
+        Flattens a list of itemsets into parallel (row, item) arrays
+    '''
+    itemset_lengths = np.fromiter(map(len, itemsets), dtype=np.intp, count=len(itemsets))
+    rows = np.repeat(np.arange(len(itemsets)), itemset_lengths)
+    items = np.fromiter(itertools.chain.from_iterable(itemsets), dtype=np.intp, count=len(rows))
+    return (rows, items)
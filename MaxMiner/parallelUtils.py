@@ -0,0 +1,62 @@
+'''
+    Helpers for running the mining engines over a process pool
+
+    Packed bitmaps are placed once in a multiprocessing shared memory block, workers map that
+    block into an array view when they start instead of receiving a pickled copy per task.
+'''
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+def resolve_n_jobs(n_jobs:int) -> int:
+    '''
+        Converts an n_jobs option into a worker count, None or 1 means run serially and
+        negative values count back from the number of CPUs (-1 uses every core)
+    '''
+    if n_jobs is None:
+        return 1
+    if n_jobs < 0:
+        return max(os.cpu_count() + 1 + n_jobs, 1)
+    return max(n_jobs, 1)
+
+
+class SharedArray:
+    '''
+        Copies a numpy array into a shared memory block owned by the creating process
+
+        The descriptor is a small picklable tuple which attach_shared_array uses to map the
+        same memory in a worker. The block is released when the context manager exits.
+    '''
+
+    def __init__(self, array:np.ndarray):
+        self.shape = array.shape
+        self.dtype = array.dtype
+        self.shared_memory = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(self.shape, dtype=self.dtype, buffer=self.shared_memory.buf)[...] = array
+
+    def descriptor(self) -> tuple:
+        return (self.shared_memory.name, self.shape, self.dtype.str)
+
+    def close(self):
+        self.shared_memory.close()
+        self.shared_memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def attach_shared_array(descriptor:tuple):
+    '''
+        Maps a SharedArray in the current (worker) process
+
+        Returns the shared memory block along with the array view, the caller must keep a
+        reference to the block for as long as the view is in use
+    '''
+    name, shape, dtype = descriptor
+    block = shared_memory.SharedMemory(name=name)
+    return block, np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
@@ -0,0 +1,340 @@
+'''
+    Exact maximal or closed itemsets of a transaction source larger than memory, mined one partition at a time (SON)
+
+    The source is read in partitions of partition_size transactions, only one partition (or a couple per pool worker)
+    is ever encoded at once:
+
+    1. Every partition is encoded and mined on its own at the global minimum support ratio, its MFIs (MAFIA) give
+       its locally frequent itemsets as their subsets. An itemset frequent over the whole source is frequent in at
+       least one partition (were it below the ratio in every partition it would be below it in their union), so every
+       globally frequent itemset is a subset of a local MFI.
+    2. The global MFIs are found by Pincer-Search, starting from the union of the local MFIs as the maximal frequent
+       candidate set. Every pass over the source counts one level of itemsets bottom-up together with the uncounted
+       candidates, each partition encoded over the candidate values and counted with one
+       SparseEncodedTransactions.itemset_supports call. A candidate counted frequent is kept whole, the infrequent
+       itemsets of the level split the candidates holding them top-down, and the levels only grow inside candidates
+       not found frequent yet. Counting ends once every candidate left is frequent, the maximal ones are the global
+       MFIs.
+    3. For the closed itemsets the global MFIs only bound the search, the closed itemsets are grown from the closure
+       of the empty itemset by prefix preserving closure extension (as in LCM) with one pass per level, which counts
+       the support and closure of every extension (SparseEncodedTransactions.extension_closures). Extensions outside
+       every MFI are infrequent and never counted.
+
+    Partitions are mined serially or over a process pool (n_jobs), the counting passes stream the source. A source
+    which fits in one partition is mined directly (MAFIA or CHARM) with no counting pass.
+
+    Local MFIs which are globally frequent are counted whole, so long MFIs do not blow up into their subsets, but a run
+    which would count more than max_candidates itemsets is stopped with a ValueError. Larger partitions find fewer
+    spurious local itemsets to split.
+'''
+import contextlib
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
+
+import MaxMiner
+from MaxMiner.itemsetIndex import MaximalItemsetIndex
+from MaxMiner.parallelUtils import resolve_n_jobs
+from MaxMiner.samplingMining import _MAX_CANDIDATES, _negative_border
+from MaxMiner.searchStatistics import SearchStatistics
+from MaxMiner.transactionalUtils import TransactionalEncoder, generate_transactional_encoder_from_collection, minimum_support_count
+
+#Transactions encoded and mined at once
+_PARTITION_SIZE = 1 << 18
+
+
+def partitioned_itemsets(transaction_source, min_support_ratio, closed: bool=False, partition_size: int=_PARTITION_SIZE,
+    n_jobs: int=1, max_candidates: int=_MAX_CANDIDATES, search_statistics: SearchStatistics=None, return_statistics: bool=False):
+    '''
+        Returns the Maximal Frequent Itemsets of a transaction source, or with closed its closed itemsets, mining it in
+        partitions of partition_size transactions and verifying the local results in passes over the source
+
+        transaction_source is the path of a CSV file (one transaction per line, values split on commas as in
+        encode_horizontally_from_csv_streaming) or a collection of transactions which can be iterated repeatedly (ex. a
+        list, or an object whose __iter__ reads the transactions from storage). Single use iterators are rejected.
+
+        n_jobs mines that many partitions at once in a process pool (-1 for every core), with at most two partitions
+        per worker read ahead. An optional SearchStatistics object receives the counters of the partition mines and
+        the time spent mining the partitions ('partitions') and counting the candidates ('counting').
+
+        Returns (transaction encoder, itemsets), the encoder holding the globally frequent values, their supports and
+        the number of transactions. The maximal itemsets are the set of sorted tuples of its column numbers returned
+        by MAFIA_on_encoded_collection, the closed itemsets the {itemset size: {frozenset of values: support}} of
+        CHARM_on_encoded_collection.
+    '''
+    if not isinstance(transaction_source, (str, os.PathLike)) and iter(transaction_source) is transaction_source:
+        raise TypeError("transaction_source is read repeatedly, pass a collection or a file path rather than an iterator")
+    if search_statistics is None:
+        search_statistics = SearchStatistics()
+    n_jobs = resolve_n_jobs(n_jobs)
+
+    partitions = _partition_rows(transaction_source, partition_size)
+    leading_partitions = list(itertools.islice(partitions, 2))
+    if len(leading_partitions) < 2:
+        #The only partition is the whole source, its local result is the global one
+        with search_statistics.timed_phase('partitions'):
+            transaction_encoder, itemsets = _mine_whole_source(leading_partitions[0] if leading_partitions else [],
+                min_support_ratio, closed, search_statistics)
+        if return_statistics:
+            return (transaction_encoder, itemsets, search_statistics)
+        return (transaction_encoder, itemsets)
+
+    #Candidates are kept as sorted tuples of value ids, numbered as the values are first found locally frequent
+    value_ids = {}
+    candidate_itemsets = set()
+    number_of_transactions = 0
+    with search_statistics.timed_phase('partitions'):
+        for partition_itemsets, partition_transactions, partition_statistics in _mine_partitions(
+            itertools.chain(leading_partitions, partitions), min_support_ratio, n_jobs):
+            search_statistics.merge(partition_statistics)
+            number_of_transactions += partition_transactions
+            candidate_itemsets.update(tuple(sorted(value_ids.setdefault(value, len(value_ids)) for value in itemset))
+                for itemset in partition_itemsets)
+
+    min_support_count = minimum_support_count(min_support_ratio, number_of_transactions)
+    with search_statistics.timed_phase('counting'):
+        value_supports, maximal_itemsets = _count_maximal_itemsets(transaction_source, partition_size, value_ids,
+            candidate_itemsets, min_support_count, max_candidates, search_statistics)
+
+        #Renumber the globally frequent values into the columns of the returned encoder
+        id_values = list(value_ids)
+        transaction_encoder = TransactionalEncoder({id_values[value_id]: support for value_id, support in enumerate(value_supports)
+            if support >= min_support_count}, number_of_transactions)
+        value_columns = [transaction_encoder.value_encoder_mapping.get(value) for value in id_values]
+        itemsets = {tuple(sorted(value_columns[value_id] for value_id in itemset)) for itemset in maximal_itemsets}
+        if closed:
+            itemsets = _count_closed_itemsets(transaction_source, partition_size, transaction_encoder, itemsets, max_candidates,
+                search_statistics)
+
+    if return_statistics:
+        return (transaction_encoder, itemsets, search_statistics)
+    return (transaction_encoder, itemsets)
+
+def _mine_whole_source(source_rows: list, min_support_ratio, closed: bool, search_statistics: SearchStatistics):
+    '''
+        (transaction encoder, itemsets) of a source held in a single partition, mined with MAFIA or CHARM
+    '''
+    transaction_encoder = generate_transactional_encoder_from_collection(source_rows)
+    encoded_transactions, encoder_key = transaction_encoder.encode_horizontally_from_collection_frequent(source_rows,
+        min_support_ratio, sparse=True)
+    mining_function = MaxMiner.CHARM_on_encoded_collection if closed else MaxMiner.MAFIA_on_encoded_collection
+    itemsets = mining_function(encoded_transactions, transaction_encoder, min_support_ratio, search_statistics=search_statistics)
+
+    #Encoding kept the columns of the frequent values only, in their order
+    frequent_value_supports = {value: transaction_encoder.value_supports[value] for value in transaction_encoder.value_encoder_mapping}
+    return (TransactionalEncoder(frequent_value_supports, len(source_rows)), itemsets)
+
+def _count_maximal_itemsets(transaction_source, partition_size: int, value_ids: dict, candidate_itemsets: set, min_support_count: int,
+    max_candidates: int, search_statistics: SearchStatistics):
+    '''
+        Global supports of the candidate values (by value id) and the global MFIs as sorted tuples of value ids, found
+        by Pincer-Search from the local MFIs
+
+        Each pass counts one level of itemsets bottom-up (Apriori) along with, top-down, the uncounted elements of the 
+        maximal frequent candidate set (MFCS), which starts as the local MFIs. An element counted frequent is maximal,
+        and every itemset of the level counted infrequent splits the elements holding it into one per item it drops. 
+        Every frequent itemset stays inside an element, so the levels only count itemsets inside elements not found
+        frequent yet and the search ends when none are left.
+    '''
+    candidate_encoder = TransactionalEncoder(dict.fromkeys(value_ids, 0), 0)
+    counted_supports = {}
+    frequent_candidates = []
+    open_candidates = set(candidate_itemsets)
+    level_itemsets = [(value_id,) for value_id in range(len(value_ids))]
+    while level_itemsets or not open_candidates.issubset(counted_supports):
+        #Itemsets of the level may have been counted already, as elements
+        pass_itemsets = sorted(open_candidates.union(level_itemsets).difference(counted_supports))
+        if len(counted_supports) + len(pass_itemsets) > max_candidates:
+            raise ValueError("Verifying the partitions' itemsets takes more than {} candidates, mine larger partitions or at a "
+                "higher support".format(max_candidates))
+        if pass_itemsets:
+            counted_supports.update(zip(pass_itemsets, _count_itemsets(transaction_source, partition_size, candidate_encoder,
+                pass_itemsets, search_statistics).tolist()))
+
+        open_candidates = _split_candidates(open_candidates, [itemset for itemset in level_itemsets 
+            if counted_supports[itemset] < min_support_count], frequent_candidates, len(value_ids))
+        #Elements split off may have been counted already
+        frequent_candidates.extend(itemset for itemset in open_candidates if counted_supports.get(itemset, 0) >= min_support_count)
+        open_candidates = {itemset for itemset in open_candidates if counted_supports.get(itemset, 0) < min_support_count}
+        level_itemsets = _negative_border({itemset for itemset in level_itemsets if counted_supports[itemset] >= min_support_count}, [])
+        if level_itemsets and open_candidates:
+            open_candidates_index = MaximalItemsetIndex(len(value_ids))
+            open_candidates_index.extend(open_candidates_index.itemset_masks_of(list(open_candidates)), list(open_candidates))
+            level_itemsets = list(itertools.compress(level_itemsets, open_candidates_index.has_superset_each(level_itemsets)))
+        else:
+            level_itemsets = []
+
+    value_supports = [counted_supports[(value_id,)] for value_id in range(len(value_ids))]
+    frequent_candidates_index = MaximalItemsetIndex(len(value_ids))
+    if frequent_candidates:
+        frequent_candidates_index.extend(frequent_candidates_index.itemset_masks_of(frequent_candidates), frequent_candidates)
+    return (value_supports, frequent_candidates_index.filtered_maximal_itemsets())
+
+def _split_candidates(open_candidates: set, infrequent_itemsets: list, frequent_candidates: list, number_of_items: int) -> set:
+    '''
+        Replaces every MFCS element holding infrequent itemsets by its largest subsets holding none of them, each
+        infrequent itemset splitting the pieces which hold it into one per item dropped, then drops the elements inside
+        another element
+    '''
+    candidates_index = MaximalItemsetIndex(number_of_items)
+    if infrequent_itemsets and open_candidates:
+        infrequent_masks = candidates_index.itemset_masks_of(infrequent_itemsets)
+        split_candidates = set()
+        for open_itemset, open_mask in zip(open_candidates, candidates_index.itemset_masks_of(list(open_candidates))):
+            pieces = {open_itemset}
+            for infrequent_number in np.flatnonzero(np.all((infrequent_masks & open_mask) == infrequent_masks, axis=1)).tolist():
+                infrequent_itemset = infrequent_itemsets[infrequent_number]
+                held_pieces = [piece for piece in pieces if set(infrequent_itemset).issubset(piece)]
+                pieces.difference_update(held_pieces)
+                pieces.update(tuple(item for item in piece if item != dropped_item) for piece in held_pieces 
+                    for dropped_item in infrequent_itemset)
+            split_candidates.update(pieces)
+        open_candidates = split_candidates
+    open_candidates.discard(())
+    open_candidates.difference_update(frequent_candidates)
+    if not open_candidates:
+        return open_candidates
+
+    candidates = list(open_candidates) + frequent_candidates
+    candidates_index.extend(candidates_index.itemset_masks_of(candidates), candidates)
+    return open_candidates.intersection(candidates_index.filtered_maximal_itemsets())
+
+def _count_closed_itemsets(transaction_source, partition_size: int, transaction_encoder: TransactionalEncoder, maximal_itemsets: set,
+    max_candidates: int, search_statistics: SearchStatistics) -> dict:
+    '''
+        Closed itemsets in the CHARM_on_encoded_collection format, grown from the closure of the empty itemset
+
+        Each closed itemset is extended with every column after the one that produced it, and the closure of an
+        extension is a new closed itemset when it adds no earlier column (the prefix preserving closure extension of
+        LCM, which reaches every closed itemset exactly once). Only extensions inside a global MFI are counted.
+    '''
+    closed_itemsets = {}
+    if not maximal_itemsets:
+        return closed_itemsets
+    number_of_items = len(transaction_encoder.value_encoder_mapping)
+    maximal_itemsets = list(maximal_itemsets)
+    maximal_itemset_index = MaximalItemsetIndex(number_of_items)
+    maximal_itemset_index.extend(maximal_itemset_index.itemset_masks_of(maximal_itemsets), maximal_itemsets)
+    decoder_map = transaction_encoder.value_decoder_mapping
+
+    #The closure of the empty itemset is the values held by every transaction
+    number_of_transactions = transaction_encoder.number_of_transactions
+    root_itemset = tuple(column for column, value in decoder_map.items() if transaction_encoder.value_supports[value] == number_of_transactions)
+    if root_itemset:
+        closed_itemsets[len(root_itemset)] = {frozenset(decoder_map[column] for column in root_itemset): number_of_transactions}
+
+    #Each level holds (closed itemset, first column it is extended with)
+    level_itemsets = [(root_itemset, 0)]
+    counted_extensions = 0
+    while level_itemsets:
+        extensions = [(closed_itemset, column) for closed_itemset, first_column in level_itemsets
+            for column in range(first_column, number_of_items) if column not in closed_itemset]
+        if not extensions:
+            break
+        level_extensions = {}
+        for (closed_itemset, column), frequent_extension in zip(extensions, maximal_itemset_index.has_superset_each(
+            [tuple(sorted(closed_itemset + (column,))) for closed_itemset, column in extensions]).tolist()):
+            if frequent_extension:
+                level_extensions.setdefault(closed_itemset, []).append(column)
+        counted_extensions += sum(map(len, level_extensions.values()))
+        if counted_extensions > max_candidates:
+            raise ValueError("Growing the closed itemsets takes more than {} candidates, mine at a higher support".format(max_candidates))
+
+        level_itemsets = []
+        level_extensions = list(level_extensions.items())
+        for (closed_itemset, extension_columns), (supports, closures) in zip(level_extensions, _count_closures(transaction_source,
+            partition_size, transaction_encoder, level_extensions, search_statistics)):
+            closed_mask = np.zeros(number_of_items, dtype=bool)
+            closed_mask[list(closed_itemset)] = True
+            for column, support, closure in zip(extension_columns, supports.tolist(), closures):
+                #A closure adding a column before the extension's is reached from another closed itemset
+                if np.any(closure[:column] & ~closed_mask[:column]):
+                    continue
+                closure_itemset = tuple(np.flatnonzero(closure).tolist())
+                closed_itemsets.setdefault(len(closure_itemset), {})[frozenset(decoder_map[item] for item in closure_itemset)] = support
+                level_itemsets.append((closure_itemset, column + 1))
+    return closed_itemsets
+
+def _count_itemsets(transaction_source, partition_size: int, transaction_encoder: TransactionalEncoder, itemsets: list,
+    search_statistics: SearchStatistics) -> np.ndarray:
+    '''
+        Supports of itemsets of the encoder's columns over the whole source, one partition at a time
+    '''
+    supports = np.zeros(len(itemsets), dtype=np.int64)
+    for partition_rows in _partition_rows(transaction_source, partition_size):
+        supports += transaction_encoder.encode_horizontally_from_collection(partition_rows, sparse=True).itemset_supports(itemsets)
+    search_statistics.support_computations += len(itemsets)
+    return supports
+
+def _count_closures(transaction_source, partition_size: int, transaction_encoder: TransactionalEncoder, itemset_extensions: list,
+    search_statistics: SearchStatistics) -> list:
+    '''
+        (supports, closures) of every (itemset, extension columns) over the whole source, one partition at a time (see 
+        SparseEncodedTransactions.extension_closures)
+    '''
+    number_of_items = len(transaction_encoder.value_encoder_mapping)
+    extension_closures = [(np.zeros(len(extension_columns), dtype=np.int64), np.ones((len(extension_columns), number_of_items), dtype=bool))
+        for itemset, extension_columns in itemset_extensions]
+    for partition_rows in _partition_rows(transaction_source, partition_size):
+        partition_transactions = transaction_encoder.encode_horizontally_from_collection(partition_rows, sparse=True)
+        for (itemset, extension_columns), (supports, closures) in zip(itemset_extensions, extension_closures):
+            partition_supports, partition_closures = partition_transactions.extension_closures(itemset, extension_columns)
+            supports += partition_supports
+            closures &= partition_closures
+    search_statistics.support_computations += sum(len(extension_columns) for itemset, extension_columns in itemset_extensions)
+    return extension_closures
+
+def _partition_rows(transaction_source, partition_size: int):
+    '''
+        Yields the transactions of the source as lists of at most partition_size rows
+    '''
+    with contextlib.ExitStack() as source_resources:
+        if isinstance(transaction_source, (str, os.PathLike)):
+            input_file = source_resources.enter_context(open(transaction_source, 'r'))
+            rows = ([value for value in map(str.strip, line.split(',')) if value] for line in input_file)
+        else:
+            rows = iter(transaction_source)
+        while True:
+            partition_rows = list(itertools.islice(rows, partition_size))
+            if not partition_rows:
+                return
+            yield partition_rows
+
+def _mine_partitions(partitions, min_support_ratio, n_jobs: int):
+    '''
+        Yields the (locally maximal itemsets, transactions, statistics) of every partition (lists of rows), in order
+        when serial and as they complete in a pool
+    '''
+    if n_jobs == 1:
+        for partition_rows in partitions:
+            yield _mine_partition(partition_rows, min_support_ratio)
+        return
+
+    remaining_partitions = iter(partitions)
+    pending_partitions = set()
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        while True:
+            for partition_rows in itertools.islice(remaining_partitions, 2 * n_jobs - len(pending_partitions)):
+                pending_partitions.add(executor.submit(_mine_partition, partition_rows, min_support_ratio))
+            if not pending_partitions:
+                return
+            completed_partitions, pending_partitions = wait(pending_partitions, return_when=FIRST_COMPLETED)
+            for completed_partition in completed_partitions:
+                yield completed_partition.result()
+
+def _mine_partition(partition_rows: list, min_support_ratio):
+    '''
+        Encodes one partition and mines its MFIs with MAFIA, returned as tuples of values
+    '''
+    transaction_encoder = generate_transactional_encoder_from_collection(partition_rows)
+    encoded_transactions, encoder_key = transaction_encoder.encode_horizontally_from_collection_frequent(partition_rows,
+        min_support_ratio, sparse=True)
+    search_statistics = SearchStatistics()
+    maximal_itemsets = MaxMiner.MAFIA_on_encoded_collection(encoded_transactions, transaction_encoder, min_support_ratio,
+        search_statistics=search_statistics)
+
+    decoder_map = transaction_encoder.value_decoder_mapping
+    return ([tuple(decoder_map[item] for item in itemset) for itemset in maximal_itemsets], len(partition_rows),
+        search_statistics.as_dict())
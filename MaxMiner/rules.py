@@ -0,0 +1,268 @@
+'''
+    Association rules derived from the closed itemsets returned by CHARM_on_encoded_collection
+
+    Every frequent itemset is a subset of a closed itemset and has the support of its closure, the closed superset
+    with the highest support. The transactions never need to be scanned again, rules are scored from the closed
+    itemsets alone:
+
+    - The closed itemsets are sorted by decreasing support and indexed by item (ClosureIndex)
+    - Each closed itemset C is expanded into the supports of all of its subsets at once. Every closed itemset
+      containing an item of C (and more frequent than C) marks its intersection with C, a superset maximum over
+      the 2^|C| subset lattice then gives every subset the support of its closure
+    - The frequent itemsets Y whose closure is C (the subsets with the support of C) produce the rules X -> Y - X for
+      every non empty proper subset X, all of them scored together in NumPy
+
+    Each frequent itemset has exactly one closure, so every rule is generated once. Rules are yielded one at a time,
+    as the number of rules grows exponentially with the length of the closed itemsets.
+'''
+import functools
+from typing import NamedTuple
+
+import numpy as np
+
+from MaxMiner.bitsetUtils import WORD_BITS, pack_coordinates, popcount
+
+#Number of (antecedent, itemset) pairs scored per NumPy batch
+_RULE_BATCH_ELEMENTS = 1 << 20
+#Longest closed itemset expanded, its subset lattice holds 2^length supports
+_MAX_CLOSED_ITEMSET_LENGTH = 24
+#Words of closed itemset bitmaps gathered per batch by closed_superset_supports
+_SUPERSET_BATCH_WORDS = 1 << 22
+
+
+class AssociationRule(NamedTuple):
+    '''
+        antecedent -> consequent, support is the (possibly weighted) number of transactions containing both
+
+        confidence = P(consequent | antecedent)
+        lift = confidence / P(consequent)
+        leverage = P(antecedent, consequent) - P(antecedent) * P(consequent)
+        conviction = (1 - P(consequent)) / (1 - confidence), infinite for rules which always hold
+    '''
+    antecedent: frozenset
+    consequent: frozenset
+    support: int
+    confidence: float
+    lift: float
+    leverage: float
+    conviction: float
+
+
+class ClosureIndex:
+    '''
+        Closed itemsets sorted by decreasing support with an inverted index from every item to the closed itemsets
+        containing it, in CSR form
+
+        The support of any itemset is the support of the first (most frequent) closed itemset containing it, see
+        itemset_support
+    '''
+
+    def __init__(self, closed_itemsets: dict):
+        closed_supports = {itemset: support for size_itemsets in closed_itemsets.values() for itemset, support in size_itemsets.items()}
+        self.closed_itemsets = sorted(closed_supports, key=lambda itemset: -closed_supports[itemset])
+        self.supports = np.array([closed_supports[itemset] for itemset in self.closed_itemsets], dtype=np.int64)
+
+        self.item_decoder = sorted({item for itemset in self.closed_itemsets for item in itemset}, key=repr)
+        self.item_encoder = {item: item_id for item_id, item in enumerate(self.item_decoder)}
+        itemset_lengths = np.fromiter(map(len, self.closed_itemsets), dtype=np.int64, count=len(self.closed_itemsets))
+        self.itemset_indptr = np.concatenate(([0], np.cumsum(itemset_lengths)))
+        self.itemset_items = np.fromiter((self.item_encoder[item] for itemset in self.closed_itemsets for item in itemset), dtype=np.int64,
+            count=int(self.itemset_indptr[-1]))
+
+        #Postings of each item in increasing closed itemset number, so decreasing support
+        itemset_numbers = np.repeat(np.arange(len(self.closed_itemsets)), itemset_lengths)
+        posting_order = np.lexsort((itemset_numbers, self.itemset_items))
+        self.item_indptr = np.concatenate(([0], np.cumsum(np.bincount(self.itemset_items, minlength=len(self.item_decoder)))))
+        self.item_postings = itemset_numbers[posting_order]
+
+    def __len__(self):
+        return len(self.closed_itemsets)
+
+    def item_closed_itemsets(self, item_id: int) -> np.ndarray:
+        return self.item_postings[self.item_indptr[item_id]:self.item_indptr[item_id + 1]]
+
+    def itemset_support(self, itemset) -> int:
+        '''
+            Support of an itemset of values, 0 when no closed itemset contains it (the itemset is not frequent)
+        '''
+        if any(item not in self.item_encoder for item in itemset):
+            return 0
+        containing_itemsets = None
+        for item in itemset:
+            item_postings = self.item_closed_itemsets(self.item_encoder[item])
+            containing_itemsets = item_postings if containing_itemsets is None else \
+                np.intersect1d(containing_itemsets, item_postings, assume_unique=True)
+        if containing_itemsets is None:
+            raise ValueError("The support of the empty itemset is not indexed")
+        return int(self.supports[containing_itemsets[0]]) if len(containing_itemsets) else 0
+
+    def closed_superset_supports(self) -> np.ndarray:
+        '''
+            Highest support of a proper closed superset of every closed itemset, 0 for those without one
+
+            A closed itemset is maximal at every minimum support count above this value, up to its own support. Each
+            item is packed into a bitmap over the closed itemsets containing it, the AND over an itemset's items gives
+            every closed itemset containing it and, as a proper superset of a closed itemset is always less frequent,
+            the first of them after the itemset itself is its most frequent superset.
+        '''
+        number_of_closed = len(self.closed_itemsets)
+        superset_supports = np.zeros(number_of_closed, dtype=np.int64)
+        if number_of_closed == 0:
+            return superset_supports
+        itemset_lengths = np.diff(self.itemset_indptr)
+        item_bitmaps = pack_coordinates(self.itemset_items, np.repeat(np.arange(number_of_closed), itemset_lengths), len(self.item_decoder),
+            number_of_closed)
+
+        batch_size = max(_SUPERSET_BATCH_WORDS // (item_bitmaps.shape[1] * max(int(itemset_lengths.max()), 1)), 1)
+        for first_closed in range(0, number_of_closed, batch_size):
+            batch_closed = np.arange(first_closed, min(first_closed + batch_size, number_of_closed))
+            batch_items = self.itemset_items[self.itemset_indptr[batch_closed[0]]:self.itemset_indptr[batch_closed[-1] + 1]]
+            containing_bitmaps = np.bitwise_and.reduceat(item_bitmaps[batch_items], self.itemset_indptr[batch_closed] - 
+                self.itemset_indptr[batch_closed[0]], axis=0)
+            containing_bitmaps[np.arange(len(batch_closed)), batch_closed // WORD_BITS] &= \
+                ~np.left_shift(np.uint64(1), (batch_closed % WORD_BITS).astype(np.uint64))
+
+            #Lowest set bit, the first non zero word and the number of trailing zeros within it
+            non_zero_words = containing_bitmaps != 0
+            has_superset = non_zero_words.any(axis=1)
+            first_words = non_zero_words.argmax(axis=1)
+            first_word_values = containing_bitmaps[np.arange(len(batch_closed)), first_words]
+            trailing_zeros = popcount(((first_word_values & (~first_word_values + np.uint64(1))) - np.uint64(1))[:, np.newaxis])
+            superset_numbers = first_words * WORD_BITS + trailing_zeros
+            superset_supports[batch_closed[has_superset]] = self.supports[superset_numbers[has_superset]]
+        return superset_supports
+
+    def subset_supports(self, closed_number: int) -> np.ndarray:
+        '''
+            Support of every subset of a closed itemset, indexed by the bitmask of the subset's positions in the
+            closed itemset's items (itemset_items order)
+        '''
+        closed_items = self.itemset_items[self.itemset_indptr[closed_number]:self.itemset_indptr[closed_number + 1]]
+        closed_length = len(closed_items)
+        if closed_length > _MAX_CLOSED_ITEMSET_LENGTH:
+            raise ValueError("Closed itemset of {} items is too long to expand into its {} subsets".format(closed_length,
+                2 ** closed_length))
+
+        #Only the closed itemsets more frequent than this one can be the closure of one of its subsets
+        more_frequent_count = int(np.searchsorted(-self.supports, -self.supports[closed_number], side='left'))
+        #A candidate sharing several items is listed once per item, which the maximum below does not mind
+        candidate_itemsets = [np.array([closed_number])]
+        for item_id in closed_items.tolist():
+            item_postings = self.item_closed_itemsets(item_id)
+            candidate_itemsets.append(item_postings[:np.searchsorted(item_postings, more_frequent_count)])
+        candidate_itemsets = np.concatenate(candidate_itemsets)
+
+        #Bitmask of each candidate's intersection with the closed itemset
+        item_bits = np.zeros(len(self.item_decoder), dtype=np.int64)
+        item_bits[closed_items] = np.left_shift(1, np.arange(closed_length, dtype=np.int64))
+        candidate_lengths = self.itemset_indptr[candidate_itemsets + 1] - self.itemset_indptr[candidate_itemsets]
+        candidate_starts = np.concatenate(([0], np.cumsum(candidate_lengths)[:-1]))
+        occurrence_positions = np.arange(int(candidate_lengths.sum())) + np.repeat(self.itemset_indptr[candidate_itemsets] - candidate_starts,
+            candidate_lengths)
+        intersection_masks = np.bitwise_or.reduceat(item_bits[self.itemset_items[occurrence_positions]], candidate_starts)
+
+        #Superset maximum, every subset takes the highest support of the intersections containing it
+        subset_supports = np.zeros(1 << closed_length, dtype=np.int64)
+        np.maximum.at(subset_supports, intersection_masks, self.supports[candidate_itemsets])
+        for position in range(closed_length):
+            subset_pairs = subset_supports.reshape(-1, 2, 1 << position)
+            np.maximum(subset_pairs[:, 0], subset_pairs[:, 1], out=subset_pairs[:, 0])
+        return subset_supports
+
+
+def generate_rules_apriori(closed_itemsets: dict, min_confidence: float, number_of_transactions: int):
+    '''
+        Returns an iterator over the AssociationRule of every frequent itemset with a confidence of at least
+        min_confidence
+
+        closed_itemsets is the {itemset size: {frozenset of values: support}} output of CHARM_on_encoded_collection and
+        number_of_transactions the number of transactions it was mined from (the summed weights for a weighted run)
+
+        Every closed itemset is expanded into its subset lattice, a closed itemset longer than 
+        _MAX_CLOSED_ITEMSET_LENGTH raises a ValueError from this call, before any rule is produced
+    '''
+    closure_index = ClosureIndex(closed_itemsets)
+    longest_closed = int(np.diff(closure_index.itemset_indptr).max(initial=0))
+    if longest_closed > _MAX_CLOSED_ITEMSET_LENGTH:
+        raise ValueError("Closed itemset of {} items is too long to expand into its {} subsets, mine at a higher support or "
+            "limit max_length".format(longest_closed, 2 ** longest_closed))
+    return _generate_rules(closure_index, min_confidence, number_of_transactions)
+
+
+def _generate_rules(closure_index: ClosureIndex, min_confidence: float, number_of_transactions: int):
+    for closed_number in range(len(closure_index)):
+        closed_items = closure_index.itemset_items[closure_index.itemset_indptr[closed_number]:closure_index.itemset_indptr[closed_number + 1]]
+        if len(closed_items) < 2:
+            continue
+        closed_support = int(closure_index.supports[closed_number])
+        subset_supports = closure_index.subset_supports(closed_number)
+
+        #The subsets sharing the closed itemset's support are exactly the itemsets it is the closure of
+        itemset_masks = np.flatnonzero(subset_supports == closed_support)
+        itemset_lengths = _lattice_popcounts(len(closed_items))[itemset_masks]
+        item_decoder = [closure_index.item_decoder[item_id] for item_id in closed_items.tolist()]
+        decoded_subsets = {}
+        for itemset_length in range(2, len(closed_items) + 1):
+            length_masks = itemset_masks[itemset_lengths == itemset_length]
+            if len(length_masks) == 0:
+                continue
+            batch_size = max(_RULE_BATCH_ELEMENTS >> itemset_length, 1)
+            for first_itemset in range(0, len(length_masks), batch_size):
+                for rule in _score_rules(length_masks[first_itemset:first_itemset + batch_size], itemset_length, closed_support,
+                    subset_supports, min_confidence, number_of_transactions):
+                    antecedent_mask, consequent_mask = rule[0], rule[1]
+                    yield AssociationRule(_decode_subset(antecedent_mask, item_decoder, decoded_subsets),
+                        _decode_subset(consequent_mask, item_decoder, decoded_subsets), closed_support, *rule[2:])
+
+
+def _score_rules(itemset_masks, itemset_length: int, itemset_support: int, subset_supports, min_confidence: float,
+    number_of_transactions: int):
+    '''
+        Scores every split of a batch of itemsets of the same length, returning (antecedent mask, consequent mask,
+        confidence, lift, leverage, conviction) of the splits passing min_confidence
+    '''
+    #Positions of each itemset's bits, every antecedent is a combination of them (all but the empty and full ones)
+    closed_positions = np.arange(subset_supports.size.bit_length() - 1, dtype=np.int64)
+    itemset_rows, itemset_positions = np.nonzero((itemset_masks[:, np.newaxis] >> closed_positions) & 1)
+    position_bits = np.left_shift(1, closed_positions[itemset_positions]).reshape(len(itemset_masks), itemset_length)
+    antecedent_masks = _split_selectors(itemset_length) @ position_bits.T
+    consequent_masks = itemset_masks[np.newaxis, :] ^ antecedent_masks
+
+    antecedent_supports = subset_supports[antecedent_masks]
+    confidences = itemset_support / antecedent_supports
+    confident_splits = confidences >= min_confidence
+    antecedent_masks, consequent_masks = antecedent_masks[confident_splits], consequent_masks[confident_splits]
+    confidences, antecedent_supports = confidences[confident_splits], antecedent_supports[confident_splits]
+
+    consequent_probabilities = subset_supports[consequent_masks] / number_of_transactions
+    lifts = confidences / consequent_probabilities
+    leverages = itemset_support / number_of_transactions - antecedent_supports / number_of_transactions * consequent_probabilities
+    with np.errstate(divide='ignore', invalid='ignore'):
+        convictions = np.where(confidences < 1, (1 - consequent_probabilities) / (1 - confidences), np.inf)
+    return zip(antecedent_masks.tolist(), consequent_masks.tolist(), confidences.tolist(), lifts.tolist(), leverages.tolist(),
+        convictions.tolist())
+
+
+@functools.lru_cache(maxsize=None)
+def _lattice_popcounts(number_of_items: int) -> np.ndarray:
+    '''
+        Number of set bits of every mask 0..2^number_of_items-1, each extra bit repeats the lattice below it plus one
+    '''
+    popcounts = np.zeros(1, dtype=np.uint8)
+    for position in range(number_of_items):
+        popcounts = np.concatenate((popcounts, popcounts + 1))
+    return popcounts
+
+
+@functools.lru_cache(maxsize=None)
+def _split_selectors(itemset_length: int) -> np.ndarray:
+    '''
+        Which of an itemset's items each of its non empty proper subsets takes, one row per subset
+    '''
+    return (np.arange(1, (1 << itemset_length) - 1, dtype=np.int64)[:, np.newaxis] >> np.arange(itemset_length)) & 1
+
+
+def _decode_subset(mask: int, item_decoder: list, decoded_subsets: dict) -> frozenset:
+    if mask not in decoded_subsets:
+        decoded_subsets[mask] = frozenset(item for position, item in enumerate(item_decoder) if mask >> position & 1)
+    return decoded_subsets[mask]
@@ -0,0 +1,144 @@
+'''
+    Exact maximal or closed itemsets from a mine over a random sample of the transactions (Toivonen's sampling algorithm)
+
+    A sample of the rows is mined with MAFIA at a support ratio lowered below the requested one, so that an itemset
+    frequent in the whole database is (with probability at least 1 - failure_probability) frequent in the sample too.
+    The sample's frequent itemsets S are the subsets of its MFIs, and their negative border NB (the itemsets outside S
+    whose immediate subsets are all in S) is the boundary every missed frequent itemset would have to cross:
+
+    - S and NB are counted over the whole database in one batched pass (SparseEncodedTransactions.itemset_supports)
+    - When no itemset of NB is frequent, every frequent itemset of the database is in S (a frequent itemset outside S
+      would have a minimal subset outside S, which is in NB and frequent as well), so the frequent itemsets and from
+      them the maximal or closed itemsets are exact
+    - Otherwise the sample has missed part of the lattice and the database is mined in full
+
+    The sample mine and the counting pass replace a full search, which pays off when the database is large and the
+    border small. S grows exponentially with the length of the sample's MFIs, runs over max_candidates are mined in full.
+'''
+import math
+
+import numpy as np
+
+import MaxMiner
+from MaxMiner.incrementalMining import _immediate_subsets, derive_closed_itemsets, derive_maximal_itemsets
+from MaxMiner.searchStatistics import SearchStatistics
+from MaxMiner.transactionalUtils import PackedEncodedTransactions, SparseEncodedTransactions, minimum_support_count, unpack_encoded_transactions
+
+#Most itemsets (sample frequent itemsets and their negative border) counted before a run falls back to a full mine
+_MAX_CANDIDATES = 1 << 20
+
+
+def sampled_itemsets_on_encoded_collection(encoded_transactions, transaction_encoder, min_support_ratio, closed: bool=False,
+    sample_ratio: float=0.01, failure_probability: float=0.01, lowered_support_ratio: float=None, seed: int=None,
+    max_candidates: int=_MAX_CANDIDATES, transaction_weights=None, search_statistics: SearchStatistics=None,
+    return_statistics: bool=False):
+    '''
+        Returns the Maximal Frequent Itemsets of a transaction encoded dataset (dense, packed or sparse), or
+        with closed its closed itemsets, mined from a random sample of sample_ratio of its rows and verified exactly
+
+        The sample is mined at lowered_support_ratio, by default min_support_ratio x (1 - e) with 
+        e = sqrt(2 ln(1 / failure_probability) / (min_support_ratio x sample rows)). By the multiplicative Chernoff bound
+        an itemset just frequent enough is then missed with probability at most failure_probability, and the bound 
+        scales with the expected count rather than the sample size so low ratios are not lowered to nothing. seed makes
+        the sample reproducible.
+
+        The results match MAFIA_on_encoded_collection (a set of sorted tuples of column numbers) and
+        CHARM_on_encoded_collection ({itemset size: {frozenset of values: support}}), which run on the whole dataset
+        when the negative border check fails or the candidates exceed max_candidates, counted in the SearchStatistics
+        as a sample_fallback. transaction_weights are the duplicate counts of a collapsed dataset.
+    '''
+    if search_statistics is None:
+        search_statistics = SearchStatistics()
+    number_of_transactions = encoded_transactions.shape[0]
+    if transaction_weights is not None:
+        transaction_weights = np.asarray(transaction_weights, dtype=np.int64)
+
+    with search_statistics.timed_phase('sampling'):
+        sample_size = min(max(math.ceil(sample_ratio * number_of_transactions), 1), number_of_transactions)
+        sample_rows = np.sort(np.random.default_rng(seed).choice(number_of_transactions, sample_size, replace=False))
+        if isinstance(encoded_transactions, (SparseEncodedTransactions, PackedEncodedTransactions)):
+            sample_transactions = encoded_transactions.take_transactions(sample_rows)
+        else:
+            sample_transactions = encoded_transactions[sample_rows]
+        if lowered_support_ratio is None:
+            expected_support = max(min_support_ratio * sample_size, 1)
+            lowered_support_ratio = min_support_ratio * (1 - math.sqrt(2 * math.log(1 / failure_probability) / expected_support))
+        sample_maximal_itemsets = MaxMiner.MAFIA_on_encoded_collection(sample_transactions, transaction_encoder,
+            max(lowered_support_ratio, 0), search_statistics=search_statistics,
+            transaction_weights=None if transaction_weights is None else transaction_weights[sample_rows])
+
+    with search_statistics.timed_phase('border'):
+        candidate_itemsets = _downward_closure(sample_maximal_itemsets, max_candidates)
+        if candidate_itemsets is not None:
+            border_itemsets = _negative_border(candidate_itemsets, sorted(transaction_encoder.value_encoder_mapping.values()))
+            if len(candidate_itemsets) + len(border_itemsets) > max_candidates:
+                candidate_itemsets = None
+
+    frequent_itemsets = None
+    if candidate_itemsets is not None:
+        with search_statistics.timed_phase('verification'):
+            if not isinstance(encoded_transactions, SparseEncodedTransactions):
+                encoded_transactions = SparseEncodedTransactions.from_dense(unpack_encoded_transactions(encoded_transactions))
+            if transaction_weights is None:
+                total_transaction_count = number_of_transactions
+            else:
+                total_transaction_count = int(np.sum(transaction_weights))
+            min_support_count = minimum_support_count(min_support_ratio, total_transaction_count)
+
+            counted_itemsets = list(candidate_itemsets) + border_itemsets
+            counted_supports = encoded_transactions.itemset_supports(counted_itemsets, transaction_weights)
+            search_statistics.support_computations += len(counted_itemsets)
+            if not np.any(counted_supports[len(candidate_itemsets):] >= min_support_count):
+                frequent_itemsets = {itemset: support for itemset, support in zip(counted_itemsets, counted_supports.tolist())
+                    if support >= min_support_count}
+
+    if frequent_itemsets is None:
+        #The sample missed part of the lattice (or its border is too large to count), mine the whole dataset instead
+        search_statistics.sample_fallbacks += 1
+        mining_function = MaxMiner.CHARM_on_encoded_collection if closed else MaxMiner.MAFIA_on_encoded_collection
+        itemsets = mining_function(encoded_transactions, transaction_encoder, min_support_ratio,
+            transaction_weights=transaction_weights, search_statistics=search_statistics)
+    elif closed:
+        itemsets = derive_closed_itemsets(frequent_itemsets, transaction_encoder.value_decoder_mapping)
+    else:
+        itemsets = derive_maximal_itemsets(frequent_itemsets)
+
+    if return_statistics:
+        return (itemsets, search_statistics)
+    return itemsets
+
+def _downward_closure(maximal_itemsets: set, max_candidates: int) -> set:
+    '''
+        Every non empty subset of the maximal itemsets, each level generated from the immediate subsets of the one above,
+        or None once there are more than max_candidates of them
+    '''
+    if any(len(itemset) >= max_candidates.bit_length() for itemset in maximal_itemsets):
+        return None
+    closure_itemsets = set()
+    level_itemsets = {tuple(sorted(itemset)) for itemset in maximal_itemsets}
+    while level_itemsets:
+        closure_itemsets.update(level_itemsets)
+        if len(closure_itemsets) > max_candidates:
+            return None
+        level_itemsets = {subset for itemset in level_itemsets if len(itemset) > 1 for subset in _immediate_subsets(itemset)}
+        level_itemsets -= closure_itemsets
+    return closure_itemsets
+
+def _negative_border(frequent_itemsets: set, items: list) -> list:
+    '''
+        Itemsets outside a downward closed collection whose immediate subsets all belong to it, the items outside it
+        and the joins of two of its itemsets sharing all but their last item (the Apriori candidate generation)
+    '''
+    border_itemsets = [(item,) for item in items if (item,) not in frequent_itemsets]
+    prefix_groups = {}
+    for itemset in frequent_itemsets:
+        prefix_groups.setdefault(itemset[:-1], []).append(itemset[-1])
+    for prefix, last_items in prefix_groups.items():
+        last_items.sort()
+        for first_position, first_item in enumerate(last_items):
+            for second_item in last_items[first_position + 1:]:
+                candidate_itemset = prefix + (first_item, second_item)
+                if candidate_itemset not in frequent_itemsets and \
+                    all(subset in frequent_itemsets for subset in _immediate_subsets(candidate_itemset)):
+                    border_itemsets.append(candidate_itemset)
+    return border_itemsets
@@ -0,0 +1,89 @@
+'''
+    Counters describing the work done by a single mining run
+
+    The engines accept an optional SearchStatistics object and increment its counters as they
+    search, callers keep the reference and read the numbers once the run returns (or ask the
+    engine to return it with return_statistics). as_dict gives a flat, JSON friendly view.
+
+    The counters are plain integer increments so they stay cheap on the hot path, nothing is
+    formatted or logged per node.
+'''
+import contextlib
+import time
+
+
+class SearchStatistics:
+    '''
+        Per-run search counters
+
+        nodes_visited - search tree nodes whose tail was evaluated (CHARM IT-tree nodes, FP-MAX conditional trees)
+        support_computations - itemset supports counted, one per AND + popcount of a bitmap engine, tidset
+            intersection of CHARM or item counted in an FP-MAX conditional pattern base
+        hut_prunes - subtrees skipped because the head union tail was a subset of a known MFI
+        pep_merges - tail items moved into the head by Parent Equivalence Pruning, each one is
+            a child subtree that was never branched into
+        subsumption_tests - itemsets checked against the known maximal (or closed) itemsets for a superset
+        max_depth - size of the largest head (itemset) the search reached
+        tail_reorders - nodes whose tail order was changed by sorting on increasing support
+        lookahead_hits - Max-Miner groups whose head union tail was counted frequent, ending their subtree
+        lower_bound_hits - Max-Miner groups whose head union tail was known frequent from the support lower bound,
+            without being counted
+        bitmap_projections - MAFIA roots and nodes whose subtree switched to bitmaps projected onto the head's transactions
+        diffset_switches - CHARM classes switched from tidsets to diffsets
+        sample_fallbacks - sampled runs whose negative border held a frequent itemset (or was too large to count),
+            so the whole dataset was mined
+        cache_hits - queries answered from itemsets kept up to date by a miner (ex. SlidingWindowMiner) without a search
+        phase_seconds - wall clock seconds spent in each phase of the run (ex. preparation, search)
+    '''
+
+    def __init__(self):
+        self.nodes_visited = 0
+        self.support_computations = 0
+        self.hut_prunes = 0
+        self.pep_merges = 0
+        self.subsumption_tests = 0
+        self.max_depth = 0
+        self.tail_reorders = 0
+        self.lookahead_hits = 0
+        self.lower_bound_hits = 0
+        self.bitmap_projections = 0
+        self.diffset_switches = 0
+        self.sample_fallbacks = 0
+        self.cache_hits = 0
+        self.phase_seconds = {}
+
+    def record_depth(self, depth: int):
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    @contextlib.contextmanager
+    def timed_phase(self, phase: str):
+        '''
+            Adds the time spent inside the with block to phase_seconds[phase]
+        '''
+        phase_start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.phase_seconds[phase] = self.phase_seconds.get(phase, 0.0) + time.perf_counter() - phase_start
+
+    def merge(self, statistics: dict):
+        '''
+            Accumulates the as_dict of another run (ex. a pool worker) into this one
+        '''
+        for counter, value in statistics.items():
+            if counter == 'max_depth':
+                self.record_depth(value)
+            elif counter == 'phase_seconds':
+                for phase, seconds in value.items():
+                    self.phase_seconds[phase] = self.phase_seconds.get(phase, 0.0) + seconds
+            else:
+                setattr(self, counter, getattr(self, counter) + value)
+
+    def as_dict(self) -> dict:
+        statistics = dict(vars(self))
+        statistics['phase_seconds'] = dict(self.phase_seconds)
+        return statistics
+
+    def __repr__(self):
+        return "SearchStatistics({})".format(self.as_dict())
@@ -0,0 +1,328 @@
+'''
+    Maximal and closed itemsets of a sliding window over a transaction stream
+
+    SlidingWindowMiner holds the most recent transactions in a ring buffer of window_size slots. The window is kept
+    as packed item bitmaps (items x words, bit j of an item's row set when slot j holds the item) along with the
+    support of every item, and both are updated in place as transactions arrive and expire:
+
+    ##
+    slot            0     1     2     3        next_slot = 2, the oldest transaction sits in slot 2
+    transaction    t4    t5    t2    t3        adding t6 expires t2 and overwrites its slot
+    ##
+
+    Expiring a slot clears its bits and subtracts its items from the supports, adding a transaction sets its bits and
+    adds its items, so no update ever rescans the window. A window may also be bounded in time (window_seconds), every
+    transaction older than the newest timestamp minus window_seconds expires.
+
+    Queries are answered from a negative border state kept per minimum support ratio (as IncrementalMiner keeps one
+    for a growing database): the frequent itemsets F of the window and their negative border NB (the infrequent
+    itemsets whose every proper subset is frequent), with their supports. The first query at a ratio seeds its state
+    with a MAFIA search over the window bitmaps (MAFIA_on_bitmaps), F being the subsets of the MFIs found, and from
+    then on every change to the window is applied to it:
+
+    - The itemsets of F and NB are counted over the added (or expired) slots only, by ANDing their item bitmaps with
+      the slots' bits, and the counts added to (or subtracted from) their supports
+    - Itemsets of F below the window's minimum support count leave it, and their supersets leave NB
+    - Itemsets of NB now reaching it join F, and only the candidates they make possible are counted over the window
+
+    maximal_itemsets and closed_itemsets read F, so no query after the first at a ratio searches the window. The
+    price is the size of F and NB for every ratio queried so far, windows of dense data at low support are better
+    mined once with MAFIA_on_encoded_collection.
+
+    Values are given columns as they first appear and a column is freed once its value leaves the window, so memory
+    follows the distinct values of the current window rather than of the whole stream.
+'''
+import contextlib
+import time
+
+import numpy as np
+
+import MaxMiner
+from MaxMiner.bitsetUtils import WORD_BITS, WORD_DTYPE, number_of_words, popcount
+from MaxMiner.incrementalMining import _update_negative_border, derive_closed_itemsets, derive_maximal_itemsets
+from MaxMiner.samplingMining import _MAX_CANDIDATES, _downward_closure, _negative_border
+from MaxMiner.searchStatistics import SearchStatistics
+from MaxMiner.transactionalUtils import TransactionalEncoder, minimum_support_count
+
+#Item rows allocated up front, the bitmaps double whenever the columns run out
+_INITIAL_ITEM_CAPACITY = 64
+
+#Bitmap words ANDed at once when counting a block of itemsets
+_COUNT_BLOCK_WORDS = 1 << 20
+
+
+class SlidingWindowMiner:
+    '''
+        Sliding window of at most window_size transactions, optionally also limited to the last window_seconds
+
+        transaction_encoder maps the values of the window to their columns (value_supports and number_of_transactions
+        describe the current window). Queries return values rather than columns, since a column is handed to another
+        value once its own leaves the window.
+
+        Seeding the state of a ratio stops with a ValueError when the window has more than max_candidates frequent
+        itemsets (and border itemsets) at it. An optional SearchStatistics object receives the support computations
+        and the time ('maintenance') spent keeping the states current as the window changes.
+    '''
+
+    def __init__(self, window_size: int, window_seconds: float=None, max_candidates: int=_MAX_CANDIDATES,
+        search_statistics: SearchStatistics=None):
+        if window_size < 1:
+            raise ValueError("window_size must be positive, got {}".format(window_size))
+        self.window_size = window_size
+        self.window_seconds = window_seconds
+        self.max_candidates = max_candidates
+        self.search_statistics = search_statistics
+        self.transaction_encoder = TransactionalEncoder({}, 0)
+
+        self.item_bitmaps = np.zeros((_INITIAL_ITEM_CAPACITY, number_of_words(window_size)), dtype=WORD_DTYPE)
+        self.item_supports = np.zeros(_INITIAL_ITEM_CAPACITY, dtype=np.int64)
+        self._free_columns = list(range(_INITIAL_ITEM_CAPACITY - 1, -1, -1))
+        self._slot_items = [None] * window_size
+        self._slot_timestamps = np.full(window_size, -np.inf)
+        self._live_slots = np.zeros(window_size, dtype=bool)
+        self._next_slot = 0
+
+        #{min support ratio: (frequent itemsets, negative border)}, both {sorted column tuple: window support}
+        self._window_states = {}
+        self._cached_results = {}
+
+    @property
+    def number_of_transactions(self) -> int:
+        return self.transaction_encoder.number_of_transactions
+
+    def add_transactions(self, transactions, timestamps=None):
+        '''
+            Appends a batch of transactions (Python collections of values) to the window, expiring the oldest
+            transactions to make room and, with window_seconds, those which are now too old
+
+            timestamps holds one time per transaction (non decreasing), the current time.time() when omitted
+        '''
+        rows = [list(dict.fromkeys(row)) for row in transactions]
+        if timestamps is None:
+            timestamps = np.full(len(rows), time.time())
+        else:
+            timestamps = np.asarray(timestamps, dtype=np.float64)
+            if len(timestamps) != len(rows):
+                raise ValueError("Expected {} timestamps, got {}".format(len(rows), len(timestamps)))
+        if len(rows) == 0:
+            return
+
+        #Only the last window_size transactions of a large batch would survive it
+        rows, timestamps = rows[-self.window_size:], timestamps[-self.window_size:]
+        slots = (self._next_slot + np.arange(len(rows))) % self.window_size
+        self._expire_slots(slots[self._live_slots[slots]])
+
+        #Map the values to columns, values seen for the first time (or again after leaving the window) take a free column
+        encoder_mapping = self.transaction_encoder.value_encoder_mapping
+        new_columns = []
+        for row in rows:
+            for value in row:
+                if value not in encoder_mapping:
+                    new_columns.append(self._assign_column(value))
+        row_lengths = np.fromiter(map(len, rows), dtype=np.int64, count=len(rows))
+        columns = np.fromiter((encoder_mapping[value] for row in rows for value in row), dtype=np.int64, count=int(row_lengths.sum()))
+        row_starts = np.concatenate(([0], np.cumsum(row_lengths)))
+        for row_index, slot in enumerate(slots.tolist()):
+            self._slot_items[slot] = columns[row_starts[row_index]:row_starts[row_index + 1]]
+
+        occurrence_slots = np.repeat(slots, row_lengths)
+        np.bitwise_or.at(self.item_bitmaps, (columns, occurrence_slots // WORD_BITS), _slot_bits(occurrence_slots))
+        self._update_supports(columns, 1)
+        self._slot_timestamps[slots] = timestamps
+        self._live_slots[slots] = True
+        self._next_slot = int(slots[-1] + 1) % self.window_size
+        self.transaction_encoder.number_of_transactions += len(rows)
+        self._update_window_states(self._count_known_itemsets(slots), 1, new_columns)
+
+        if self.window_seconds is not None:
+            self.expire_before(float(timestamps[-1]) - self.window_seconds)
+
+    def expire_before(self, timestamp: float):
+        '''
+            Removes the transactions added before timestamp from the window
+        '''
+        self._expire_slots(np.flatnonzero(self._live_slots & (self._slot_timestamps < timestamp)))
+
+    def maximal_itemsets(self, min_support_ratio: float, search_statistics: SearchStatistics=None) -> frozenset:
+        '''
+            Maximal frequent itemsets of the current window, as a frozenset of frozensets of values
+
+            The first query at a ratio seeds its state with the MAFIA search of the window bitmaps, and its
+            search_statistics receive that run. Later queries are read from the maintained state, counted in
+            search_statistics as a cache_hit.
+        '''
+        cache_key = ('maximal', min_support_ratio)
+        frequent_itemsets = self._window_state(min_support_ratio, search_statistics)
+        if cache_key not in self._cached_results:
+            decoder_map = self.transaction_encoder.value_decoder_mapping
+            self._cached_results[cache_key] = frozenset(frozenset(decoder_map[item] for item in itemset)
+                for itemset in derive_maximal_itemsets(frequent_itemsets))
+        return self._cached_results[cache_key]
+
+    def closed_itemsets(self, min_support_ratio: float, search_statistics: SearchStatistics=None) -> dict:
+        '''
+            Closed frequent itemsets of the current window, in the {itemset size: {frozenset of values: support}}
+            format of CHARM_on_encoded_collection
+
+            Read from the same state as maximal_itemsets (and seeded the same way), each call returns its own copy
+        '''
+        cache_key = ('closed', min_support_ratio)
+        frequent_itemsets = self._window_state(min_support_ratio, search_statistics)
+        if cache_key not in self._cached_results:
+            self._cached_results[cache_key] = derive_closed_itemsets(frequent_itemsets, self.transaction_encoder.value_decoder_mapping)
+        return {itemset_size: dict(itemsets) for itemset_size, itemsets in self._cached_results[cache_key].items()}
+
+    def _window_state(self, min_support_ratio: float, search_statistics: SearchStatistics) -> dict:
+        '''
+            Frequent itemsets of the window at min_support_ratio, seeding the ratio's state on its first query
+        '''
+        if min_support_ratio in self._window_states:
+            if search_statistics is not None:
+                search_statistics.cache_hits += 1
+            return self._window_states[min_support_ratio][0]
+
+        with _timed_phase(search_statistics, 'search'):
+            min_support_count = minimum_support_count(min_support_ratio, self.number_of_transactions)
+            maximal_itemsets = MaxMiner.MAFIA_on_bitmaps(self.item_bitmaps, self.item_supports, min_support_count,
+                search_statistics=search_statistics)
+            frequent_itemsets = _downward_closure(maximal_itemsets, self.max_candidates)
+            if frequent_itemsets is not None:
+                border_itemsets = _negative_border(frequent_itemsets, np.flatnonzero(self.item_supports).tolist())
+            if frequent_itemsets is None or len(frequent_itemsets) + len(border_itemsets) > self.max_candidates:
+                raise ValueError("The window has more than {} frequent and border itemsets at a support ratio of {}, raise "
+                    "max_candidates or query a higher support".format(self.max_candidates, min_support_ratio))
+
+            counted_itemsets = list(frequent_itemsets) + border_itemsets
+            counted_supports = self._itemset_supports(counted_itemsets).tolist()
+            if search_statistics is not None:
+                search_statistics.support_computations += len(counted_itemsets)
+        self._window_states[min_support_ratio] = (dict(zip(counted_itemsets[:len(frequent_itemsets)], counted_supports)),
+            dict(zip(border_itemsets, counted_supports[len(frequent_itemsets):])))
+        return self._window_states[min_support_ratio][0]
+
+    def _count_known_itemsets(self, slots) -> dict:
+        '''
+            Supports within the given slots of every itemset in the state of a queried ratio
+        '''
+        if not self._window_states:
+            return {}
+        known_itemsets = set()
+        for frequent_itemsets, negative_border in self._window_states.values():
+            known_itemsets.update(frequent_itemsets)
+            known_itemsets.update(negative_border)
+        known_itemsets = list(known_itemsets)
+        slot_mask = np.zeros(self.item_bitmaps.shape[1], dtype=WORD_DTYPE)
+        np.bitwise_or.at(slot_mask, slots // WORD_BITS, _slot_bits(slots))
+        return dict(zip(known_itemsets, self._itemset_supports(known_itemsets, slot_mask).tolist()))
+
+    def _update_window_states(self, slot_supports: dict, sign: int, new_columns=()):
+        '''
+            Adds (or with sign -1 subtracts) the supports of the changed slots to every state and brings its frequent
+            itemsets and negative border up to date, new columns join as singletons
+        '''
+        self._cached_results.clear()
+        if not self._window_states:
+            return
+        support_computations = len(slot_supports)
+        with _timed_phase(self.search_statistics, 'maintenance'):
+            for min_support_ratio, (frequent_itemsets, negative_border) in self._window_states.items():
+                known_supports = dict(frequent_itemsets)
+                known_supports.update(negative_border)
+                for itemset in known_supports:
+                    known_supports[itemset] += sign * slot_supports[itemset]
+                for column in new_columns:
+                    known_supports[(column,)] = int(self.item_supports[column])
+                number_of_known_itemsets = len(known_supports)
+
+                self._window_states[min_support_ratio] = _update_negative_border(frequent_itemsets, known_supports,
+                    minimum_support_count(min_support_ratio, self.number_of_transactions), self._itemset_supports,
+                    len(self.item_supports))
+                support_computations += len(known_supports) - number_of_known_itemsets
+        if self.search_statistics is not None:
+            self.search_statistics.support_computations += support_computations
+
+    def _itemset_supports(self, itemsets: list, slot_mask=None) -> np.ndarray:
+        '''
+            Window supports of sorted column tuples, the AND + popcount of their item bitmaps, counting only the slots
+            of slot_mask when given (and then only ANDing the words it touches)
+        '''
+        itemset_supports = np.zeros(len(itemsets), dtype=np.int64)
+        item_bitmaps = self.item_bitmaps
+        if slot_mask is not None:
+            mask_words = np.flatnonzero(slot_mask)
+            item_bitmaps, slot_mask = item_bitmaps[:, mask_words], slot_mask[mask_words]
+        block_rows = max(_COUNT_BLOCK_WORDS // max(item_bitmaps.shape[1], 1), 1)
+
+        #Itemsets of one length are counted together, one fancy indexed AND per item position
+        itemset_lengths = np.fromiter(map(len, itemsets), dtype=np.int64, count=len(itemsets))
+        for itemset_length in np.unique(itemset_lengths).tolist():
+            positions = np.flatnonzero(itemset_lengths == itemset_length)
+            itemset_columns = np.array([itemsets[position] for position in positions.tolist()], dtype=np.intp)
+            for block_start in range(0, len(positions), block_rows):
+                block_columns = itemset_columns[block_start:block_start + block_rows]
+                block_bitmaps = item_bitmaps[block_columns[:, 0]]
+                for item_position in range(1, itemset_length):
+                    block_bitmaps &= item_bitmaps[block_columns[:, item_position]]
+                if slot_mask is not None:
+                    block_bitmaps &= slot_mask
+                itemset_supports[positions[block_start:block_start + block_rows]] = popcount(block_bitmaps)
+        return itemset_supports
+
+    def _assign_column(self, value) -> int:
+        if not self._free_columns:
+            item_capacity = len(self.item_supports)
+            self.item_bitmaps = np.concatenate((self.item_bitmaps, np.zeros_like(self.item_bitmaps)))
+            self.item_supports = np.concatenate((self.item_supports, np.zeros_like(self.item_supports)))
+            self._free_columns = list(range(2 * item_capacity - 1, item_capacity - 1, -1))
+        column = self._free_columns.pop()
+        self.transaction_encoder.value_encoder_mapping[value] = column
+        self.transaction_encoder.value_decoder_mapping[column] = value
+        self.transaction_encoder.value_supports[value] = 0
+        return column
+
+    def _expire_slots(self, slots):
+        if len(slots) == 0:
+            return
+        #The states need the expired slots counted before their bits are cleared
+        slot_supports = self._count_known_itemsets(slots)
+        columns = np.concatenate([self._slot_items[slot] for slot in slots.tolist()])
+        occurrence_slots = np.repeat(slots, [len(self._slot_items[slot]) for slot in slots.tolist()])
+        np.bitwise_and.at(self.item_bitmaps, (columns, occurrence_slots // WORD_BITS), ~_slot_bits(occurrence_slots))
+        self._update_supports(columns, -1)
+        for slot in slots.tolist():
+            self._slot_items[slot] = None
+        self._live_slots[slots] = False
+        self.transaction_encoder.number_of_transactions -= len(slots)
+        self._update_window_states(slot_supports, -1)
+
+        #Values which left the window give their column back, by now only their singleton remains in a negative border
+        encoder = self.transaction_encoder
+        for column in np.unique(columns[self.item_supports[columns] == 0]).tolist():
+            value = encoder.value_decoder_mapping.pop(column)
+            del encoder.value_encoder_mapping[value]
+            del encoder.value_supports[value]
+            self._free_columns.append(column)
+            for frequent_itemsets, negative_border in self._window_states.values():
+                negative_border.pop((column,), None)
+
+    def _update_supports(self, columns, sign: int):
+        changed_columns, column_counts = np.unique(columns, return_counts=True)
+        self.item_supports[changed_columns] += sign * column_counts
+        encoder = self.transaction_encoder
+        for column, support in zip(changed_columns.tolist(), self.item_supports[changed_columns].tolist()):
+            encoder.value_supports[encoder.value_decoder_mapping[column]] = support
+
+
+def _slot_bits(slots):
+    '''
+        Bit of each slot within its bitmap word
+    '''
+    return np.left_shift(np.uint64(1), (np.asarray(slots) % WORD_BITS).astype(np.uint64))
+
+def _timed_phase(search_statistics: SearchStatistics, phase: str):
+    '''
+        timed_phase of the optional statistics, nothing is timed without them
+    '''
+    if search_statistics is None:
+        return contextlib.nullcontext()
+    return search_statistics.timed_phase(phase)
@@ -1,11 +1,26 @@
 import unittest
+import unittest.mock
+import json
 import logging
+import inspect
+import os
+import tempfile
+import sys
 
 import numpy
 
-from MaxMiner.transactionalUtils import generate_transactional_encoder_from_collection
+from MaxMiner.transactionalUtils import (generate_transactional_encoder_from_collection, generate_transactional_encoder_from_csv, 
+    encode_horizontally_from_csv_streaming, PackedEncodedTransactions)
 import MaxMiner
+from MaxMiner.searchStatistics import SearchStatistics
+from MaxMiner.incrementalMining import IncrementalMiner
+from MaxMiner.streamMining import SlidingWindowMiner
+from MaxMiner.samplingMining import sampled_itemsets_on_encoded_collection
+from MaxMiner.partitionedMining import partitioned_itemsets
 from MaxMiner import rules
+from MaxMiner.fpTree import FPTree
+from MaxMiner import benchmarkUtils
+from MaxMiner import encodingCache
 
 #Synthetic dataset was borrowed from the SPMF documentation for Charm-MFI, another maximal dataset miner
 charm_mfi_spmf_in_data = [
@@ -100,6 +115,8 @@ charm_paper_out_data = [
     {'A', 'C', 'T' ,'W'}
 ]
 
+charm_paper_out_data_maximal = {frozenset(['A', 'C', 'T', 'W']), frozenset(['C', 'D', 'W'])}
+
 
 def setTester(algorithm_out_sets, expected_out_sets):
     '''
@@ -112,6 +129,16 @@ def setTester(algorithm_out_sets, expected_out_sets):
             valid_flag = False
     
     return valid_flag
+
+def toFrozensets(itemsets):
+    return {frozenset(itemset) for itemset in itemsets}
+
+def decodeItemsets(encoded_itemsets, transaction_encoder):
+    '''
+        Helper function translating itemsets of encoded column numbers back into the original values
+    '''
+    column_values = {column: value for value, column in transaction_encoder.value_encoder_mapping.items()}
+    return {frozenset(column_values[column] for column in itemset) for itemset in encoded_itemsets}
     
     
 
@@ -125,19 +152,370 @@ class TestCalc(unittest.TestCase):
         encoded_transactions, encoder_key = transaction_encoder.encode_horizontally_from_collection_frequent(mafia_paper_in_data, 0.05)
 
 
-    '''
+    def test_bulk_encoder(self):
+        mixed_data = [['a', 1, 'a'], [2.5, 'b'], [], ['b', 1, 'c', 2.5], ['a']]
+        
+        #A chunk size smaller than the collection makes the supports and the rows span chunks
+        with unittest.mock.patch('MaxMiner.transactionalUtils._ENCODING_CHUNK_SIZE', 2):
+            transaction_encoder = generate_transactional_encoder_from_collection(mixed_data)
+            self.assertEqual(transaction_encoder.value_supports, {'a': 3, 1: 2, 2.5: 2, 'b': 2, 'c': 1})
+            encoded_transactions, encoder_key = transaction_encoder.encode_horizontally_from_collection_frequent(mixed_data, 0.4)
+            vertically_encoded_transactions = transaction_encoder.encode_vertically_from_collection(mixed_data)
+            sparse_transactions, encoder_key = generate_transactional_encoder_from_collection(
+                mixed_data).encode_horizontally_from_collection_frequent(mixed_data, 0.4, sparse=True)
+        
+        self.assertEqual(encoded_transactions.shape, (5, 4))
+        decoded_transactions = [{transaction_encoder.value_decoder_mapping[column] for column in numpy.flatnonzero(row)} 
+            for row in encoded_transactions]
+        self.assertEqual(decoded_transactions, [{'a', 1}, {2.5, 'b'}, set(), {'b', 1, 2.5}, {'a'}])
+        self.assertTrue(numpy.array_equal(sparse_transactions.to_dense(), encoded_transactions))
+        self.assertTrue(numpy.array_equal(vertically_encoded_transactions, encoded_transactions.T))
+        
+        #A batch encoded over the current columns drops 'c' and leaves the supports untouched
+        batch_transactions = transaction_encoder.encode_horizontally_from_collection([['c', 'a'], [1, 'b']], sparse=True)
+        self.assertEqual([{transaction_encoder.value_decoder_mapping[column] for column in numpy.flatnonzero(row)} 
+            for row in batch_transactions.to_dense()], [{'a'}, {1, 'b'}])
+        self.assertEqual(transaction_encoder.value_supports['a'], 3)
+
+    def test_streaming_csv_encoder(self):
+        with tempfile.TemporaryDirectory() as temporary_directory:
+            file_path = os.path.join(temporary_directory, 'transactions.csv')
+            with open(file_path, 'w') as output_file:
+                for row in charm_paper_in_data:
+                    output_file.write(",".join(row) + "\n")
+            
+            #A chunk size smaller than the file forces the supports to be accumulated across chunks
+            transaction_encoder, encoded_transactions = encode_horizontally_from_csv_streaming(file_path, 0.5, chunk_size=4)
+        
+        self.assertEqual(transaction_encoder.value_supports, {'A': 4, 'C': 6, 'T': 4, 'W': 5, 'D': 4})
+        self.assertEqual(encoded_transactions.shape, (6, 5))
+        decoded_transactions = [{value for value, column in transaction_encoder.value_encoder_mapping.items() if row[column]} 
+            for row in encoded_transactions]
+        self.assertEqual(decoded_transactions, [set(row) for row in charm_paper_in_data])
+    
+    def test_csv_encoders_ignore_empty_values(self):
+        with tempfile.TemporaryDirectory() as temporary_directory:
+            file_path = os.path.join(temporary_directory, 'transactions.csv')
+            with open(file_path, 'w') as output_file:
+                for row in charm_paper_in_data:
+                    output_file.write(",".join(row) + ",\n")
+                output_file.write("A,,C\n")
+            
+            streaming_encoder, streaming_transactions = encode_horizontally_from_csv_streaming(file_path, chunk_size=4)
+            transaction_encoder = generate_transactional_encoder_from_csv(file_path)
+            encoded_transactions = transaction_encoder.encode_horizontally_from_csv(file_path)[0]
+        
+        #Trailing commas and empty fields leave no '' column in either encoder
+        self.assertEqual(set(transaction_encoder.value_encoder_mapping), {'A', 'C', 'D', 'T', 'W'})
+        self.assertEqual(set(streaming_encoder.value_encoder_mapping), set(transaction_encoder.value_encoder_mapping))
+        self.assertEqual([{streaming_encoder.value_decoder_mapping[column] for column in numpy.flatnonzero(row)} for row in streaming_transactions],
+            [{transaction_encoder.value_decoder_mapping[column] for column in numpy.flatnonzero(row)} for row in encoded_transactions])
+        self.assertEqual(streaming_encoder.number_of_transactions, transaction_encoder.number_of_transactions)
+    
+    def test_encoding_cache(self):
+        with tempfile.TemporaryDirectory() as temporary_directory:
+            file_path = os.path.join(temporary_directory, 'transactions.csv')
+            with open(file_path, 'w') as output_file:
+                for row in charm_paper_in_data:
+                    output_file.write(",".join(row) + "\n")
+            
+            transaction_encoder, encoded_transactions = encodingCache.encode_csv_cached(file_path, 0.5)
+            self.assertIsInstance(encoded_transactions, PackedEncodedTransactions)
+            self.assertIsInstance(encoded_transactions.item_bitmaps, numpy.memmap)
+            self.assertEqual(transaction_encoder.value_supports, {'A': 4, 'C': 6, 'T': 4, 'W': 5, 'D': 4})
+            streaming_encoder, streaming_transactions = encode_horizontally_from_csv_streaming(file_path, 0.5)
+            self.assertTrue(numpy.array_equal(encoded_transactions.to_dense(), streaming_transactions))
+            self.assertEqual(MaxMiner.MAFIA_on_encoded_collection(encoded_transactions, transaction_encoder, 0.5),
+                MaxMiner.MAFIA_on_encoded_collection(streaming_transactions, streaming_encoder, 0.5))
+            
+            #The second call loads the saved entry without encoding again
+            with unittest.mock.patch('MaxMiner.encodingCache.encode_horizontally_from_csv_streaming') as streaming_encoder:
+                cached_encoder, cached_transactions = encodingCache.encode_csv_cached(file_path, 0.5)
+                streaming_encoder.assert_not_called()
+            self.assertEqual(cached_encoder.value_encoder_mapping, transaction_encoder.value_encoder_mapping)
+            self.assertTrue(numpy.array_equal(cached_transactions.item_bitmaps, encoded_transactions.item_bitmaps))
+            
+            #A changed source or threshold is encoded afresh
+            with open(file_path, 'a') as output_file:
+                output_file.write("A,T\n")
+            transaction_encoder, sparse_transactions, transaction_weights = encodingCache.encode_csv_cached(file_path, 0.5, 
+                collapse_duplicates=True, sparse=True)
+            self.assertEqual(transaction_encoder.value_supports['T'], 5)
+            self.assertEqual(int(transaction_weights.sum()), 7)
+            streaming_encoder, streaming_transactions = encode_horizontally_from_csv_streaming(file_path, 0.5)
+            self.assertEqual(MaxMiner.CHARM_on_encoded_collection(sparse_transactions, transaction_encoder, 0.5, transaction_weights),
+                MaxMiner.CHARM_on_encoded_collection(streaming_transactions, streaming_encoder, 0.5))
+            self.assertEqual(len(os.listdir(os.path.join(temporary_directory, '.maxminer_cache'))), 2)
+    
+    def test_benchmark_utils(self):
+        transactions = benchmarkUtils.generate_quest_transactions(500, 6, 3, 40, number_of_patterns=20, seed=1)
+        self.assertEqual(transactions, benchmarkUtils.generate_quest_transactions(500, 6, 3, 40, number_of_patterns=20, seed=1))
+        self.assertEqual(len(transactions), 500)
+        self.assertTrue(all(0 <= item < 40 for transaction in transactions for item in transaction))
+        
+        with tempfile.TemporaryDirectory() as temporary_directory:
+            file_path = os.path.join(temporary_directory, 'transactions.dat')
+            with open(file_path, 'w') as output_file:
+                for transaction in mafia_paper_in_data:
+                    output_file.write(" ".join(map(str, transaction)) + " \n")
+            self.assertEqual(benchmarkUtils.load_fimi_transactions(file_path), mafia_paper_in_data)
+            
+            benchmark_records = benchmarkUtils.benchmark_engines(mafia_paper_in_data, [0.2, 0.05], ('MAFIA', 'CHARM', 'FPMAX'), 'mafia')
+            report_path = os.path.join(temporary_directory, 'benchmark.json')
+            benchmarkUtils.write_benchmark_report(benchmark_records, report_path)
+            with open(report_path) as report_file:
+                benchmark_report = json.load(report_file)
+        
+        result_counts = {(record['engine'], record['min_support_ratio']): record['result_count'] for record in benchmark_report['records']}
+        self.assertEqual(result_counts[('MAFIA', 0.2)], len(mafia_paper_out_data_mid_support))
+        self.assertEqual(result_counts[('MAFIA', 0.05)], len(mafia_paper_out_data_low_support))
+        self.assertEqual(result_counts[('FPMAX', 0.05)], len(mafia_paper_out_data_low_support))
+        self.assertTrue(all(record['peak_memory_bytes'] > 0 for record in benchmark_report['records']))
+    
     def test_mafia(self):
         transaction_encoder = generate_transactional_encoder_from_collection(mafia_paper_in_data)
 
         encoded_transactions, encoder_key = transaction_encoder.encode_horizontally_from_collection_frequent(mafia_paper_in_data, 0.2)
         maximal_itemsets = MaxMiner.MAFIA_on_encoded_collection(encoded_transactions, transaction_encoder, 0.2)
         logging.info("Maximal itemsets uncovered {}".format(maximal_itemsets))
+        self.assertEqual(decodeItemsets(maximal_itemsets, transaction_encoder), toFrozensets(mafia_paper_out_data_mid_support))
 
         encoded_transactions, encoder_key = transaction_encoder.encode_horizontally_from_collection_frequent(mafia_paper_in_data, 0.05)
         maximal_itemsets = MaxMiner.MAFIA_on_encoded_collection(encoded_transactions, transaction_encoder, 0.05)
         logging.info("Maximal itemsets uncovered {}".format(maximal_itemsets))
+        self.assertEqual(decodeItemsets(maximal_itemsets, transaction_encoder), toFrozensets(mafia_paper_out_data_low_support))
+    
+    def test_mafia_spmf(self):
+        transaction_encoder = generate_transactional_encoder_from_collection(charm_mfi_spmf_in_data)
+        encoded_transactions, encoder_key = transaction_encoder.encode_horizontally_from_collection_frequent(charm_mfi_spmf_in_data, 0.4)
+        maximal_itemsets = MaxMiner.MAFIA_on_encoded_collection(encoded_transactions, transaction_encoder, 0.4)
+        self.assertEqual(decodeItemsets(maximal_itemsets, transaction_encoder), toFrozensets(charm_mfi_spmf_out_data))
+    
+    def test_mafia_pruning_toggles(self):
+        transaction_encoder = generate_transactional_encoder_from_collection(charm_paper_in_data)
+        encoded_transactions, encoder_key = transaction_encoder.encode_horizontally_from_collection_frequent(charm_paper_in_data, 0.5)
+        
+        search_statistics = SearchStatistics()
+        maximal_itemsets = MaxMiner.MAFIA_on_encoded_collection(encoded_transactions, transaction_encoder, 0.5, 
+            search_statistics=search_statistics)
+        unpruned_maximal_itemsets = MaxMiner.MAFIA_on_encoded_collection(encoded_transactions, transaction_encoder, 0.5,
+            parent_equivalence_pruning=False, dynamic_reordering=False)
+        
+        #Every transaction containing A also contains C and W, so PEP merges them into the head of A
+        self.assertEqual(maximal_itemsets, unpruned_maximal_itemsets)
+        self.assertEqual(decodeItemsets(maximal_itemsets, transaction_encoder), toFrozensets([['A', 'C', 'T', 'W'], ['C', 'D', 'W']]))
+        self.assertGreater(search_statistics.pep_merges, 0)
+    
+    def test_search_statistics(self):
+        transaction_encoder = generate_transactional_encoder_from_collection(mafia_paper_in_data)
+        encoded_transactions, encoder_key = transaction_encoder.encode_horizontally_from_collection_frequent(mafia_paper_in_data, 0.05)
+        
+        maximal_itemsets, search_statistics = MaxMiner.MAFIA_on_encoded_collection(encoded_transactions, transaction_encoder, 0.05,
+            return_statistics=True)
+        self.assertEqual(decodeItemsets(maximal_itemsets, transaction_encoder), toFrozensets(mafia_paper_out_data_low_support))
+        self.assertGreater(search_statistics.support_computations, 0)
+        self.assertGreater(search_statistics.subsumption_tests, 0)
+        self.assertEqual(search_statistics.max_depth, 4)
+        self.assertEqual(set(search_statistics.phase_seconds), {'preparation', 'search'})
+        
+        #Pool workers report their counters back to the caller's statistics
+        parallel_statistics = SearchStatistics()
+        MaxMiner.MAFIA_on_encoded_collection(encoded_transactions, transaction_encoder, 0.05, search_statistics=parallel_statistics, n_jobs=2)
+        self.assertGreater(parallel_statistics.support_computations, 0)
+        self.assertEqual(parallel_statistics.max_depth, 4)
+        
+        transaction_encoder = generate_transactional_encoder_from_collection(charm_paper_in_data)
+        encoded_transactions, encoder_key = transaction_encoder.encode_horizontally_from_collection_frequent(charm_paper_in_data, 0.5)
+        closed_itemsets, search_statistics = MaxMiner.CHARM_on_encoded_collection(encoded_transactions, transaction_encoder, 0.5,
+            return_statistics=True)
+        self.assertGreater(search_statistics.nodes_visited, 0)
+        self.assertGreater(search_statistics.subsumption_tests, 0)
+        self.assertEqual(search_statistics.max_depth, 4)
+        self.assertIn('search', search_statistics.as_dict()['phase_seconds'])
+    
+    def test_mafia_parallel(self):
+        transaction_encoder = generate_transactional_encoder_from_collection(mafia_paper_in_data)
+        encoded_transactions, encoder_key = transaction_encoder.encode_horizontally_from_collection_frequent(mafia_paper_in_data, 0.2)
+        
+        maximal_itemsets = MaxMiner.MAFIA_on_encoded_collection(encoded_transactions, transaction_encoder, 0.2, n_jobs=2)
+        self.assertEqual(decodeItemsets(maximal_itemsets, transaction_encoder), toFrozensets(mafia_paper_out_data_mid_support))
+    
+    def test_mafia_long_patterns(self):
+        #Without PEP every item of the pattern is one more level of the search, far deeper than the recursion limit here
+        long_pattern_data = [list(range(300))] * 3 + [list(range(0, 300, 2))] * 2
+        transaction_encoder = generate_transactional_encoder_from_collection(long_pattern_data)
+        encoded_transactions, encoder_key = transaction_encoder.encode_horizontally_from_collection_frequent(long_pattern_data, 0.5)
+        
+        recursion_limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(len(inspect.stack()) + 100)
+        try:
+            maximal_itemsets, search_statistics = MaxMiner.MAFIA_on_encoded_collection(encoded_transactions, transaction_encoder, 0.5,
+                parent_equivalence_pruning=False, return_statistics=True)
+        finally:
+            sys.setrecursionlimit(recursion_limit)
+        self.assertEqual(decodeItemsets(maximal_itemsets, transaction_encoder), {frozenset(range(300))})
+        self.assertEqual(search_statistics.max_depth, 300)
+    
+    def test_max_miner(self):
+        transaction_encoder = generate_transactional_encoder_from_collection(mafia_paper_in_data)
+        encoded_transactions, encoder_key = transaction_encoder.encode_horizontally_from_collection_frequent(mafia_paper_in_data, 0.05)
+        
+        search_statistics = SearchStatistics()
+        for min_support_ratio, expected_itemsets in ((0.05, mafia_paper_out_data_low_support), (0.2, mafia_paper_out_data_mid_support)):
+            maximal_itemsets = MaxMiner.MaxMiner_on_encoded_collection(encoded_transactions, transaction_encoder, min_support_ratio,
+                search_statistics=search_statistics)
+            self.assertEqual(decodeItemsets(maximal_itemsets, transaction_encoder), toFrozensets(expected_itemsets))
+            self.assertEqual(maximal_itemsets, MaxMiner.MaxMiner_on_encoded_collection(encoded_transactions, transaction_encoder, 
+                min_support_ratio, support_lower_bounding=False))
+        
+        #At 5% the head union tail of the first root is {1,2,3,4}, which the lookahead finds frequent
+        self.assertGreater(search_statistics.lookahead_hits, 0)
+        
+        transaction_encoder = generate_transactional_encoder_from_collection(charm_paper_in_data)
+        encoded_transactions, encoder_key = transaction_encoder.encode_horizontally_from_collection_frequent(charm_paper_in_data, 0.5)
+        self.assertEqual(MaxMiner.MaxMiner_on_encoded_collection(encoded_transactions, transaction_encoder, 0.5),
+            MaxMiner.MAFIA_on_encoded_collection(encoded_transactions, transaction_encoder, 0.5))
+    
+    def test_fpmax(self):
+        for transactions, min_support_ratio, expected_itemsets in ((mafia_paper_in_data, 0.05, mafia_paper_out_data_low_support),
+            (mafia_paper_in_data, 0.2, mafia_paper_out_data_mid_support), (charm_mfi_spmf_in_data, 0.4, charm_mfi_spmf_out_data)):
+            transaction_encoder = generate_transactional_encoder_from_collection(transactions)
+            search_statistics = SearchStatistics()
+            maximal_itemsets = MaxMiner.FPMAX_on_collection(transactions, transaction_encoder, min_support_ratio, 
+                search_statistics=search_statistics)
+            self.assertEqual(decodeItemsets(maximal_itemsets, transaction_encoder), toFrozensets(expected_itemsets))
+            self.assertGreater(search_statistics.nodes_visited, 0)
+        
+        transaction_encoder = generate_transactional_encoder_from_collection(charm_paper_in_data)
+        maximal_itemsets = decodeItemsets(MaxMiner.FPMAX_on_collection(charm_paper_in_data, transaction_encoder, 0.5), transaction_encoder)
+        encoded_transactions, encoder_key = transaction_encoder.encode_horizontally_from_collection_frequent(charm_paper_in_data, 0.5)
+        self.assertEqual(maximal_itemsets, 
+            decodeItemsets(MaxMiner.MAFIA_on_encoded_collection(encoded_transactions, transaction_encoder, 0.5), transaction_encoder))
+        
+        #One long transaction adds a node per item, shared prefixes are stored once
+        rows = [list(range(200)), [0, 1], [0, 2], [3]]
+        fp_tree = FPTree.from_transactions(numpy.cumsum([0] + [len(row) for row in rows]), sum(rows, []), [1, 1, 1, 2], 200)
+        self.assertEqual(len(fp_tree), 202)
+        self.assertEqual(fp_tree.item_supports()[:4].tolist(), [3, 2, 2, 3])
+    
+    def test_incremental_miner(self):
+        incremental_miner = IncrementalMiner(0.2)
+        for first_transaction in range(0, len(mafia_paper_in_data), 4):
+            incremental_miner.append_transactions(mafia_paper_in_data[first_transaction:first_transaction + 4])
+            
+            #Every batch boundary matches a full mine of the transactions seen so far
+            transactions = mafia_paper_in_data[:first_transaction + 4]
+            transaction_encoder = generate_transactional_encoder_from_collection(transactions)
+            encoded_transactions, encoder_key = transaction_encoder.encode_horizontally_from_collection_frequent(transactions, 0.2)
+            self.assertEqual(decodeItemsets(incremental_miner.maximal_itemsets(), incremental_miner.transaction_encoder),
+                decodeItemsets(MaxMiner.MAFIA_on_encoded_collection(encoded_transactions, transaction_encoder, 0.2), transaction_encoder))
+            self.assertEqual(incremental_miner.closed_itemsets(), MaxMiner.CHARM_on_encoded_collection(encoded_transactions, transaction_encoder, 0.2))
+        
+        self.assertEqual(decodeItemsets(incremental_miner.maximal_itemsets(), incremental_miner.transaction_encoder), 
+            toFrozensets(mafia_paper_out_data_mid_support))
+        self.assertTrue(all(support < incremental_miner.min_support_count for support in incremental_miner.negative_border.values()))
+    
+    def test_sliding_window_miner(self):
+        search_statistics = SearchStatistics()
+        window_miner = SlidingWindowMiner(6, search_statistics=search_statistics)
+        for last_transaction in range(3, len(mafia_paper_in_data) + 1, 3):
+            window_miner.add_transactions(mafia_paper_in_data[last_transaction - 3:last_transaction])
+            
+            #The window holds the last 6 transactions
+            transactions = mafia_paper_in_data[max(last_transaction - 6, 0):last_transaction]
+            transaction_encoder = generate_transactional_encoder_from_collection(transactions)
+            encoded_transactions, encoder_key = transaction_encoder.encode_horizontally_from_collection_frequent(transactions, 0.3)
+            self.assertEqual(window_miner.number_of_transactions, len(transactions))
+            self.assertEqual(window_miner.maximal_itemsets(0.3),
+                decodeItemsets(MaxMiner.MAFIA_on_encoded_collection(encoded_transactions, transaction_encoder, 0.3), transaction_encoder))
+            self.assertEqual(window_miner.closed_itemsets(0.3), MaxMiner.CHARM_on_encoded_collection(encoded_transactions, transaction_encoder, 0.3))
+        
+        #Only the first query searched the window, the later ones were read from the maintained itemsets
+        query_statistics = SearchStatistics()
+        window_miner.maximal_itemsets(0.3, search_statistics=query_statistics)
+        self.assertEqual((query_statistics.nodes_visited, query_statistics.cache_hits), (0, 1))
+        self.assertGreater(search_statistics.support_computations, 0)
+        
+        #Results are copies, changing one leaves the next query intact
+        window_miner.closed_itemsets(0.3).clear()
+        self.assertTrue(window_miner.closed_itemsets(0.3))
+        
+        #A time bounded window drops the transactions older than window_seconds
+        window_miner = SlidingWindowMiner(100, window_seconds=5)
+        window_miner.add_transactions(charm_paper_in_data, timestamps=range(len(charm_paper_in_data)))
+        self.assertEqual(window_miner.number_of_transactions, 6)
+        maximal_itemsets = window_miner.maximal_itemsets(0.5)
+        window_miner.add_transactions([['A', 'C']], timestamps=[20])
+        self.assertEqual(window_miner.maximal_itemsets(0.5), toFrozensets([['A', 'C']]))
+        self.assertEqual(set(window_miner.transaction_encoder.value_supports), {'A', 'C'})
+        
+        #The columns freed by the expired values are reused, earlier results hold values and are unaffected
+        window_miner.add_transactions([['E', 'F'], ['E', 'F', 'A']], timestamps=[21, 22])
+        self.assertEqual(window_miner.maximal_itemsets(0.5), toFrozensets([['A'], ['E', 'F']]))
+        self.assertEqual(maximal_itemsets, toFrozensets([['A', 'C', 'T', 'W'], ['C', 'D', 'W']]))
+    
+    def test_collapsed_duplicates(self):
+        transaction_encoder = generate_transactional_encoder_from_collection(mafia_paper_in_data)
+        encoded_transactions, encoder_key = transaction_encoder.encode_horizontally_from_collection_frequent(mafia_paper_in_data, 0.2)
+        collapsed_transactions, encoder_key, transaction_weights = transaction_encoder.encode_horizontally_from_collection_frequent(
+            mafia_paper_in_data, 0.2, collapse_duplicates=True)
+        
+        self.assertEqual(collapsed_transactions.shape[0], 4)
+        self.assertEqual(list(transaction_weights), [1, 3, 3, 3])
+        self.assertEqual(MaxMiner.MAFIA_on_encoded_collection(collapsed_transactions, transaction_encoder, 0.2, transaction_weights=transaction_weights),
+            MaxMiner.MAFIA_on_encoded_collection(encoded_transactions, transaction_encoder, 0.2))
+        self.assertEqual(MaxMiner.CHARM_on_encoded_collection(collapsed_transactions, transaction_encoder, 0.2, transaction_weights=transaction_weights),
+            MaxMiner.CHARM_on_encoded_collection(encoded_transactions, transaction_encoder, 0.2))
+    
+    def test_sparse_mafia(self):
+        transaction_encoder = generate_transactional_encoder_from_collection(mafia_paper_in_data)
+        encoded_transactions, encoder_key = transaction_encoder.encode_horizontally_from_collection_frequent(mafia_paper_in_data, 0.05)
+        sparse_transactions, encoder_key = transaction_encoder.encode_horizontally_from_collection_frequent(mafia_paper_in_data, 0.05,
+            sparse=True)
+        
+        self.assertEqual(sparse_transactions.number_of_occurrences, int(encoded_transactions.sum()))
+        self.assertTrue(numpy.array_equal(sparse_transactions.to_dense(), encoded_transactions))
+        
+        #The tiny dataset packs full bitmaps, so force the projected roots as well
+        self.assertEqual(MaxMiner.MAFIA_on_encoded_collection(sparse_transactions, transaction_encoder, 0.05),
+            MaxMiner.MAFIA_on_encoded_collection(encoded_transactions, transaction_encoder, 0.05))
+        with unittest.mock.patch('MaxMiner._MAFIA_full_bitmaps_fit', return_value=False):
+            for min_support_ratio, expected_itemsets in ((0.05, mafia_paper_out_data_low_support), (0.2, mafia_paper_out_data_mid_support)):
+                maximal_itemsets = MaxMiner.MAFIA_on_encoded_collection(sparse_transactions, transaction_encoder, min_support_ratio)
+                self.assertEqual(decodeItemsets(maximal_itemsets, transaction_encoder), toFrozensets(expected_itemsets))
+    
+    def test_adaptive_projection(self):
+        transaction_encoder = generate_transactional_encoder_from_collection(mafia_paper_in_data)
+        encoded_transactions, encoder_key = transaction_encoder.encode_horizontally_from_collection_frequent(mafia_paper_in_data, 0.05)
+        
+        #Every node of the tiny dataset is dense, so make projection always pay
+        with unittest.mock.patch.multiple('MaxMiner', _MAFIA_PROJECTION_MIN_WORDS=1, _MAFIA_PROJECTION_DENSITY=1, _MAFIA_ROOT_PROJECTION_COST=0):
+            maximal_itemsets, search_statistics = MaxMiner.MAFIA_on_encoded_collection(encoded_transactions, transaction_encoder, 0.05,
+                return_statistics=True)
+        self.assertEqual(decodeItemsets(maximal_itemsets, transaction_encoder), toFrozensets(mafia_paper_out_data_low_support))
+        self.assertGreater(search_statistics.bitmap_projections, 0)
+        
+        transaction_encoder = generate_transactional_encoder_from_collection(charm_video_in_data)
+        encoded_transactions, encoder_key = transaction_encoder.encode_horizontally_from_collection_frequent(charm_video_in_data, 0.5)
+        closed_itemsets, search_statistics = MaxMiner.CHARM_on_encoded_collection(encoded_transactions, transaction_encoder, 0.5,
+            return_statistics=True)
+        self.assertEqual(closed_itemsets, MaxMiner.CHARM_on_encoded_collection(encoded_transactions, transaction_encoder, 0.5, diffsets=False))
+        self.assertGreater(search_statistics.diffset_switches, 0)
+    
+    def test_item_cooccurrence(self):
+        transaction_encoder = generate_transactional_encoder_from_collection(charm_paper_in_data)
+        encoded_transactions, encoder_key = transaction_encoder.encode_horizontally_from_collection_frequent(charm_paper_in_data, 0.5)
+        sparse_transactions, encoder_key = transaction_encoder.encode_horizontally_from_collection_frequent(charm_paper_in_data, 0.5,
+            sparse=True)
+        
+        #Blocks of 4 transactions split the dataset so the counts are accumulated across blocks
+        integer_transactions = encoded_transactions.astype(numpy.int64)
+        self.assertTrue(numpy.array_equal(sparse_transactions.item_cooccurrence(range(5), block_size=4), 
+            integer_transactions.T @ integer_transactions))
+        transaction_weights = numpy.arange(1, 7)
+        self.assertTrue(numpy.array_equal(sparse_transactions.item_cooccurrence([3, 1], transaction_weights, block_size=4), 
+            integer_transactions[:, [3, 1]].T @ (integer_transactions[:, [3, 1]] * transaction_weights[:, numpy.newaxis])))
     
-    '''
     def test_video_charm(self):
         transaction_encoder = generate_transactional_encoder_from_collection(charm_video_in_data)
         encoded_transactions, encoder_key = transaction_encoder.encode_horizontally_from_collection_frequent(charm_video_in_data, 0.5)
@@ -157,4 +535,159 @@ class TestCalc(unittest.TestCase):
         encoded_transactions, encoder_key = transaction_encoder.encode_horizontally_from_collection_frequent(charm_paper_in_data, 0.5)
         closed_itemsets = MaxMiner.CHARM_on_encoded_collection(encoded_transactions, transaction_encoder, 0.5)
         
-        #self.assertTrue(setTester(closed_itemsets, charm_paper_out_data))
\ No newline at end of file
+        #self.assertTrue(setTester(closed_itemsets, charm_paper_out_data))
+        discovered_itemsets = {itemset: support for itemsets in closed_itemsets.values() for itemset, support in itemsets.items()}
+        self.assertEqual(set(discovered_itemsets), toFrozensets(charm_paper_out_data))
+        self.assertEqual(discovered_itemsets[frozenset(['A', 'C', 'T', 'W'])], 3)
+        self.assertEqual(discovered_itemsets[frozenset(['C'])], 6)
+    
+    def test_rare_itemsets(self):
+        transaction_encoder = generate_transactional_encoder_from_collection(charm_paper_in_data)
+        encoded_transactions, encoder_key = transaction_encoder.encode_horizontally_from_collection_frequent(charm_paper_in_data)
+        rare_itemsets = MaxMiner.rare_itemsets_on_encoded_collection(encoded_transactions, transaction_encoder, 0.6)
+        self.assertEqual(rare_itemsets, {2: {frozenset(['A', 'D']): 2, frozenset(['A', 'T']): 3, frozenset(['D', 'T']): 2, 
+            frozenset(['D', 'W']): 3, frozenset(['T', 'W']): 3}})
+        
+        #The rare encoder only keeps the frequent items, the rare ones are minimal rare itemsets on their own
+        transaction_encoder = generate_transactional_encoder_from_collection(charm_paper_in_data)
+        encoded_transactions, rare_items, combination_items = transaction_encoder.encode_horizontally_from_collection_rare(
+            charm_paper_in_data, 0.7, 0.3)
+        rare_itemsets = MaxMiner.rare_itemsets_on_encoded_collection(encoded_transactions, transaction_encoder, 0.7, 0.3)
+        self.assertEqual(rare_itemsets, {1: {frozenset([value]): support for value, support in rare_items.items()}})
+        
+        transaction_encoder = generate_transactional_encoder_from_collection(charm_paper_in_data)
+        encoded_transactions, encoder_key = transaction_encoder.encode_horizontally_from_collection_inverse(charm_paper_in_data, 0.7)
+        sporadic_itemsets = MaxMiner.rare_itemsets_on_encoded_collection(encoded_transactions, transaction_encoder, 0.7, 0.5, 
+            sporadic=True)
+        self.assertEqual(sporadic_itemsets, {1: {frozenset(['A']): 4, frozenset(['D']): 4, frozenset(['T']): 4}, 2: {frozenset(['A', 'T']): 3}})
+
+    def test_constraint_pushdown(self):
+        def constrained_mfis(**constraints):
+            transaction_encoder = generate_transactional_encoder_from_collection(charm_paper_in_data)
+            encoded_transactions, encoder_key = transaction_encoder.encode_horizontally_from_collection_frequent(charm_paper_in_data, 0.5)
+            maximal_itemsets = MaxMiner.MAFIA_on_encoded_collection(encoded_transactions, transaction_encoder, 0.5, **constraints)
+            return {frozenset(transaction_encoder.value_decoder_mapping[item] for item in itemset) for itemset in maximal_itemsets}
+
+        def constrained_closed(**constraints):
+            transaction_encoder = generate_transactional_encoder_from_collection(charm_paper_in_data)
+            encoded_transactions, encoder_key = transaction_encoder.encode_horizontally_from_collection_frequent(charm_paper_in_data, 0.5)
+            return MaxMiner.CHARM_on_encoded_collection(encoded_transactions, transaction_encoder, 0.5, **constraints)
+
+        self.assertEqual(constrained_mfis(required_items=['D']), {frozenset(['C', 'D', 'W'])})
+        self.assertEqual(constrained_mfis(excluded_items=['C']), {frozenset(['A', 'T', 'W']), frozenset(['D', 'W'])})
+        self.assertEqual(constrained_mfis(max_length=2), {frozenset(pair) for pair in ['AC', 'AT', 'AW', 'CD', 'CT', 'CW', 'DW', 'TW']})
+        self.assertEqual(constrained_mfis(min_length=5), set())
+        self.assertEqual(constrained_mfis(required_items=['E']), set())
+
+        #Closure only ranges over the items left, without C the closure of {A} is {A, W}
+        self.assertEqual(constrained_closed(required_items=['T']), {4: {frozenset(['A', 'C', 'T', 'W']): 3}, 2: {frozenset(['C', 'T']): 4}})
+        self.assertEqual(constrained_closed(excluded_items=['C']), {3: {frozenset(['A', 'T', 'W']): 3},
+            2: {frozenset(['A', 'W']): 4, frozenset(['D', 'W']): 3}, 1: {frozenset(['D']): 4, frozenset(['T']): 4, frozenset(['W']): 5}})
+        self.assertEqual(constrained_closed(max_length=2), {2: {frozenset(['C', 'D']): 4, frozenset(['C', 'T']): 4, frozenset(['C', 'W']): 5},
+            1: {frozenset(['C']): 6}})
+        self.assertEqual(constrained_closed(required_items=['W'], min_length=3, max_length=3),
+            {3: {frozenset(['A', 'C', 'W']): 4, frozenset(['C', 'D', 'W']): 3}})
+        with self.assertRaises(ValueError):
+            constrained_closed(min_length=3, max_length=2)
+
+    def test_sampled_mining(self):
+        transactions = benchmarkUtils.generate_quest_transactions(2000, 6, 3, 40, number_of_patterns=20, seed=3)
+        transaction_encoder = generate_transactional_encoder_from_collection(transactions)
+        encoded_transactions, encoder_key = transaction_encoder.encode_horizontally_from_collection_frequent(transactions, 0.05)
+        
+        #Mined from a quarter of the rows, the border check passes and the results are exact
+        search_statistics = SearchStatistics()
+        self.assertEqual(sampled_itemsets_on_encoded_collection(encoded_transactions, transaction_encoder, 0.05, sample_ratio=0.25, 
+            seed=0, search_statistics=search_statistics), MaxMiner.MAFIA_on_encoded_collection(encoded_transactions, transaction_encoder, 0.05))
+        self.assertEqual(sampled_itemsets_on_encoded_collection(encoded_transactions, transaction_encoder, 0.05, closed=True, 
+            sample_ratio=0.25, seed=0, search_statistics=search_statistics), 
+            MaxMiner.CHARM_on_encoded_collection(encoded_transactions, transaction_encoder, 0.05))
+        self.assertEqual(search_statistics.sample_fallbacks, 0)
+        
+        #A sample mined well above the threshold misses frequent itemsets, one of them is in the border and the full mine runs
+        self.assertEqual(sampled_itemsets_on_encoded_collection(encoded_transactions, transaction_encoder, 0.05, sample_ratio=0.25, 
+            lowered_support_ratio=0.5, seed=0, search_statistics=search_statistics), 
+            MaxMiner.MAFIA_on_encoded_collection(encoded_transactions, transaction_encoder, 0.05))
+        self.assertEqual(search_statistics.sample_fallbacks, 1)
+
+    def test_partitioned_mining(self):
+        transaction_encoder = generate_transactional_encoder_from_collection(charm_paper_in_data)
+        encoded_transactions, encoder_key = transaction_encoder.encode_horizontally_from_collection_frequent(charm_paper_in_data, 0.5)
+        closed_itemsets = MaxMiner.CHARM_on_encoded_collection(encoded_transactions, transaction_encoder, 0.5)
+        
+        #Partitions of two transactions, the itemsets frequent in any of them are counted again over the whole collection
+        partition_encoder, maximal_itemsets = partitioned_itemsets(charm_paper_in_data, 0.5, partition_size=2)
+        self.assertEqual(decodeItemsets(maximal_itemsets, partition_encoder), charm_paper_out_data_maximal)
+        self.assertEqual(partition_encoder.value_supports, {'A': 4, 'C': 6, 'T': 4, 'W': 5, 'D': 4})
+        
+        with tempfile.TemporaryDirectory() as temporary_directory:
+            file_path = os.path.join(temporary_directory, 'transactions.csv')
+            with open(file_path, 'w') as output_file:
+                for row in charm_paper_in_data:
+                    output_file.write(",".join(row) + "\n")
+            partition_encoder, partition_closed_itemsets = partitioned_itemsets(file_path, 0.5, closed=True, partition_size=4)
+        self.assertEqual(partition_closed_itemsets, closed_itemsets)
+
+        #A long local MFI which is globally frequent is counted whole, not expanded into its subsets
+        long_pattern_data = [[str(value) for value in range(22)]] * 10 + [['0']] * 10
+        for partition_size in (7, 100):
+            partition_encoder, maximal_itemsets = partitioned_itemsets(long_pattern_data, 0.3, partition_size=partition_size)
+            self.assertEqual(decodeItemsets(maximal_itemsets, partition_encoder), {frozenset(str(value) for value in range(22))})
+        partition_encoder, partition_closed_itemsets = partitioned_itemsets(long_pattern_data, 0.3, closed=True, partition_size=7)
+        self.assertEqual(partition_closed_itemsets, {1: {frozenset(['0']): 20}, 22: {frozenset(str(value) for value in range(22)): 10}})
+
+        with self.assertRaises(TypeError):
+            partitioned_itemsets(iter(charm_paper_in_data), 0.5)
+
+    def test_rules(self):
+        transaction_encoder = generate_transactional_encoder_from_collection(charm_paper_in_data)
+        encoded_transactions, encoder_key = transaction_encoder.encode_horizontally_from_collection_frequent(charm_paper_in_data, 0.5)
+        closed_itemsets = MaxMiner.CHARM_on_encoded_collection(encoded_transactions, transaction_encoder, 0.5)
+        
+        #Supports of non closed itemsets come from their closure, {A, W} from {A, C, W}
+        closure_index = rules.ClosureIndex(closed_itemsets)
+        self.assertEqual(closure_index.itemset_support(frozenset(['A', 'W'])), 4)
+        self.assertEqual(closure_index.itemset_support(frozenset(['D', 'T'])), 0)
+        
+        output_rules = {(rule.antecedent, rule.consequent): rule for rule in rules.generate_rules_apriori(closed_itemsets, 0.8, 6)}
+        self.assertTrue(all(rule.confidence >= 0.8 for rule in output_rules.values()))
+        always_holds = output_rules[(frozenset(['A']), frozenset(['W']))]
+        self.assertEqual((always_holds.support, always_holds.confidence, always_holds.conviction), (4, 1.0, float('inf')))
+        self.assertAlmostEqual(always_holds.lift, 1.2)
+        self.assertAlmostEqual(always_holds.leverage, 4 / 6 - 4 / 6 * 5 / 6)
+        self.assertAlmostEqual(output_rules[(frozenset(['W']), frozenset(['A']))].confidence, 0.8)
+        self.assertNotIn((frozenset(['C']), frozenset(['A'])), output_rules)
+        
+        #Every split of every frequent itemset, {C, W} -> {A, T} among them
+        all_rules = list(rules.generate_rules_apriori(closed_itemsets, 0, 6))
+        self.assertEqual(len(all_rules), len(set((rule.antecedent, rule.consequent) for rule in all_rules)))
+        self.assertIn((frozenset(['C', 'W']), frozenset(['A', 'T'])), [(rule.antecedent, rule.consequent) for rule in all_rules])
+        
+        #A closed itemset too long to expand is refused before any rule is yielded
+        long_closed_itemsets = {30: {frozenset(range(30)): 5}, 2: {frozenset([0, 1]): 10}}
+        with self.assertRaises(ValueError):
+            rules.generate_rules_apriori(long_closed_itemsets, 0.9, 10)
+    
+    def test_support_envelope(self):
+        transaction_encoder = generate_transactional_encoder_from_collection(mafia_paper_in_data)
+        encoded_transactions, encoder_key = transaction_encoder.encode_horizontally_from_collection_frequent(mafia_paper_in_data, 0.05)
+        envelope_itemsets = MaxMiner.support_envelope_on_encoded_collection(encoded_transactions, transaction_encoder, [0.2, 0.05])
+        
+        self.assertEqual(set(envelope_itemsets), {0.05, 0.2})
+        for min_support_ratio, expected_itemsets in ((0.05, mafia_paper_out_data_low_support), (0.2, mafia_paper_out_data_mid_support)):
+            maximal_itemsets = envelope_itemsets[min_support_ratio]['maximal']
+            self.assertEqual({itemset for itemsets in maximal_itemsets.values() for itemset in itemsets}, toFrozensets(expected_itemsets))
+            self.assertEqual(envelope_itemsets[min_support_ratio]['closed'], 
+                MaxMiner.CHARM_on_encoded_collection(encoded_transactions, transaction_encoder, min_support_ratio))
+    
+    def test_charm_diffsets(self):
+        transaction_encoder = generate_transactional_encoder_from_collection(charm_video_in_data)
+        encoded_transactions, encoder_key = transaction_encoder.encode_horizontally_from_collection_frequent(charm_video_in_data, 0.5)
+        sparse_transactions, encoder_key = transaction_encoder.encode_horizontally_from_collection_frequent(charm_video_in_data, 0.5, 
+            sparse=True)
+        
+        closed_itemsets = MaxMiner.CHARM_on_encoded_collection(encoded_transactions, transaction_encoder, 0.5, diffsets=False)
+        #2 occurs in every transaction, so it is also closed on its own
+        self.assertEqual({itemset for itemsets in closed_itemsets.values() for itemset in itemsets}, toFrozensets(charm_video_out_data + [{2}]))
+        self.assertEqual(MaxMiner.CHARM_on_encoded_collection(encoded_transactions, transaction_encoder, 0.5, diffsets=True), closed_itemsets)
+        self.assertEqual(MaxMiner.CHARM_on_encoded_collection(sparse_transactions, transaction_encoder, 0.5), closed_itemsets)
\ No newline at end of file
@@ -1,6 +1,10 @@
 from typing import Iterable, Set, List, Dict, ClassVar, Tuple
+import itertools
 import numpy as np
 import logging
+import tempfile
+
+from MaxMiner.bitsetUtils import WORD_BITS, pack_coordinates, pack_encoded_columns, pack_weight_planes, support_counter
 
 class TransactionalEncoder:
 	'''
@@ -29,16 +33,19 @@ class TransactionalEncoder:
 		
 		self.number_of_transactions = number_of_transactions
 	
-	def encode_horizontally_from_csv (self, file_path:str):
+	def encode_horizontally_from_csv (self, file_path:str, sparse:bool=False):
 		'''
 			Load transaction data from a csv into a horizontally encoded binary numpy array for
 			use with Apriori
+			
+			With sparse a SparseEncodedTransactions (CSR) is returned instead of the dense array
 		'''
 
 		with open(file_path, 'r') as input_file:
-			return self._base_hoz_encoder(input_file, True)
+			return self._base_hoz_encoder(input_file, True, sparse=sparse)
 	
-	def encode_horizontally_from_collection_frequent(self, iterable_object:Iterable, min_support_ratio_threshhold:float=0):
+	def encode_horizontally_from_collection_frequent(self, iterable_object:Iterable, min_support_ratio_threshhold:float=0,
+		collapse_duplicates:bool=False, sparse:bool=False):
 	#-> Tuple[np.ndarray, dict[str, int]]:
 		'''
 			Transaction data encoder for the Apriori-Frequent algorithm 
@@ -48,9 +55,18 @@ class TransactionalEncoder:
 		
 			Accepts a minimum support ratio threshold and uses it to pre-generate item supports and filter the
 			transactions
+			
+			With collapse_duplicates identical (encoded) transactions are merged and a third element, the per-row
+			transaction weights, is returned for the mining functions' transaction_weights argument
+			
+			With sparse the transactions are returned as a SparseEncodedTransactions (CSR) rather than a dense
+			array, for vocabularies where transactions x items would not fit in memory
 		'''
 		horizontally_encoded_array, valid_output_items, valid_combination_items = self._base_hoz_encoder(iterable_object, 
-			False, 0, min_support_ratio_threshhold)
+			False, 0, min_support_ratio_threshhold, sparse)
+		if collapse_duplicates:
+			unique_encoded_array, transaction_weights = collapse_duplicate_transactions(horizontally_encoded_array)
+			return (unique_encoded_array, valid_output_items, transaction_weights)
 		return (horizontally_encoded_array, valid_output_items)
 	
 	def encode_horizontally_from_collection_inverse(self, iterable_object:Iterable, max_support_ratio_threshhold:float=0):
@@ -77,7 +93,49 @@ class TransactionalEncoder:
 		'''
 		return self._base_hoz_encoder(iterable_object, False, max_support_ratio_threshhold, min_support_ratio_threshold)
 	
-	def _base_hoz_encoder(self, iterable_object:Iterable, csv_flag:bool, max_support_ratio_threshhold:float=0, min_support_ratio_threshhold:float=0):
+	def encode_horizontally_from_collection(self, iterable_object:Iterable, sparse:bool=False):
+		'''
+			Encodes a batch of transactions over the encoder's current columns, which are neither filtered nor 
+			renumbered, values without a column are dropped and the supports are left as they are
+			
+			Suits encoders built over a known set of values, ex. the candidates counted by partitioned mining. With 
+			sparse a SparseEncodedTransactions (CSR) is returned instead of the dense array
+		'''
+		encoded_transactions = self._base_sparse_encoder(iterable_object, False)
+		return encoded_transactions if sparse else encoded_transactions.to_dense()
+	
+	def append_from_collection(self, iterable_object:Iterable, encoded_transactions):
+		'''
+			Appends a batch of transactions to the encoder and to a store it previously encoded (a dense array or a
+			SparseEncodedTransactions), returning (updated store, encoded batch) in the store's format
+			
+			value_supports and number_of_transactions are updated with the batch. Values seen for the first time are
+			given the next free column numbers, so existing columns keep their meaning and a dense store gains zero
+			columns for them. Values the encoder previously filtered out stay excluded, their earlier occurrences are
+			not in the store.
+		'''
+		batch_rows = list(iterable_object)
+		for row in batch_rows:
+			for value in row:
+				if value not in self.value_supports:
+					self.value_supports[value] = 0
+					column = len(self.value_encoder_mapping)
+					self.value_encoder_mapping[value] = column
+					self.value_decoder_mapping[column] = value
+				self.value_supports[value] += 1
+		self.number_of_transactions += len(batch_rows)
+		
+		encoded_batch = self._base_sparse_encoder(batch_rows, False)
+		if isinstance(encoded_transactions, SparseEncodedTransactions):
+			return (encoded_transactions.concatenate(encoded_batch), encoded_batch)
+		
+		encoded_batch = encoded_batch.to_dense()
+		widened_transactions = np.zeros((encoded_transactions.shape[0], encoded_batch.shape[1]), dtype=bool)
+		widened_transactions[:, :encoded_transactions.shape[1]] = encoded_transactions
+		return (np.concatenate((widened_transactions, encoded_batch)), encoded_batch)
+	
+	def _base_hoz_encoder(self, iterable_object:Iterable, csv_flag:bool, max_support_ratio_threshhold:float=0, min_support_ratio_threshhold:float=0,
+		sparse:bool=False):
 	#-> Tuple[np.ndarray, dict[str, int]]:
 				
 		#These are two sets of single items and supports calculated by the encoder to
@@ -93,8 +151,6 @@ class TransactionalEncoder:
 				support = self.value_supports[value]
 				support_ratio = support/self.number_of_transactions			
 				
-				logging.debug("{} {}".format(value, support_ratio))
-				
 				#Apriori Rare
 				if max_support_ratio_threshhold > 0 and min_support_ratio_threshhold > 0:
 					
@@ -123,77 +179,508 @@ class TransactionalEncoder:
 					else:
 						self.value_encoder_mapping.pop(value)
 						
-		logging.debug("Reduced items of interest from {} to {}".format(len(self.value_supports), len(self.value_encoder_mapping)))
+		logging.debug("Reduced items of interest from %d to %d", len(self.value_supports), len(self.value_encoder_mapping))
 		
 		#Renumber lookup index to compensate for removed entries
 		for index, key in enumerate(self.value_encoder_mapping.keys()):
 			self.value_encoder_mapping[key] = index
+		self.value_decoder_mapping = {index: key for key, index in self.value_encoder_mapping.items()}
+		
+		if sparse:
+			return (self._base_sparse_encoder(iterable_object, csv_flag), valid_output_items, valid_combination_items)
 		
 		number_of_cols = len(self.value_encoder_mapping)
 			
 		horizontally_encoded_array = np.zeros((self.number_of_transactions, number_of_cols), dtype=bool)
 		
-		for col_index, row in enumerate(iterable_object):
-			#Process CSV data
-			if csv_flag == True:
-				for value in row.split(','):
-					value = value.strip()
-
-					#If value is in encoder mapping, add to encoded data, otherwise discard
-					if value in self.value_encoder_mapping:
-						row_index = self.value_encoder_mapping[value]
-						horizontally_encoded_array[col_index][row_index] = True
-				
-			#Process Python collections
-			elif csv_flag == False:
-				for value in row:
-
-					#If value is in encoder mapping, add to encoded data, otherwise discard
-					if value in self.value_encoder_mapping:
-						row_index = self.value_encoder_mapping[value]
-						horizontally_encoded_array[col_index][row_index] = True
+		#Values missing from the encoder mapping are discarded, each chunk sets its bits with one assignment
+		for row_numbers, column_numbers, chunk_rows in self._encoded_occurrences(iterable_object, csv_flag):
+			horizontally_encoded_array[row_numbers, column_numbers] = True
 
 		return (horizontally_encoded_array, valid_output_items, valid_combination_items)
 	
-	def encode_vertically_from_csv(self, file_path:str):
+	def encode_vertically_from_csv(self, file_path:str, sparse:bool=False):
 		'''
 			Load transaction data from a csv into a vertically encoded binary numpy array for
 			use with Apriori
-		
+			
+			With sparse each row of the returned SparseEncodedTransactions is the sorted tid-list of an item
 		'''
 		with open(file_path, 'r') as input_file:
-			return self._base_vert_encoder(input_file, True)
+			return self._base_vert_encoder(input_file, True, sparse)
 					
-	def encode_vertically_from_collection(self, iterable_object:Iterable):
+	def encode_vertically_from_collection(self, iterable_object:Iterable, sparse:bool=False):
 		'''
 			Load transaction data from a csv into a vertically encoded binary numpy array for
 			use with Apriori
-		
+			
+			With sparse each row of the returned SparseEncodedTransactions is the sorted tid-list of an item
 		'''
-		return self._base_vert_encoder(iterable_object, False)
+		return self._base_vert_encoder(iterable_object, False, sparse)
 	
-	def _base_vert_encoder(self, iterable_object:Iterable, csv_flag:bool) -> np.array:
+	def _base_vert_encoder(self, iterable_object:Iterable, csv_flag:bool, sparse:bool=False) -> np.array:
+		if sparse:
+			return self._base_sparse_encoder(iterable_object, csv_flag).transpose()
+		
 		number_of_rows = len(self.value_encoder_mapping)
 		vertically_encoded_array = np.zeros((number_of_rows, self.number_of_transactions), dtype=bool)
 		
-		for col_index, row in enumerate(iterable_object):
-			if csv_flag == True:
-				for value in row.split(','):
-					value = value.strip()
-					row_index = self.value_encoder_mapping[value]
-					vertically_encoded_array[row_index][col_index] = True					
-			elif csv_flag == False:
-				for value in row:
-					row_index = self.value_encoder_mapping[value]
-					vertically_encoded_array[row_index][col_index] = True
+		for transaction_numbers, row_numbers, chunk_rows in self._encoded_occurrences(iterable_object, csv_flag):
+			vertically_encoded_array[row_numbers, transaction_numbers] = True
 		
 		return vertically_encoded_array
+	
+	def _base_sparse_encoder(self, iterable_object:Iterable, csv_flag:bool):
+		'''
+			Sparse counterpart of the encoding loops, only the sorted column numbers of each transaction are 
+			stored (in compact typed arrays) so memory follows the number of item occurrences
+		'''
+		number_of_cols = max(len(self.value_encoder_mapping), 1)
+		row_lengths = []
+		indices = []
+		first_row = 0
+		for row_numbers, column_numbers, chunk_rows in self._encoded_occurrences(iterable_object, csv_flag):
+			#Sorting the (row, column) keys of the chunk orders every row's columns and stores repeated values once
+			row_numbers, column_numbers = np.divmod(_sorted_unique((row_numbers - first_row) * number_of_cols + column_numbers), number_of_cols)
+			row_lengths.append(np.bincount(row_numbers, minlength=chunk_rows))
+			indices.append(column_numbers.astype(np.int32))
+			first_row += chunk_rows
+		
+		indptr = np.zeros(first_row + 1, dtype=np.int64)
+		if row_lengths:
+			np.cumsum(np.concatenate(row_lengths), out=indptr[1:])
+		return SparseEncodedTransactions(indptr, np.concatenate(indices) if indices else np.zeros(0, dtype=np.int32), 
+			len(self.value_encoder_mapping))
+	
+	def _encoded_occurrences(self, iterable_object:Iterable, csv_flag:bool, chunk_size:int=None):
+		'''
+			Bulk encoding loop shared by the encoders, yields (row numbers, column numbers, rows in the chunk) for each
+			chunk of chunk_size transactions
+			
+			Every value of a chunk is looked up at once, the rows are flattened into one sequence and mapped to their 
+			columns by a single pass over the encoder mapping (values missing from it map to -1 and are dropped), the 
+			row of each occurrence is repeated from the row lengths. Row numbers count from the first transaction, 
+			so each chunk can be written with one fancy indexed assignment.
+		'''
+		if chunk_size is None:
+			chunk_size = _ENCODING_CHUNK_SIZE
+		rows_iterator = iter(iterable_object)
+		get_column = self.value_encoder_mapping.get
+		first_row = 0
+		while True:
+			rows = list(itertools.islice(rows_iterator, chunk_size))
+			if not rows:
+				break
+			if csv_flag == True:
+				rows = [[value for value in map(str.strip, row.split(',')) if value] for row in rows]
+			
+			row_lengths = np.fromiter(map(len, rows), dtype=np.int64, count=len(rows))
+			column_numbers = np.fromiter(map(get_column, itertools.chain.from_iterable(rows), itertools.repeat(-1)), dtype=np.int64,
+				count=int(row_lengths.sum()))
+			row_numbers = np.repeat(np.arange(first_row, first_row + len(rows), dtype=np.int64), row_lengths)
+			
+			encoded_occurrences = column_numbers >= 0
+			yield (row_numbers[encoded_occurrences], column_numbers[encoded_occurrences], len(rows))
+			first_row += len(rows)
+
+class SparseEncodedTransactions:
+	'''
+		Compressed sparse row (CSR) alternative to the horizontally encoded bool array
+		
+		Row i (transaction i) holds the sorted column numbers indices[indptr[i]:indptr[i + 1]], so memory scales 
+		with the number of item occurrences rather than transactions x items. The per item sorted tid-lists 
+		(the CSC view) are built on first use and kept for the mining engines.
+		
+		##
+		encoded_transactions           indptr     indices
+		[[True, True, False],          [0,        [0, 1,
+		 [False, False, True]]   ->     2,         2]
+		                                3]
+		##
+	'''
+	
+	def __init__(self, indptr, indices, number_of_items:int, item_indptr=None, item_tids=None):
+		self.indptr = np.asarray(indptr)
+		self.indices = np.asarray(indices)
+		self.number_of_transactions = len(self.indptr) - 1
+		self.number_of_items = number_of_items
+		self._item_indptr = item_indptr
+		self._item_tids = item_tids
+	
+	@property
+	def shape(self) -> Tuple[int, int]:
+		return (self.number_of_transactions, self.number_of_items)
+	
+	@property
+	def number_of_occurrences(self) -> int:
+		return len(self.indices)
+	
+	def __repr__(self):
+		return "SparseEncodedTransactions(shape={}, occurrences={})".format(self.shape, self.number_of_occurrences)
+	
+	def transaction_lengths(self) -> np.ndarray:
+		return np.diff(self.indptr)
+	
+	def item_supports(self, transaction_weights=None) -> np.ndarray:
+		'''
+			Support of every column, the summed weights of its transactions when transaction_weights are provided
+		'''
+		if transaction_weights is None:
+			return np.bincount(self.indices, minlength=self.number_of_items).astype(np.int64)
+		occurrence_weights = np.repeat(np.asarray(transaction_weights, dtype=np.float64), self.transaction_lengths())
+		return np.rint(np.bincount(self.indices, weights=occurrence_weights, minlength=self.number_of_items)).astype(np.int64)
+	
+	def item_tidlists(self) -> Tuple[np.ndarray, np.ndarray]:
+		'''
+			Returns the CSC view (item_indptr, item_tids), item j occurs in the sorted transactions 
+			item_tids[item_indptr[j]:item_indptr[j + 1]]
+		'''
+		if self._item_indptr is None:
+			transaction_ids = np.repeat(np.arange(self.number_of_transactions, dtype=_index_dtype(self.number_of_transactions)), 
+				self.transaction_lengths())
+			
+			#A stable sort on the column keeps each item's transactions in increasing order
+			self._item_tids = transaction_ids[np.argsort(self.indices, kind='stable')]
+			self._item_indptr = np.zeros(self.number_of_items + 1, dtype=np.int64)
+			np.cumsum(np.bincount(self.indices, minlength=self.number_of_items), out=self._item_indptr[1:])
+		return (self._item_indptr, self._item_tids)
+	
+	def item_tidlist(self, item:int) -> np.ndarray:
+		item_indptr, item_tids = self.item_tidlists()
+		return item_tids[item_indptr[item]:item_indptr[item + 1]]
+	
+	def transactions_items(self, transaction_ids) -> Tuple[np.ndarray, np.ndarray]:
+		'''
+			Gathers the items of the given transactions as flat (position, column) pairs, where position is the 
+			index of the transaction within transaction_ids
+		'''
+		transaction_ids = np.asarray(transaction_ids, dtype=np.int64)
+		starts = self.indptr[transaction_ids]
+		lengths = self.indptr[transaction_ids + 1] - starts
+		positions = np.repeat(np.arange(len(transaction_ids), dtype=np.int64), lengths)
+		
+		#Offset of every gathered occurrence within its transaction, added to the start of that transaction
+		offsets = np.arange(int(lengths.sum()), dtype=np.int64) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+		return (positions, self.indices[starts[positions] + offsets])
+	
+	def item_cooccurrence(self, items, transaction_weights=None, block_size:int=None) -> np.ndarray:
+		'''
+			Pairwise co-occurrence counts of the given columns, entry [a, b] is the number of transactions (or their 
+			summed transaction_weights) containing both items[a] and items[b], the diagonal holds the supports
+			
+			This is X.T @ X over the selected columns of the encoded array. It is accumulated over blocks of 
+			block_size transactions, densifying one block at a time, so every pair is counted by a single matrix 
+			product instead of one tid-list intersection per pair
+			
+			When the transactions hold few of the selected items the product mostly multiplies zeros, the pairs
+			present in each transaction are then enumerated and counted with a bincount instead (see 
+			_pair_cooccurrence), whichever of the two does less work
+		'''
+		items = np.asarray(items, dtype=np.int64)
+		item_columns = np.full(self.number_of_items, -1, dtype=np.int64)
+		item_columns[items] = np.arange(len(items))
+		
+		#Selected items of every transaction, from a running count of the selected occurrences
+		selected_counts = np.concatenate(([0], np.cumsum(item_columns[self.indices] >= 0)))
+		selected_lengths = selected_counts[self.indptr[1:]] - selected_counts[self.indptr[:-1]]
+		pair_occurrences = int(np.sum(selected_lengths ** 2))
+		if block_size is None and pair_occurrences * _COOCCURRENCE_PAIR_COST < self.number_of_transactions * len(items) ** 2:
+			return self._pair_cooccurrence(item_columns, len(items), selected_lengths, transaction_weights)
+		
+		if block_size is None:
+			block_size = max(_COOCCURRENCE_BLOCK_ELEMENTS // max(len(items), 1), 1)
+		cooccurrence_counts = np.zeros((len(items), len(items)), dtype=np.int64)
+		
+		for first_transaction in range(0, self.number_of_transactions, block_size):
+			block_transactions = np.arange(first_transaction, min(first_transaction + block_size, self.number_of_transactions))
+			positions, columns = self.transactions_items(block_transactions)
+			columns = item_columns[columns]
+			selected_occurrences = columns >= 0
+			
+			block_array = np.zeros((len(block_transactions), len(items)), dtype=np.float64)
+			block_array[positions[selected_occurrences], columns[selected_occurrences]] = 1
+			if transaction_weights is None:
+				block_counts = block_array.T @ block_array
+			else:
+				block_counts = block_array.T @ (block_array * np.asarray(transaction_weights, dtype=np.float64)[block_transactions, np.newaxis])
+			cooccurrence_counts += np.rint(block_counts).astype(np.int64)
+		return cooccurrence_counts
+	
+	def _pair_cooccurrence(self, item_columns:np.ndarray, number_of_selected:int, selected_lengths:np.ndarray, 
+		transaction_weights=None) -> np.ndarray:
+		'''
+			item_cooccurrence by enumerating the (ordered) pairs of selected items within each transaction, every 
+			selected occurrence is repeated once per selected item of its transaction and paired with each of them
+		'''
+		pair_codes = number_of_selected * number_of_selected
+		cooccurrence_counts = np.zeros(pair_codes, dtype=np.int64)
+		
+		#Blocks of transactions holding about _COOCCURRENCE_BLOCK_ELEMENTS pairs
+		block_ends = np.searchsorted(np.cumsum(selected_lengths ** 2), 
+			np.arange(_COOCCURRENCE_BLOCK_ELEMENTS, int(np.sum(selected_lengths ** 2)), _COOCCURRENCE_BLOCK_ELEMENTS), side='right')
+		block_bounds = np.unique(np.concatenate(([0], block_ends, [self.number_of_transactions])))
+		for first_transaction, last_transaction in zip(block_bounds[:-1].tolist(), block_bounds[1:].tolist()):
+			block_transactions = np.arange(first_transaction, last_transaction)
+			positions, columns = self.transactions_items(block_transactions)
+			columns = item_columns[columns]
+			selected_occurrences = columns >= 0
+			positions, columns = positions[selected_occurrences], columns[selected_occurrences]
+			
+			#Occurrences stay grouped by transaction, so a transaction's selected items are a contiguous run
+			block_lengths = selected_lengths[first_transaction:last_transaction]
+			run_starts = np.cumsum(block_lengths) - block_lengths
+			pair_repeats = block_lengths[positions]
+			first_columns = np.repeat(columns, pair_repeats)
+			pair_offsets = np.arange(len(first_columns)) - np.repeat(np.cumsum(pair_repeats) - pair_repeats, pair_repeats)
+			second_columns = columns[np.repeat(run_starts[positions], pair_repeats) + pair_offsets]
+			
+			pair_weights = None if transaction_weights is None else \
+				np.repeat(np.asarray(transaction_weights)[block_transactions][positions], pair_repeats)
+			cooccurrence_counts += np.rint(np.bincount(first_columns * number_of_selected + second_columns, weights=pair_weights, 
+				minlength=pair_codes)).astype(np.int64)
+		return cooccurrence_counts.reshape(number_of_selected, number_of_selected)
+	
+	def take_transactions(self, transaction_ids):
+		'''
+			New sparse array holding only the given transactions, in the given order
+		'''
+		positions, columns = self.transactions_items(transaction_ids)
+		indptr = np.zeros(len(transaction_ids) + 1, dtype=np.int64)
+		np.cumsum(np.bincount(positions, minlength=len(transaction_ids)), out=indptr[1:])
+		return SparseEncodedTransactions(indptr, columns, self.number_of_items)
+	
+	def concatenate(self, other):
+		'''
+			New sparse array holding this array's transactions followed by those of other, over the larger of the 
+			two column ranges
+			
+			When this array's tid-lists are already built they are extended with other's rather than rebuilt, each 
+			item's new tids land after its old ones so the lists stay sorted without another argsort
+		'''
+		number_of_items = max(self.number_of_items, other.number_of_items)
+		indptr = np.concatenate((self.indptr, self.indptr[-1] + np.asarray(other.indptr[1:], dtype=np.int64)))
+		indices = np.concatenate((self.indices, other.indices)).astype(_index_dtype(number_of_items), copy=False)
+		if self._item_indptr is None:
+			return SparseEncodedTransactions(indptr, indices, number_of_items)
+		
+		old_counts = np.zeros(number_of_items, dtype=np.int64)
+		old_counts[:self.number_of_items] = np.diff(self._item_indptr)
+		new_counts = np.bincount(other.indices, minlength=number_of_items).astype(np.int64)
+		item_indptr = np.zeros(number_of_items + 1, dtype=np.int64)
+		np.cumsum(old_counts + new_counts, out=item_indptr[1:])
+		
+		item_tids = np.empty(len(indices), dtype=_index_dtype(len(indptr) - 1))
+		item_tids[np.arange(len(self._item_tids)) + np.repeat(item_indptr[:-1] - np.concatenate(([0], np.cumsum(old_counts)[:-1])), 
+			old_counts)] = self._item_tids
+		other_item_indptr, other_item_tids = other.item_tidlists()
+		item_tids[np.arange(len(other_item_tids)) + np.repeat(item_indptr[:-1] + old_counts - np.concatenate(([0], np.cumsum(new_counts)[:-1])), 
+			new_counts)] = other_item_tids + self.number_of_transactions
+		return SparseEncodedTransactions(indptr, indices, number_of_items, item_indptr, item_tids)
+	
+	def itemset_supports(self, itemsets:list, transaction_weights=None) -> np.ndarray:
+		'''
+			Support of every (non empty) itemset of column numbers, the summed weights of its transactions when 
+			transaction_weights are provided
+			
+			The transactions are visited in blocks, each block packs bitmaps of the columns the itemsets use and 
+			every itemset's support in it is the popcount of the AND of its columns' bitmaps, so a whole list of 
+			candidate itemsets is counted in one pass over the data
+			
+			Single items are read from item_supports, and when the pairs cover a good share of the pairs of the items 
+			they use (and the matrix fits _PAIR_MATRIX_MAX_BYTES) they are read from one item_cooccurrence matrix, 
+			which is much cheaper than ANDing a bitmap per pair
+		'''
+		supports = np.zeros(len(itemsets), dtype=np.int64)
+		if len(itemsets) == 0:
+			return supports
+		itemset_lengths = np.fromiter(map(len, itemsets), dtype=np.int64, count=len(itemsets))
+		
+		single_itemsets = np.flatnonzero(itemset_lengths == 1)
+		if len(single_itemsets):
+			supports[single_itemsets] = self.item_supports(transaction_weights)[[itemsets[index][0] for index in single_itemsets.tolist()]]
+		pair_itemsets = np.flatnonzero(itemset_lengths == 2)
+		if len(pair_itemsets):
+			pairs = np.array([itemsets[index] for index in pair_itemsets.tolist()], dtype=np.int64).reshape(-1, 2)
+			pair_items, pair_positions = np.unique(pairs, return_inverse=True)
+			if len(pair_items) ** 2 * 8 <= _PAIR_MATRIX_MAX_BYTES and len(pair_items) ** 2 <= _PAIR_MATRIX_FILL * len(pairs):
+				pair_positions = pair_positions.reshape(-1, 2)
+				pair_matrix = self.item_cooccurrence(pair_items, transaction_weights)
+				supports[pair_itemsets] = pair_matrix[pair_positions[:, 0], pair_positions[:, 1]]
+				itemset_lengths[pair_itemsets] = 0
+		itemset_lengths[single_itemsets] = 0
+		
+		bitmap_itemsets = np.flatnonzero(itemset_lengths)
+		if len(bitmap_itemsets):
+			supports[bitmap_itemsets] = self._bitmap_itemset_supports([itemsets[index] for index in bitmap_itemsets.tolist()],
+				itemset_lengths[bitmap_itemsets], transaction_weights)
+		return supports
+	
+	def _bitmap_itemset_supports(self, itemsets:list, itemset_lengths:np.ndarray, transaction_weights=None) -> np.ndarray:
+		supports = np.zeros(len(itemsets), dtype=np.int64)
+		itemset_items = np.fromiter(itertools.chain.from_iterable(itemsets), dtype=np.int64, count=int(itemset_lengths.sum()))
+		itemset_starts = np.concatenate(([0], np.cumsum(itemset_lengths)[:-1]))
+		used_items, item_rows = np.unique(itemset_items, return_inverse=True)
+		item_rows = item_rows.reshape(-1)
+		
+		#Bound the (itemsets x words) block of bitmaps
+		block_words = max(_ITEMSET_COUNT_BLOCK_WORDS // len(itemsets), 1)
+		block_size = block_words * WORD_BITS
+		item_columns = np.full(self.number_of_items, -1, dtype=np.int64)
+		item_columns[used_items] = np.arange(len(used_items))
+		#Itemsets of the same length are ANDed together one position at a time, each pass a row gather of the block
+		length_groups = [(itemset_numbers, item_rows[itemset_starts[itemset_numbers][:, np.newaxis] + np.arange(itemset_length)])
+			for itemset_length in np.unique(itemset_lengths).tolist() 
+			for itemset_numbers in [np.flatnonzero(itemset_lengths == itemset_length)]]
+		for first_transaction in range(0, self.number_of_transactions, block_size):
+			block_transactions = np.arange(first_transaction, min(first_transaction + block_size, self.number_of_transactions))
+			positions, columns = self.transactions_items(block_transactions)
+			columns = item_columns[columns]
+			used_occurrences = columns >= 0
+			block_bitmaps = pack_coordinates(columns[used_occurrences], positions[used_occurrences], len(used_items), len(block_transactions))
+			block_weight_planes = None if transaction_weights is None else pack_weight_planes(np.asarray(transaction_weights)[block_transactions])
+			count_support = support_counter(block_weight_planes)
+			
+			for itemset_numbers, group_rows in length_groups:
+				itemset_bitmaps = block_bitmaps[group_rows[:, 0]]
+				for position in range(1, group_rows.shape[1]):
+					np.bitwise_and(itemset_bitmaps, block_bitmaps[group_rows[:, position]], out=itemset_bitmaps)
+				supports[itemset_numbers] += count_support(itemset_bitmaps)
+		return supports
+	
+	def extension_closures(self, itemset, extension_items) -> Tuple[np.ndarray, np.ndarray]:
+		'''
+			Support and closure of an itemset of column numbers (possibly empty) extended by each of extension_items 
+			in turn, the closures (the columns held by every transaction holding the extended itemset) as an 
+			(extension items x items) bool array
+			
+			The transactions holding the itemset are gathered once, and the item_cooccurrence of the columns they 
+			hold gives every extension's support (its diagonal) and the columns held as often. An extension held by
+			no transaction has every column in its closure, so the closures over several batches of transactions 
+			combine with a logical AND
+		'''
+		extension_items = np.asarray(extension_items, dtype=np.int64)
+		supports = np.zeros(len(extension_items), dtype=np.int64)
+		closures = np.ones((len(extension_items), self.number_of_items), dtype=bool)
+		itemset_tids = self.item_tidlist(itemset[0]) if len(itemset) else np.arange(self.number_of_transactions)
+		for item in itemset[1:]:
+			itemset_tids = np.intersect1d(itemset_tids, self.item_tidlist(item), assume_unique=True)
+		if len(itemset_tids) == 0 or len(extension_items) == 0:
+			return (supports, closures)
+		
+		itemset_transactions = self.take_transactions(itemset_tids)
+		held_items = np.flatnonzero(np.bincount(itemset_transactions.indices, minlength=self.number_of_items))
+		if len(held_items) == 0:
+			return (supports, closures)
+		cooccurrence_counts = itemset_transactions.item_cooccurrence(held_items)
+		item_positions = np.searchsorted(held_items, extension_items)
+		held_extensions = np.flatnonzero(held_items[np.minimum(item_positions, len(held_items) - 1)] == extension_items)
+		supports[held_extensions] = cooccurrence_counts[item_positions[held_extensions], item_positions[held_extensions]]
+		closures[held_extensions] = False
+		closures[held_extensions[:, np.newaxis], held_items] = cooccurrence_counts[item_positions[held_extensions]] == \
+			supports[held_extensions, np.newaxis]
+		return (supports, closures)
+	
+	def transpose(self):
+		'''
+			Items x transactions view (the vertical encoding), each row is the sorted tid-list of an item
+		'''
+		item_indptr, item_tids = self.item_tidlists()
+		return SparseEncodedTransactions(item_indptr, item_tids, self.number_of_transactions)
+	
+	def to_dense(self) -> np.ndarray:
+		dense_array = np.zeros(self.shape, dtype=bool)
+		dense_array[np.repeat(np.arange(self.number_of_transactions), self.transaction_lengths()), self.indices] = True
+		return dense_array
+	
+	@classmethod
+	def from_dense(cls, encoded_transactions:np.ndarray):
+		transaction_ids, columns = np.nonzero(encoded_transactions)
+		indptr = np.zeros(encoded_transactions.shape[0] + 1, dtype=np.int64)
+		np.cumsum(np.bincount(transaction_ids, minlength=encoded_transactions.shape[0]), out=indptr[1:])
+		return cls(indptr, columns.astype(_index_dtype(encoded_transactions.shape[1])), encoded_transactions.shape[1])
+
+class PackedEncodedTransactions:
+	'''
+		Dense transactions held as the packed item bitmaps MAFIA searches (items x 64 bit words, bit t of an item's 
+		row set when transaction t holds it, see bitsetUtils.pack_encoded_columns), an eighth of the bool array
+		
+		This is the dense layout of a saved dataset (see encodingCache). MAFIA_on_encoded_collection, 
+		MaxMiner_on_encoded_collection and rare_itemsets_on_encoded_collection count on item_bitmaps as they are, 
+		the other engines unpack it with to_dense.
+	'''
+	
+	def __init__(self, item_bitmaps, number_of_transactions:int):
+		self.item_bitmaps = item_bitmaps
+		self.number_of_transactions = number_of_transactions
+		self.number_of_items = item_bitmaps.shape[0]
+	
+	@property
+	def shape(self) -> Tuple[int, int]:
+		return (self.number_of_transactions, self.number_of_items)
+	
+	def __repr__(self):
+		return "PackedEncodedTransactions(shape={}, words={})".format(self.shape, self.item_bitmaps.shape[1])
+	
+	def take_transactions(self, transaction_ids):
+		transaction_ids = np.asarray(transaction_ids, dtype=np.int64)
+		item_bits = (self.item_bitmaps[:, transaction_ids // WORD_BITS] >> (transaction_ids % WORD_BITS).astype(np.uint64)) & np.uint64(1)
+		return PackedEncodedTransactions(pack_encoded_columns(item_bits.T.astype(bool)), len(transaction_ids))
+	
+	def to_dense(self) -> np.ndarray:
+		item_bits = np.unpackbits(np.ascontiguousarray(self.item_bitmaps).view(np.uint8), axis=1, count=self.number_of_transactions,
+			bitorder='little')
+		return np.ascontiguousarray(item_bits.T, dtype=bool)
+	
+	@classmethod
+	def from_dense(cls, encoded_transactions:np.ndarray):
+		return cls(pack_encoded_columns(encoded_transactions), encoded_transactions.shape[0])
+
+def unpack_encoded_transactions(encoded_transactions):
+	'''
+		The bool array of PackedEncodedTransactions, any other encoding is returned as it is
+	'''
+	if isinstance(encoded_transactions, PackedEncodedTransactions):
+		return encoded_transactions.to_dense()
+	return encoded_transactions
+
+#Number of elements of the dense block item_cooccurrence builds per matrix product (32MB of float64), also the pairs
+#enumerated per block when it counts pairs instead
+_COOCCURRENCE_BLOCK_ELEMENTS = 1 << 22
+#Multiply-adds of the matrix product worth one enumerated pair, the pairs are counted when they cost less
+_COOCCURRENCE_PAIR_COST = 512
+
+#Number of bitmap words itemset_supports gathers per block of transactions (32MB)
+_ITEMSET_COUNT_BLOCK_WORDS = 1 << 22
+
+#Largest pair support matrix itemset_supports builds to count pairs (256MB, about 5800 items)
+_PAIR_MATRIX_MAX_BYTES = 1 << 28
+#The matrix is used when it has at most this many entries per pair counted
+_PAIR_MATRIX_FILL = 8
+
+#Transactions encoded per chunk by the bulk encoding loops, bounding their temporary arrays
+_ENCODING_CHUNK_SIZE = 1 << 16
+
+def _sorted_unique(keys:np.ndarray) -> np.ndarray:
+	'''
+		np.unique for the integer keys of the encoders, a sort and a comparison of neighbours (np.unique may
+		hash instead, which is several times slower on keys that are nearly sorted already)
+	'''
+	keys = np.sort(keys)
+	return keys[np.concatenate(([True], keys[1:] != keys[:-1]))] if len(keys) else keys
+
+def _index_dtype(upper_bound:int):
+	'''
+		Smallest of int32/int64 able to hold the indices below upper_bound
+	'''
+	return np.int32 if upper_bound < np.iinfo(np.int32).max else np.int64
+
 def generate_transactional_encoder_from_csv(file_path:str):
 	'''
 		Generates a Transactional Encoder from a file containing Transaction data
 		
 		Expected format is newline rows containing non-fixed length, comma separated lists of categorical values,
-		which are assumed to be strings
+		which are assumed to be strings. Empty values (ex. from a trailing comma) are ignored, as they are by 
+		encode_horizontally_from_csv_streaming
 		
 		##
 		a,b,c
@@ -208,12 +695,156 @@ def generate_transactional_encoder_from_csv(file_path:str):
 		for line in input_file:
 			for item in line.split(','):
 				item = item.strip()
-				unique_values.add(item)
+				if item:
+					unique_values.add(item)
 			number_of_transactions += 1
 		
 	print("{} num transactions".format(number_of_transactions))
 	return TransactionalEncoder(unique_values, number_of_transactions)
 
+def encode_horizontally_from_csv_streaming(file_path:str, min_support_ratio_threshhold:float=0, chunk_size:int=65536,
+	collapse_duplicates:bool=False, sparse:bool=False):
+	'''
+		Single pass alternative to generate_transactional_encoder_from_csv followed by encode_horizontally_from_csv
+		
+		The file is read once in chunks of chunk_size lines. Each chunk is split, mapped to integer codes 
+		(new values are added to the vocabulary as they are first seen) and its item supports are added 
+		to the running totals with np.bincount. The compact codes (4 bytes per item occurrence plus 4 per 
+		transaction) are spilled to a temporary file, so the text of at most one chunk is held in memory.
+		
+		Once the file is exhausted the supports are final, values below the minimum support ratio are 
+		dropped and only then is the encoded array allocated and filled from the spilled codes, one chunk 
+		at a time. Peak memory is one chunk, the vocabulary with its supports and the output.
+		
+		Values repeated within a transaction count once towards its support, empty values are ignored.
+		
+		Returns the Transaction Encoder (already filtered) and the horizontally encoded array, with collapse_duplicates
+		identical transactions are merged and their transaction weights are returned as a third element
+		
+		With sparse the codes are converted straight into a SparseEncodedTransactions and the dense array is never 
+		allocated
+	'''
+	with tempfile.TemporaryFile() as spill_file:
+		vocabulary = {}
+		supports = np.zeros(0, dtype=np.int64)
+		#(transactions, codes) of every chunk spilled, in file order
+		chunk_sizes = []
+		number_of_transactions = 0
+		
+		with open(file_path, 'r') as input_file:
+			while True:
+				lines = list(itertools.islice(input_file, chunk_size))
+				if not lines:
+					break
+				
+				rows = [[value for value in map(str.strip, line.split(',')) if value] for line in lines]
+				row_lengths = np.fromiter(map(len, rows), dtype=np.int64, count=len(rows))
+				codes = np.fromiter((vocabulary.setdefault(value, len(vocabulary)) for row in rows for value in row), 
+					dtype=np.int64, count=int(row_lengths.sum()))
+				
+				#Collapse repeated values within a transaction so they are only counted once
+				row_ids = np.repeat(np.arange(len(rows), dtype=np.int64), row_lengths)
+				row_ids, codes = np.divmod(_sorted_unique(row_ids * len(vocabulary) + codes), max(len(vocabulary), 1))
+				
+				chunk_supports = np.bincount(codes, minlength=len(vocabulary))
+				chunk_supports[:len(supports)] += supports
+				supports = chunk_supports
+				
+				np.bincount(row_ids, minlength=len(rows)).astype(np.uint32).tofile(spill_file)
+				codes.astype(np.uint32).tofile(spill_file)
+				chunk_sizes.append((len(rows), len(codes)))
+				number_of_transactions += len(rows)
+		
+		#Supports are final, drop infrequent values and renumber the remaining columns in vocabulary order
+		values = list(vocabulary)
+		if number_of_transactions > 0:
+			frequent_codes = np.flatnonzero(supports/number_of_transactions >= min_support_ratio_threshhold)
+		else:
+			frequent_codes = np.zeros(0, dtype=np.int64)
+		column_numbers = np.full(len(values), -1, dtype=np.int64)
+		column_numbers[frequent_codes] = np.arange(len(frequent_codes))
+		
+		transaction_encoder = TransactionalEncoder({values[code]: int(supports[code]) for code in frequent_codes}, number_of_transactions)
+		
+		if sparse:
+			#Codes are sorted within each row and renumbering preserves their order, so the kept columns are already CSR
+			indptr = np.zeros(number_of_transactions + 1, dtype=np.int64)
+			indices = []
+		else:
+			horizontally_encoded_array = np.zeros((number_of_transactions, len(frequent_codes)), dtype=bool)
+		
+		spill_file.seek(0)
+		first_row = 0
+		for chunk_rows, chunk_codes in chunk_sizes:
+			row_lengths = np.fromfile(spill_file, dtype=np.uint32, count=chunk_rows)
+			columns = column_numbers[np.fromfile(spill_file, dtype=np.uint32, count=chunk_codes)]
+			rows = np.repeat(np.arange(first_row, first_row + chunk_rows), row_lengths)
+			
+			frequent_occurrences = columns >= 0
+			if sparse:
+				indptr[first_row + 1:first_row + chunk_rows + 1] = np.bincount(rows[frequent_occurrences] - first_row, minlength=chunk_rows)
+				indices.append(columns[frequent_occurrences].astype(np.int32))
+			else:
+				horizontally_encoded_array[rows[frequent_occurrences], columns[frequent_occurrences]] = True
+			first_row += chunk_rows
+	
+	if sparse:
+		np.cumsum(indptr, out=indptr)
+		horizontally_encoded_array = SparseEncodedTransactions(indptr, np.concatenate(indices) if indices else np.zeros(0, dtype=np.int32), 
+			len(frequent_codes))
+	
+	if collapse_duplicates:
+		return (transaction_encoder,) + collapse_duplicate_transactions(horizontally_encoded_array)
+	return (transaction_encoder, horizontally_encoded_array)
+
+def collapse_duplicate_transactions(horizontally_encoded_array:np.ndarray):
+	'''
+		Merges identical transactions of a horizontally encoded array into one row and counts them
+		
+		Encoding already normalizes value order ({a,b} and {b,a} set the same columns), so duplicates 
+		are found by packing each row into bytes and running np.unique over the packed rows. Rows keep 
+		the order of their first occurrence.
+		
+		Returns the deduplicated array and the per-row transaction weights (duplicate counts)
+		
+		A SparseEncodedTransactions is deduplicated on the bytes of its (sorted) rows instead and stays sparse, 
+		PackedEncodedTransactions are unpacked into the bool array first
+	'''
+	if isinstance(horizontally_encoded_array, SparseEncodedTransactions):
+		return _collapse_duplicate_sparse_transactions(horizontally_encoded_array)
+	horizontally_encoded_array = unpack_encoded_transactions(horizontally_encoded_array)
+	
+	number_of_transactions, number_of_cols = horizontally_encoded_array.shape
+	if number_of_transactions == 0 or number_of_cols == 0:
+		return (horizontally_encoded_array[:min(number_of_transactions, 1)], np.full(min(number_of_transactions, 1), number_of_transactions, dtype=np.int64))
+	
+	packed_rows = np.ascontiguousarray(np.packbits(horizontally_encoded_array, axis=1))
+	row_keys = packed_rows.view(np.dtype((np.void, packed_rows.shape[1]))).ravel()
+	unique_row_keys, first_rows, transaction_weights = np.unique(row_keys, return_index=True, return_counts=True)
+	
+	first_occurrence_order = np.argsort(first_rows)
+	return (horizontally_encoded_array[first_rows[first_occurrence_order]], transaction_weights[first_occurrence_order].astype(np.int64))
+
+def _collapse_duplicate_sparse_transactions(sparse_transactions:SparseEncodedTransactions):
+	'''
+		Sparse rows differ in length, so identical rows are grouped with a dictionary keyed on their packed column 
+		numbers, which keeps the order of first occurrence
+	'''
+	unique_row_numbers = {}
+	first_rows = []
+	transaction_weights = []
+	indptr = sparse_transactions.indptr.tolist()
+	for row, (start, end) in enumerate(zip(indptr[:-1], indptr[1:])):
+		row_key = sparse_transactions.indices[start:end].tobytes()
+		if row_key in unique_row_numbers:
+			transaction_weights[unique_row_numbers[row_key]] += 1
+		else:
+			unique_row_numbers[row_key] = len(first_rows)
+			first_rows.append(row)
+			transaction_weights.append(1)
+	
+	return (sparse_transactions.take_transactions(first_rows), np.array(transaction_weights, dtype=np.int64))
+
 def generate_transactional_encoder_from_collection(iterable_object:Iterable):
 	'''
 		Generates a Transactional Encoder from Python Collection of Transaction Data
@@ -235,13 +866,42 @@ def generate_transactional_encoder_from_collection(iterable_object:Iterable):
 		]
 		##
 	'''
-	unique_value_supports = {}
+	#Values are numbered in order of first appearance, chunk by chunk, and their occurrences counted with np.bincount
+	vocabulary = {}
+	supports = np.zeros(0, dtype=np.int64)
 	number_of_transactions = 0
-	for row in iterable_object:
-		for value in row:
-			if value not in unique_value_supports:
-				unique_value_supports[value] = 0
-			unique_value_supports[value] += 1
-		number_of_transactions += 1
-		
-	return TransactionalEncoder(unique_value_supports, number_of_transactions)
\ No newline at end of file
+	rows_iterator = iter(iterable_object)
+	while True:
+		rows = list(itertools.islice(rows_iterator, _ENCODING_CHUNK_SIZE))
+		if not rows:
+			break
+		for value in dict.fromkeys(itertools.chain.from_iterable(rows)):
+			vocabulary.setdefault(value, len(vocabulary))
+		
+		codes = np.fromiter(map(vocabulary.__getitem__, itertools.chain.from_iterable(rows)), dtype=np.int64, 
+			count=sum(map(len, rows)))
+		chunk_supports = np.bincount(codes, minlength=len(vocabulary))
+		chunk_supports[:len(supports)] += supports
+		supports = chunk_supports
+		number_of_transactions += len(rows)
+		
+	return TransactionalEncoder(dict(zip(vocabulary, supports.tolist())), number_of_transactions)
+
+def minimum_support_count(min_support_ratio:float, number_of_transactions:int) -> int:
+	'''
+		Converts a minimum support ratio into the smallest absolute transaction count that satisfies it
+		
+		Comparing integer counts avoids re-dividing by the transaction count at every node of a search,
+		the count is chosen so that count/number_of_transactions >= min_support_ratio exactly matches
+		the ratio comparison used by the encoders (which is sensitive to float rounding, ex. 0.2 * 10)
+		
+		An itemset must occur in at least one transaction to be considered frequent
+	'''
+	if number_of_transactions == 0:
+		return 1
+	support_count = int(min_support_ratio * number_of_transactions)
+	while support_count > 0 and (support_count - 1)/number_of_transactions >= min_support_ratio:
+		support_count -= 1
+	while support_count/number_of_transactions < min_support_ratio:
+		support_count += 1
+	return max(support_count, 1)